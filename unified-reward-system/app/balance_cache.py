@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import update
+
+from app import db, metrics
+from app.models import User
+from app.merchant_client import fetch_points, FAN_OUT_DEADLINE
+
+# Served without a refresh while younger than FRESH_SECONDS; served and refreshed in the
+# background until STALE_SECONDS; older entries count as misses
+FRESH_SECONDS = 10
+STALE_SECONDS = 300
+MAX_ENTRIES = 100000  # (user, merchant) balances kept per process, least recently used evicted first
+REFRESH_WORKERS = 4
+
+def bump_balances_version(user_ids):
+    """Marks the users' merchant balances as changed; call in the same transaction as the write.
+
+    Every process compares ``User.balances_version`` with the version its
+    cached entries were fetched at, so they all stop serving the old balances.
+    """
+    if user_ids:
+        db.session.execute(update(User).where(User.id.in_(user_ids)).values(balances_version=User.balances_version + 1))
+
+class BalanceCache:
+    """Process-local LRU cache of merchant-reported balances per (user, merchant).
+
+    Entries remember the user's ``balances_version`` they were fetched at;
+    lookups with a newer version treat them as misses.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (user_id, merchant_id) -> (points, fetched_at, balances_version)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self.hits = self.stale_hits = self.misses = 0
+        self.refreshes = self.evictions = 0
+
+    def lookup(self, user_id, merchant_ids, version=0):
+        """Splits ``merchant_ids`` into ``({id: points} fresh, {id: points} stale, [missing ids])``."""
+        now = time.monotonic()
+        fresh, stale, missing = {}, {}, []
+        with self._lock:
+            for merchant_id in merchant_ids:
+                key = (user_id, merchant_id)
+                entry = self._entries.get(key)
+                age = now - entry[1] if entry else None
+                if entry is None or age >= STALE_SECONDS or entry[2] != version:
+                    missing.append(merchant_id)
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(key)
+                if age < FRESH_SECONDS:
+                    fresh[merchant_id] = entry[0]
+                    self.hits += 1
+                else:
+                    stale[merchant_id] = entry[0]
+                    self.stale_hits += 1
+        return fresh, stale, missing
+
+    def store(self, user_id, points, version=0):
+        """Caches ``{merchant_id: points}`` fetched from merchants just now, at the user's ``version``."""
+        now = time.monotonic()
+        with self._lock:
+            for merchant_id, value in points.items():
+                self._entries[(user_id, merchant_id)] = (value, now, version)
+                self._entries.move_to_end((user_id, merchant_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def refresh(self, user_id, phone, merchants, version=0):
+        """Refetches balances in the background; keys already being refreshed are skipped."""
+        with self._lock:
+            merchants = [m for m in merchants if (user_id, m.id) not in self._refreshing]
+            self._refreshing.update((user_id, m.id) for m in merchants)
+            if not merchants:
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="balance-refresh")
+            self.refreshes += 1
+
+        def run():
+            try:
+                self.store(user_id, fetch_points(merchants, phone, FAN_OUT_DEADLINE), version)
+            finally:
+                with self._lock:
+                    self._refreshing.difference_update((user_id, m.id) for m in merchants)
+        return self._executor.submit(run)
+
+    def get(self, user_id, phone, merchants, deadline=FAN_OUT_DEADLINE, version=0):
+        """Merchant balances for one user: cached where possible, misses fetched concurrently.
+
+        Stale entries are returned as they are and refreshed in the background.
+        ``version`` is the user's current ``balances_version``.
+        Returns ``{merchant_id: points}``; merchants that could not be reached are left out.
+        """
+        by_id = {m.id: m for m in merchants}
+        fresh, stale, missing = self.lookup(user_id, by_id, version)
+        if stale:
+            self.refresh(user_id, phone, [by_id[merchant_id] for merchant_id in stale], version)
+        if missing:
+            fetched = fetch_points([by_id[merchant_id] for merchant_id in missing], phone, deadline)
+            self.store(user_id, fetched, version)
+            fresh.update(fetched)
+        return {**stale, **fresh}
+
+    def stats(self):
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / total if total else 0.0,
+            "refreshes": self.refreshes, "evictions": self.evictions, "size": len(self._entries),
+        }
+
+balance_cache = BalanceCache()
+
+metrics.collected("balance_cache_lookups_total", "Balance cache lookups by result (hit, stale, miss).",
+                  lambda: {("hit",): balance_cache.hits, ("stale",): balance_cache.stale_hits,
+                           ("miss",): balance_cache.misses}, ("result",), kind="counter")
+metrics.collected("balance_cache_entries", "Balances held in the cache.", lambda: {(): len(balance_cache._entries)})
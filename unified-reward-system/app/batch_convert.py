@@ -0,0 +1,214 @@
+import hmac
+import json
+import logging
+from collections import defaultdict, namedtuple
+
+from flask import current_app
+from sqlalchemy import bindparam, select, tuple_, update
+
+from app import db, metrics
+from app.database import write_transaction
+from app.models import LiquidityShard, User, UserPoints
+from app.ledger import LOAD_CHUNK, new_entry_id, pool_leg, record, user_leg, apply_user_deltas
+from app.liquidity import split_balance
+from app.merchant_cache import merchant_cache
+from app.merchant_client import chunked
+from app.outbox import queue_point_changes
+from app.quotes import MAX_INSTANT_AMOUNT
+from app.rate_matrix import rate_matrix_cache
+from app.logs import log_event
+
+log = logging.getLogger(__name__)
+
+# Items accepted per request, and items settled per transaction (bounds lock time and lock sets)
+BATCH_MAX_ITEMS = 100000
+BATCH_TRANSACTION_ITEMS = 2000
+MAX_USER_POINTS = 1000000  # Same cap as a single instant exchange
+REASON = 'batch_exchange'
+
+BATCH_ITEMS = metrics.counter("batch_convert_items_total", "Batch conversion items by result.", ("result",))
+
+BatchItem = namedtuple("BatchItem", "index user_id phone from_id to_id amount converted ref")
+
+def batch_authorized(authorization):
+    """True for ``Bearer <BATCH_API_TOKEN>``; batch conversion is off while no token is configured."""
+    token = current_app.config.get("BATCH_API_TOKEN")
+    if not token or not authorization or not authorization.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(authorization[len("Bearer "):].encode(), token.encode())
+
+def read_ndjson(lines):
+    """One item per non-empty line; lines that are not JSON become ``None`` and fail validation."""
+    items = []
+    for line in lines:
+        if line.strip():
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+    return items
+
+def _result(item_or_index, ref=None, **fields):
+    if isinstance(item_or_index, BatchItem):
+        item_or_index, ref = item_or_index.index, item_or_index.ref
+    result = {"index": item_or_index, **fields}
+    if ref is not None:
+        result["ref"] = ref
+    return result
+
+def _validate(index, raw, snapshot, rates):
+    """A BatchItem (user not resolved yet) or an error result for one request item."""
+    if not isinstance(raw, dict):
+        return _result(index, error="Each item must be a JSON object.")
+    ref = raw.get("ref")
+    from_merchant, to_merchant = raw.get("from_merchant"), raw.get("to_merchant")
+    if not from_merchant or not to_merchant or raw.get("amount") is None:
+        return _result(index, ref, error="Invalid request. Missing merchant or amount.")
+    if raw.get("user_id") is None and not raw.get("phone"):
+        return _result(index, ref, error="Missing user_id or phone.")
+    from_merchant, to_merchant = snapshot.by_name.get(from_merchant), snapshot.by_name.get(to_merchant)
+    if not from_merchant or not to_merchant:
+        return _result(index, ref, error="Invalid merchants selected.")
+    if from_merchant.id == to_merchant.id:
+        return _result(index, ref, error="Cannot convert to the same merchant.")
+    try:
+        amount = int(raw["amount"])
+        user_id = int(raw["user_id"]) if raw.get("user_id") is not None else None
+    except (TypeError, ValueError):
+        return _result(index, ref, error="Amount and user_id must be integers.")
+    if amount <= 0:
+        return _result(index, ref, error="Amount must be greater than 0")
+    if amount > MAX_INSTANT_AMOUNT:
+        return _result(index, ref, error="Amount must be less than 1000 points for instant exchange.")
+
+    pair = (from_merchant.id, to_merchant.id)
+    if pair not in rates:  # One rate lookup per merchant pair
+        rates[pair] = rate_matrix_cache.matrix().direct_rate(*pair)
+    converted = min(int(round(amount * rates[pair])), amount * 2)
+    return BatchItem(index, user_id, raw.get("phone"), from_merchant.id, to_merchant.id, amount, converted, ref)
+
+def _resolve_users(items):
+    """Fills in ``user_id`` from ``phone`` (or checks the given id); unknown users come back as errors."""
+    ids, phones = set(), set()
+    for item in items:
+        if item.user_id is not None:
+            ids.add(item.user_id)
+        else:
+            phones.add(item.phone)
+    known_ids, by_phone = set(), {}
+    for chunk in chunked(ids, LOAD_CHUNK):
+        known_ids.update(user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(chunk)))
+    for chunk in chunked(phones, LOAD_CHUNK):
+        by_phone.update(db.session.query(User.phone, User.id).filter(User.phone.in_(chunk)))
+
+    resolved, errors = [], []
+    for item in items:
+        user_id = item.user_id if item.user_id in known_ids else by_phone.get(item.phone) if item.user_id is None else None
+        if user_id is None:
+            errors.append(_result(item, error="Unknown user."))
+        else:
+            resolved.append(item._replace(user_id=user_id))
+    return resolved, errors
+
+def _lock_user_points(keys):
+    """``{(user_id, merchant_id): points}`` for existing rows, locked until commit."""
+    points = {}
+    for chunk in chunked(sorted(keys), LOAD_CHUNK):
+        rows = db.session.execute(
+            select(UserPoints.user_id, UserPoints.merchant_id, UserPoints.points)
+            .where(tuple_(UserPoints.user_id, UserPoints.merchant_id).in_(chunk)).with_for_update()
+        )
+        for user_id, merchant_id, value in rows:
+            points[(user_id, merchant_id)] = value or 0
+    return points
+
+@write_transaction()
+def _settle(items):
+    """Applies ``items`` in order inside one transaction; returns their results.
+
+    Balances and pool shards are read once (locked) and every item is checked
+    in order against the running totals in memory, with the same rules as
+    ``pool_swap``. Accepted items are then written with one statement per table.
+    """
+    balances = _lock_user_points({(i.user_id, m) for i in items for m in (i.from_id, i.to_id)})
+    shards = defaultdict(list)
+    for shard_id, merchant_id, balance in db.session.execute(
+        select(LiquidityShard.id, LiquidityShard.merchant_id, LiquidityShard.balance)
+        .where(LiquidityShard.merchant_id.in_({m for i in items for m in (i.from_id, i.to_id)}))
+        .order_by(LiquidityShard.merchant_id, LiquidityShard.shard)
+        .with_for_update()
+    ):
+        shards[merchant_id].append((shard_id, balance))
+    pools = {merchant_id: sum(balance for _, balance in rows) for merchant_id, rows in shards.items()}
+
+    user_deltas, pool_deltas, user_legs, pool_legs, results = defaultdict(int), defaultdict(int), [], [], []
+    for item in items:
+        from_key, to_key = (item.user_id, item.from_id), (item.user_id, item.to_id)
+        if from_key not in balances or balances[from_key] + user_deltas[from_key] < item.amount:
+            results.append(_result(item, error="Insufficient points for exchange."))
+        elif balances.get(to_key, 0) + user_deltas[to_key] + item.converted > MAX_USER_POINTS:
+            results.append(_result(item, error="Maximum points limit reached for target merchant."))
+        elif item.from_id not in pools or pools[item.from_id] + pool_deltas[item.from_id] < item.amount:
+            results.append(_result(item, error="Insufficient liquidity. Please try Smart Exchange."))
+        elif item.to_id not in pools:
+            results.append(_result(item, error="No liquidity pool for the target merchant."))
+        else:
+            user_deltas[from_key] -= item.amount
+            user_deltas[to_key] += item.converted
+            pool_deltas[item.from_id] -= item.amount
+            pool_deltas[item.to_id] += item.converted
+            entry_id = new_entry_id()  # One journal entry per item, as for a single exchange
+            user_legs += [{**user_leg(item.user_id, item.from_id, -item.amount, REASON), "entry_id": entry_id},
+                          {**user_leg(item.user_id, item.to_id, item.converted, REASON), "entry_id": entry_id}]
+            pool_legs += [{**pool_leg(item.from_id, -item.amount, REASON), "entry_id": entry_id},
+                          {**pool_leg(item.to_id, item.converted, REASON), "entry_id": entry_id}]
+            results.append(_result(item, success=True, converted_amount=item.converted))
+
+    if user_legs:
+        apply_user_deltas(user_deltas, existing=balances)
+        record(user_legs + pool_legs)  # Grouped by account: alternating NULL user_ids would split the bulk INSERT
+        # Shards are locked, so the new totals are re-spread evenly instead of debiting shard by shard
+        shard_table = LiquidityShard.__table__
+        db.session.execute(
+            update(shard_table).where(shard_table.c.id == bindparam("shard_id")).values(balance=bindparam("new_balance")),
+            [{"shard_id": shard_id, "new_balance": balance}
+             for merchant_id, delta in pool_deltas.items() if delta
+             for (shard_id, _), balance in zip(shards[merchant_id],
+                                               split_balance(pools[merchant_id] + delta, len(shards[merchant_id])))]
+        )
+        queue_point_changes([(user_id, merchant_id, delta) for (user_id, merchant_id), delta in user_deltas.items()])
+    db.session.commit()
+    return results
+
+def convert_batch(raw_items):
+    """Instant exchanges for many users at once; returns one result per item, in input order.
+
+    Items are ``{"user_id" or "phone", "from_merchant", "to_merchant", "amount", "ref"?}``
+    and convert at the direct rate. All items are validated first, then settled
+    ``BATCH_TRANSACTION_ITEMS`` per transaction. Each result has the item's ``index``
+    (and ``ref``), plus either ``success`` and ``converted_amount`` or ``error``.
+    """
+    snapshot, rates = merchant_cache.snapshot(), {}
+    results, items = [], []
+    for index, raw in enumerate(raw_items):
+        checked = _validate(index, raw, snapshot, rates)
+        (items if isinstance(checked, BatchItem) else results).append(checked)
+    items, errors = _resolve_users(items)
+    results += errors
+
+    for chunk in chunked(items, BATCH_TRANSACTION_ITEMS):
+        try:
+            results += _settle(chunk)
+        except Exception as e:
+            db.session.rollback()
+            log.error(f"❌ Batch conversion transaction failed: {e}")
+            results += [_result(item, error="Transaction failed. Please try again.") for item in chunk]
+    if items:
+        rate_matrix_cache.invalidate_pools()
+
+    results.sort(key=lambda result: result["index"])
+    succeeded = sum(1 for result in results if result.get("success"))
+    BATCH_ITEMS.inc("success", amount=succeeded)
+    BATCH_ITEMS.inc("error", amount=len(results) - succeeded)
+    log_event(log, logging.INFO, "✅ batch_convert", items=len(results), succeeded=succeeded)
+    return results
@@ -1,5 +1,6 @@
 import math
 from datetime import datetime,timezone
+import numpy as np
 
 def calculate_bpv(merchant_redemption_value, msf, sdbf):
     # Clamp the factors to prevent extreme values
@@ -23,6 +24,23 @@ def update_sdbf(current_sdbf, supply, demand):
     sdbf_change = (ratio - 1) * sensitivity
     return max(0.5, min(1.5, current_sdbf + sdbf_change))
 
+# Array versions of the formulas above, applied to every merchant at once
+
+def calculate_bpv_array(redemption_value, msf, sdbf):
+    msf = np.clip(msf, 0.8, 1.2)
+    sdbf = np.clip(sdbf, 0.8, 1.2)
+    return np.clip(redemption_value * msf * sdbf, 0.1, 2.0)
+
+def update_msf_array(current_msf, trade_volume):
+    sensitivity = 0.01
+    return np.clip(current_msf + np.log(trade_volume + 1) * sensitivity, 0.5, 1.5)
+
+def update_sdbf_array(current_sdbf, supply, demand):
+    sensitivity = 0.1
+    safe_supply = np.where(supply > 0, supply, 1)
+    ratio = np.where(supply > 0, demand / safe_supply, 1.0)
+    return np.clip(current_sdbf + (ratio - 1) * sensitivity, 0.5, 1.5)
+
 class MerchantBPV:
     def __init__(self, name, redemption_value):
         self.name = name
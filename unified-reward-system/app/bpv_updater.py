@@ -1,26 +1,86 @@
 from app import db
+from app.database import write_transaction
 from app.models import Merchant
-from app.bpv_calculator import update_msf, update_sdbf, calculate_bpv
+from app.bpv_calculator import calculate_bpv, calculate_bpv_array, update_msf_array, update_sdbf_array
+from app.merchant_cache import bump_merchant_version
 from datetime import datetime,timezone
+from sqlalchemy import bindparam, select, update
+import numpy as np
 
+# Hours between BPV updates of a merchant
+UPDATE_INTERVAL_HOURS = 24
+
+def load_bpv_factors():
+    """Loads the BPV factor columns of every merchant as NumPy arrays."""
+    table = Merchant.__table__
+    rows = db.session.execute(select(
+        table.c.id, table.c.redemption_value, table.c.msf, table.c.sdbf,
+        table.c.supply, table.c.demand, table.c.trade_volume, table.c.last_update
+    )).all()
+
+    def column(index, default):
+        return np.array([default if row[index] is None else row[index] for row in rows], dtype=float)
+
+    return {
+        "id": np.array([row[0] for row in rows], dtype=np.int64),
+        "redemption_value": column(1, 0.0),
+        "msf": column(2, 1.0),
+        "sdbf": column(3, 1.0),
+        "supply": column(4, 1000),
+        "demand": column(5, 1000),
+        "trade_volume": column(6, 0),
+        # ✅ Naive datetimes from SQLite are UTC
+        "last_update": np.array([
+            (row[7].replace(tzinfo=timezone.utc) if row[7].tzinfo is None else row[7]).timestamp() if row[7] else 0.0
+            for row in rows
+        ]),
+    }
+
+def compute_bpv_updates(factors, now):
+    """Applies the MSF/SDBF/BPV formulas to all merchants due for an update.
+
+    Returns ``(due_mask, msf, sdbf, bpv)`` where the arrays hold new values for every row.
+    """
+    hours = (now.timestamp() - factors["last_update"]) / 3600
+    due = hours >= UPDATE_INTERVAL_HOURS
+    msf = np.where(due, update_msf_array(factors["msf"], factors["trade_volume"]), factors["msf"])
+    sdbf = np.where(due, update_sdbf_array(factors["sdbf"], factors["supply"], factors["demand"]), factors["sdbf"])
+    bpv = calculate_bpv_array(factors["redemption_value"], msf, sdbf)
+    return due, msf, sdbf, bpv
+
+@write_transaction()
 def update_merchant_bpv():
-    """Updates BPV (Business Point Value) for each merchant dynamically."""
-    merchants = Merchant.query.all()
-    for merchant in merchants:
-        if merchant.last_update.tzinfo is None:  # ✅ Convert naive datetime to UTC
-          merchant.last_update = merchant.last_update.replace(tzinfo=timezone.utc)
-
-        time_since_update = (datetime.now(timezone.utc) - merchant.last_update).total_seconds() / 3600  # ✅ Fixed
-
-        if time_since_update >= 24:
-            merchant.msf = update_msf(merchant.msf, merchant.trade_volume, time_since_update)
-            merchant.sdbf = update_sdbf(merchant.sdbf, merchant.supply, merchant.demand)
-            merchant.trade_volume = 0
-            merchant.last_update = datetime.now(timezone.utc)
-            merchant.bpv = calculate_bpv(merchant.redemption_value, merchant.msf, merchant.sdbf)  # ✅ Store BPV in DB
-    
+    """Updates BPV (Business Point Value) for every merchant in bulk.
+
+    Factors are loaded as column arrays, updated with vectorized formulas and
+    only the merchants that were due are written back with one bulk UPDATE.
+    Returns the number of merchants updated.
+    """
+    now = datetime.now(timezone.utc)
+    factors = load_bpv_factors()
+    if not len(factors["id"]):
+        return 0
+
+    due, msf, sdbf, bpv = compute_bpv_updates(factors, now)
+    indexes = np.flatnonzero(due)
+    rows = [
+        {"merchant_id": int(merchant_id), "new_msf": float(m), "new_sdbf": float(s), "new_bpv": float(b)}
+        for merchant_id, m, s, b in zip(factors["id"][indexes], msf[indexes], sdbf[indexes], bpv[indexes])
+    ]
+    if rows:
+        # Core executemany: one statement, no per-row ORM bookkeeping
+        table = Merchant.__table__
+        db.session.execute(
+            update(table).where(table.c.id == bindparam("merchant_id")).values(
+                msf=bindparam("new_msf"), sdbf=bindparam("new_sdbf"), bpv=bindparam("new_bpv"),
+                trade_volume=0, last_update=now
+            ),
+            rows
+        )
+        bump_merchant_version()  # ✅ Cached BPVs are stale in every process
     db.session.commit()  # ✅ Save all updates
+    return len(rows)
 
 def get_merchant_bpv(merchant):
     """Returns the Business Point Value (BPV) of a given merchant."""
-    return calculate_bpv(merchant.redemption_value, merchant.msf, merchant.sdbf)
\ No newline at end of file
+    return calculate_bpv(merchant.redemption_value, merchant.msf, merchant.sdbf)
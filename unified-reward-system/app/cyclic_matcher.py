@@ -1,45 +1,453 @@
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import logging
+import multiprocessing
+import os
+import time
+from sqlalchemy import tuple_, update
+from sqlalchemy.orm.attributes import set_committed_value
 from app import db
-from app.models import UserPoints, Merchant
+from app.models import UserPoints, SmartExchange
+from app.merchant_cache import get_merchant_bpvs
+from app.sql_stats import count_statements
+from app.outbox import queue_point_changes
+from app.ledger import apply_user_deltas, new_entry_id, record, user_leg
+from app import metrics
 
-def find_exchange_cycles(pending_exchanges):
-    """Finds cycles in Smart Exchange requests and optimizes trade execution."""
-    graph = defaultdict(list)
-    merchant_bpvs = {m.id: m.bpv for m in Merchant.query.all()}  # ✅ Fetch BPV once
+# Upper bound on negative-cycle improvement rounds per matching run
+MAX_IMPROVEMENT_ROUNDS = 200
+# (user_id, merchant_id) pairs per balance lookup, stays under SQLite's bound-parameter limit
+SETTLEMENT_CHUNK = 400
+# Components larger than this many merchants are matched in groups first, then as a whole on what is left
+MAX_PARTITION_MERCHANTS = 64
+# Worker processes for partitioned matching, and the smallest graph (in edges) worth sending to them:
+# below it, shipping the partitions to the workers costs more than matching them here
+MATCH_PROCESSES = int(os.environ.get("MATCH_PROCESSES", os.cpu_count() or 1))
+PARALLEL_MIN_EDGES = int(os.environ.get("MATCH_PARALLEL_MIN_EDGES", 2000))
 
-    for exchange in pending_exchanges:
-        graph[exchange.from_merchant_id].append((exchange.to_merchant_id, exchange, merchant_bpvs[exchange.from_merchant_id]))
+_process_pool, _pool_workers = None, 0
+_pool_failed = False  # Once the pool fails, partitions are matched serially in this process
 
-    cycles = []
-    for start in graph:
-        stack = [(start, [])]
+MATCH_RUNS = metrics.counter("matcher_runs_total", "find_exchange_cycles runs.")
+MATCH_ORDERS = metrics.counter("matcher_orders_scanned_total", "Pending orders scanned by the matcher.")
+MATCH_CYCLES = metrics.counter("matcher_cycles_found_total", "Exchange cycles found.")
+MATCH_VOLUME = metrics.counter("matcher_volume_cleared_total", "Points cleared by found cycles, summed over their legs.")
+MATCH_SECONDS = metrics.histogram("matcher_run_duration_seconds", "Time to find the cycles of one run.")
+SETTLE_SECONDS = metrics.histogram("matcher_settle_duration_seconds", "Time to settle the cycles of one run.")
+
+def _record_match(orders, cycles, started):
+    MATCH_RUNS.inc()
+    MATCH_ORDERS.inc(amount=orders)
+    MATCH_CYCLES.inc(amount=len(cycles))
+    MATCH_VOLUME.inc(amount=sum(cycle[0][2] * len(cycle) for cycle in cycles))  # Legs share one fill
+    MATCH_SECONDS.observe(time.perf_counter() - started)
+
+def build_order_book(pending_exchanges):
+    """Groups pending orders into FIFO ``[exchange, unfilled]`` queues and capacities per merchant edge."""
+    queues = defaultdict(deque)
+    capacity = defaultdict(int)
+    ordered = sorted(pending_exchanges, key=lambda e: (e.created_at is None, e.created_at or 0, e.id or 0))
+    for exchange in ordered:
+        if exchange.amount <= 0 or exchange.from_merchant_id == exchange.to_merchant_id:
+            continue
+        edge = (exchange.from_merchant_id, exchange.to_merchant_id)
+        queues[edge].append([exchange, exchange.amount])
+        capacity[edge] += exchange.amount
+    return queues, capacity
+
+def _adjacency(edges):
+    adjacency = defaultdict(list)
+    for u, v in edges:
+        adjacency[u].append(v)
+    return adjacency
+
+def _find_positive_cycle(adjacency, residual):
+    """Iterative DFS returning one cycle (list of edges) with positive residual, or None."""
+    state = {}  # node -> 1 while on the DFS stack, 2 once finished
+    for root in list(adjacency):
+        if root in state:
+            continue
+        stack = [(root, iter(adjacency[root]))]
+        path = [root]
+        state[root] = 1
         while stack:
-            node, path = stack.pop()
-            for neighbor, exchange, bpv in graph[node]:
-                if neighbor == start and len(path) > 1:
-                    cycles.append(path + [(exchange, bpv)])
-                elif neighbor not in path:
-                    stack.append((neighbor, path + [(exchange, bpv)]))
+            node, neighbors = stack[-1]
+            advanced = False
+            for neighbor in neighbors:
+                if residual[(node, neighbor)] <= 0:
+                    continue
+                if state.get(neighbor) == 1:
+                    loop = path[path.index(neighbor):] + [neighbor]
+                    return list(zip(loop, loop[1:]))
+                if neighbor not in state:
+                    state[neighbor] = 1
+                    stack.append((neighbor, iter(adjacency[neighbor])))
+                    path.append(neighbor)
+                    advanced = True
+                    break
+            if not advanced:
+                state[node] = 2
+                stack.pop()
+                path.pop()
+    return None
+
+def _find_negative_residual_cycle(nodes, capacity, flow):
+    """Bellman-Ford over the residual graph (forward cost -1, backward cost +1).
+
+    A negative cycle means some matched volume can be re-routed so that more
+    order volume clears overall. Returns the cycle as (u, v, direction) arcs.
+    """
+    arcs = []
+    for (u, v), cap in capacity.items():
+        if flow[(u, v)] < cap:
+            arcs.append((u, v, -1, 1))
+        if flow[(u, v)] > 0:
+            arcs.append((v, u, 1, -1))
+
+    distance = {node: 0 for node in nodes}
+    parent = {}
+    last = None
+    for _ in range(len(nodes)):
+        last = None
+        for u, v, cost, direction in arcs:
+            if distance[u] + cost < distance[v]:
+                distance[v] = distance[u] + cost
+                parent[v] = (u, direction)
+                last = v
+        if last is None:
+            return None
+
+    # Walk back |V| steps to land inside the cycle, then collect it
+    node = last
+    for _ in range(len(nodes)):
+        if node not in parent:
+            return None
+        node = parent[node][0]
+    cycle, current = [], node
+    while True:
+        prev, direction = parent[current]
+        cycle.append((prev, current, direction))
+        current = prev
+        if current == node:
+            break
+    cycle.reverse()
+    return cycle
+
+def max_circulation(capacity, max_rounds=MAX_IMPROVEMENT_ROUNDS, initial=None):
+    """Computes a high-volume circulation on the merchant flow graph.
+
+    Greedy cycle cancelling saturates at least one edge per cycle, so it runs in
+    O(E * (V + E)). A bounded number of Bellman-Ford rounds then re-route flow
+    along negative residual cycles to raise the total cleared volume further.
+    ``initial`` is a circulation to start from (e.g. merged partition results).
+    """
+    flow = defaultdict(int, initial or {})
+    residual = defaultdict(int, {edge: amount - flow[edge] for edge, amount in capacity.items()})
+    adjacency = _adjacency(capacity)
+
+    cycle = _find_positive_cycle(adjacency, residual)
+    while cycle:
+        bottleneck = min(residual[edge] for edge in cycle)
+        for edge in cycle:
+            residual[edge] -= bottleneck
+            flow[edge] += bottleneck
+        cycle = _find_positive_cycle(adjacency, residual)
+
+    nodes = {node for edge in capacity for node in edge}
+    for _ in range(max_rounds):
+        cycle = _find_negative_residual_cycle(nodes, capacity, flow)
+        if not cycle:
+            break
+        bottleneck = min(
+            capacity[(u, v)] - flow[(u, v)] if direction == 1 else flow[(v, u)]
+            for u, v, direction in cycle
+        )
+        for u, v, direction in cycle:
+            if direction == 1:
+                flow[(u, v)] += bottleneck
+            else:
+                flow[(v, u)] -= bottleneck
+
+    return {edge: amount for edge, amount in flow.items() if amount > 0}
+
+def decompose_circulation(flow):
+    """Splits an edge circulation into simple merchant cycles with their volume."""
+    remaining = dict(flow)
+    outgoing = defaultdict(set)
+    for u, v in remaining:
+        outgoing[u].add(v)
+
+    cycles = []
+    for start in list(outgoing):
+        while outgoing[start]:
+            path, seen = [start], {start: 0}
+            node = start
+            while True:
+                node = next(iter(outgoing[node]))
+                if node in seen:
+                    loop = path[seen[node]:] + [node]
+                    break
+                seen[node] = len(path)
+                path.append(node)
+            edges = list(zip(loop, loop[1:]))
+            volume = min(remaining[edge] for edge in edges)
+            for u, v in edges:
+                remaining[(u, v)] -= volume
+                if remaining[(u, v)] == 0:
+                    outgoing[u].discard(v)
+            cycles.append((edges, volume))
     return cycles
 
-def execute_cycle(cycle):
-    """Executes a matched exchange cycle based on the minimum trade amount."""
-    min_amount = min(exchange.amount for exchange, _ in cycle)
-    
-    for exchange, bpv in cycle:
-        exchange.amount -= min_amount
-        if exchange.amount == 0:
-            exchange.status = 'completed'
-
-        # ✅ Update user balances based on BPV
-        user_points_from = UserPoints.query.filter_by(user_id=exchange.user_id, merchant_id=exchange.from_merchant_id).first()
-        user_points_to = UserPoints.query.filter_by(user_id=exchange.user_id, merchant_id=exchange.to_merchant_id).first()
-
-        if user_points_from and user_points_from.points >= min_amount:
-            user_points_from.points -= min_amount
-            if user_points_to:
-                user_points_to.points += int(min_amount * bpv)  # ✅ Convert based on BPV
+def strongly_connected_components(edges):
+    """Tarjan's algorithm, iterative; returns a list of node sets."""
+    adjacency = _adjacency(edges)
+    index, low, on_stack, stack, components = {}, {}, set(), [], []
+    for root in list(adjacency):
+        if root in index:
+            continue
+        work = [(root, iter(adjacency[root]))]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, neighbors = work[-1]
+            advanced = False
+            for neighbor in neighbors:
+                if neighbor not in index:
+                    index[neighbor] = low[neighbor] = len(index)
+                    stack.append(neighbor)
+                    on_stack.add(neighbor)
+                    work.append((neighbor, iter(adjacency.get(neighbor, ()))))
+                    advanced = True
+                    break
+                if neighbor in on_stack:
+                    low[node] = min(low[node], index[neighbor])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                low[work[-1][0]] = min(low[work[-1][0]], low[node])
+            if low[node] == index[node]:
+                component = set()
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.add(member)
+                    if member == node:
+                        break
+                components.append(component)
+    return components
+
+def _merchant_groups(component, capacity):
+    """Splits a large component into groups of at most ``MAX_PARTITION_MERCHANTS``, in BFS order so groups stay connected."""
+    adjacency = _adjacency(edge for edge in capacity if edge[0] in component and edge[1] in component)
+    order, seen = [], set()
+    for start in sorted(component):
+        if start in seen:
+            continue
+        seen.add(start)
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for neighbor in adjacency.get(node, ()):
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    queue.append(neighbor)
+    return [set(order[i:i + MAX_PARTITION_MERCHANTS]) for i in range(0, len(order), MAX_PARTITION_MERCHANTS)]
+
+def partition_capacity(capacity):
+    """Splits the merchant graph into independent matching problems.
+
+    Only edges inside a strongly connected component can be part of a cycle, so
+    each component is matched on its own. Components above
+    ``MAX_PARTITION_MERCHANTS`` are split into merchant groups. Returns
+    ``(parts, oversized)``: capacity dicts to match, and the oversized
+    components' capacities, refined as a whole once their groups are matched.
+    """
+    parts, oversized = [], []
+    for component in strongly_connected_components(capacity):
+        if len(component) < 2:
+            continue
+        inside = {edge: amount for edge, amount in capacity.items() if edge[0] in component and edge[1] in component}
+        if len(component) <= MAX_PARTITION_MERCHANTS:
+            parts.append(inside)
+            continue
+        oversized.append(inside)
+        for group in _merchant_groups(component, inside):
+            group_edges = {edge: amount for edge, amount in inside.items() if edge[0] in group and edge[1] in group}
+            if group_edges:
+                parts.append(group_edges)
+    return parts, oversized
+
+def get_process_pool(workers=None):
+    """The process's matching pool with ``workers`` processes (default ``MATCH_PROCESSES``).
+
+    Workers are spawned, not forked: the web and scheduler processes run
+    threads, and a fork would copy whatever locks they hold at that moment.
+    """
+    global _process_pool, _pool_workers
+    workers = workers or MATCH_PROCESSES
+    if _process_pool is not None and _pool_workers != workers:
+        _process_pool.shutdown(wait=False)
+        _process_pool = None
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _pool_workers = workers
+    return _process_pool
+
+def partitioned_circulation(capacity, processes=None):
+    """``max_circulation`` per partition, in a process pool when the graph is large, merged into one flow."""
+    global _pool_failed
+    processes = MATCH_PROCESSES if processes is None else processes
+    parts, oversized = partition_capacity(capacity)
+    flows = None
+    if processes > 1 and not _pool_failed and len(parts) > 1 and sum(len(part) for part in parts) >= PARALLEL_MIN_EDGES \
+            and not multiprocessing.current_process().daemon:  # Daemonic (e.g. Celery prefork) workers cannot have children
+        try:
+            flows = list(get_process_pool(processes).map(max_circulation, parts))
+        except Exception as e:
+            _pool_failed = True
+            logging.warning(f"⚠️ Process pool unavailable, matching partitions serially: {e}")
+    if flows is None:
+        flows = [max_circulation(part) for part in parts]
+
+    flow = defaultdict(int)
+    for part_flow in flows:
+        for edge, amount in part_flow.items():
+            flow[edge] += amount
+    # Cycles crossing group borders: refine each oversized component as a whole, starting from its groups' flow
+    for component in oversized:
+        refined = max_circulation(component, initial={edge: flow[edge] for edge in component if flow[edge]})
+        for edge in component:
+            flow[edge] = refined.get(edge, 0)
+    return {edge: amount for edge, amount in flow.items() if amount > 0}
+
+def find_exchange_cycles(pending_exchanges, merchant_bpvs=None):
+    """Finds cycles in Smart Exchange requests and optimizes trade execution.
+
+    Orders are aggregated into a merchant-to-merchant flow graph and cleared as a
+    max-circulation problem, so run time depends on the number of merchant pairs
+    rather than on the number of simple cycles between individual orders. The
+    graph is partitioned into strongly connected components, matched in
+    parallel (see ``partitioned_circulation``).
+    Each returned cycle is a list of ``(exchange, bpv, fill)`` legs that all
+    clear the same ``fill`` amount; orders are filled oldest first.
+    """
+    started = time.perf_counter()
+    queues, capacity = build_order_book(pending_exchanges)
+    if not capacity:
+        _record_match(len(pending_exchanges), [], started)
+        return []
+
+    if merchant_bpvs is None:
+        merchant_bpvs = get_merchant_bpvs()  # ✅ Cached BPV, no merchant query
+
+    cycles = []
+    for edges, volume in decompose_circulation(partitioned_circulation(capacity)):
+        while volume > 0:
+            heads = [queues[edge][0] for edge in edges]
+            fill = min(volume, min(left for _, left in heads))
+
+            cycle = []
+            for edge, head in zip(edges, heads):
+                exchange = head[0]
+                head[1] -= fill
+                if head[1] == 0:
+                    queues[edge].popleft()
+                cycle.append((exchange, merchant_bpvs[exchange.from_merchant_id], fill))
+            cycles.append(cycle)
+            volume -= fill
+    _record_match(len(pending_exchanges), cycles, started)
+    return cycles
+
+def settle_cycles(cycles):
+    """Settles every matched cycle of a run in one transaction.
+
+    The ``UserPoints`` rows involved are locked with one ``IN ... FOR UPDATE``
+    query per chunk. A cycle settles only if every leg's user still holds the
+    points; otherwise none of its legs are filled. Balances move by relative
+    deltas (one bulk UPDATE, one bulk INSERT), together with the SmartExchange
+    fill updates, one ledger INSERT (one journal entry per cycle) and the
+    merchant outbox entries for the net change per (user, merchant).
+    Returns per-run statement counts and timings.
+    """
+    legs = [leg for cycle in cycles for leg in cycle]
+    with count_statements() as counter:
+        keys = set()
+        for exchange, _, _ in legs:
+            keys.add((exchange.user_id, exchange.from_merchant_id))
+            keys.add((exchange.user_id, exchange.to_merchant_id))
+
+        balances = {}
+        keys = list(keys)
+        for i in range(0, len(keys), SETTLEMENT_CHUNK):
+            chunk = keys[i:i + SETTLEMENT_CHUNK]
+            # Locked: other transactions moving these balances wait until this one commits
+            rows = db.session.query(UserPoints.user_id, UserPoints.merchant_id, UserPoints.points) \
+                .filter(tuple_(UserPoints.user_id, UserPoints.merchant_id).in_(chunk)).with_for_update().all()
+            for row in rows:
+                balances[(row.user_id, row.merchant_id)] = row.points or 0
+        existing = set(balances)
+
+        fills, deltas, ledger_legs, rejected = {}, defaultdict(int), [], 0
+        for cycle in cycles:
+            # ✅ All or nothing: a leg whose user is short would leave the others unbalanced
+            debits = defaultdict(int)
+            for exchange, _, fill in cycle:
+                debits[(exchange.user_id, exchange.from_merchant_id)] += fill
+            if any(balances.get(key, 0) < debit for key, debit in debits.items()):
+                rejected += 1
+                continue
+
+            entry_id = new_entry_id()  # One journal entry per cycle
+            for exchange, bpv, fill in cycle:
+                if exchange.id not in fills:
+                    fills[exchange.id] = [exchange, exchange.amount]
+                fills[exchange.id][1] -= fill
+
+                # ✅ Update user balances based on BPV
+                from_key = (exchange.user_id, exchange.from_merchant_id)
+                to_key = (exchange.user_id, exchange.to_merchant_id)
+                received = int(fill * bpv)  # ✅ Convert based on BPV
+                balances[from_key] -= fill
+                balances[to_key] = balances.get(to_key, 0) + received
+                deltas[from_key] -= fill
+                deltas[to_key] += received
+                ledger_legs.append({**user_leg(*from_key, -fill, 'smart_exchange', exchange.id), "entry_id": entry_id})
+                ledger_legs.append({**user_leg(*to_key, received, 'smart_exchange', exchange.id), "entry_id": entry_id})
+
+        apply_user_deltas(deltas, existing)
+        settled = [(exchange, amount, 'completed' if amount == 0 else exchange.status)
+                   for exchange, amount in fills.values()]
+        if settled:
+            now = datetime.now(timezone.utc)
+            db.session.execute(update(SmartExchange), [
+                {"id": exchange.id, "amount": amount, "status": status,
+                 "completed_at": now if status == 'completed' else None}
+                for exchange, amount, status in settled
+            ])
+        record(ledger_legs)
+        queue_point_changes((user_id, merchant_id, change) for (user_id, merchant_id), change in deltas.items())
+        db.session.commit()
+
+        # Reflect the bulk-written fills on the objects the caller holds
+        for exchange, amount, status in settled:
+            if exchange in db.session:
+                set_committed_value(exchange, "amount", amount)
+                set_committed_value(exchange, "status", status)
             else:
-                db.session.add(UserPoints(user_id=exchange.user_id, merchant_id=exchange.to_merchant_id, points=int(min_amount * bpv)))
+                exchange.amount, exchange.status = amount, status
 
-    db.session.commit()
+    stats = {"cycles": len(cycles) - rejected, "rejected": rejected, "legs": len(legs), **counter.as_dict()}
+    SETTLE_SECONDS.observe(stats["seconds"])
+    if rejected:
+        logging.warning(f"⚠️ {rejected} matched cycles not settled: a user no longer holds the points")
+    logging.info(f"✅ Settled {stats['cycles']} cycles ({stats['legs']} legs) "
+                 f"in {stats['statements']} statements, {stats['seconds']:.3f}s")
+    return stats
+
+def execute_cycle(cycle):
+    """Executes a single matched exchange cycle."""
+    return settle_cycles([cycle])
@@ -0,0 +1,85 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Used when DATABASE_URL is not set: a local SQLite file in the instance folder
+DEFAULT_DATABASE_URL = "sqlite:///rewards.db"
+
+# Server databases (PostgreSQL): connections kept per process and how long to wait for one
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 10))
+POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))  # Seconds; stays under server idle timeouts
+
+# SQLite: seconds a writer waits for the lock, and whether write transactions take it up front
+SQLITE_BUSY_TIMEOUT = int(os.environ.get("SQLITE_BUSY_TIMEOUT", 30))
+SQLITE_BEGIN_IMMEDIATE = os.environ.get("SQLITE_BEGIN_IMMEDIATE", "1") != "0"
+
+def database_url():
+    url = os.environ.get("DATABASE_URL", DEFAULT_DATABASE_URL)
+    if url.startswith("postgres://"):  # Heroku-style URLs; SQLAlchemy only accepts postgresql://
+        url = "postgresql://" + url[len("postgres://"):]
+    return url
+
+def engine_options(url):
+    """``SQLALCHEMY_ENGINE_OPTIONS`` for the given database URL."""
+    if make_url(url).get_backend_name() == "sqlite":
+        return {"connect_args": {"timeout": SQLITE_BUSY_TIMEOUT}}
+    return {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": True,  # Drop connections the server closed instead of failing a request
+    }
+
+_intent = threading.local()
+
+@contextmanager
+def write_transaction():
+    """Transactions begun inside (in this thread) take SQLite's write lock up front.
+
+    Wrap work that reads and then writes: a deferred transaction that has read
+    cannot wait for the lock, it fails with "database is locked" once another
+    writer has committed (SQLite ignores ``with_for_update()``). A transaction
+    the session still has open is committed first, so the next one begins
+    immediate. Works as a decorator too; no-op for other backends.
+    """
+    from app import db
+    outer = getattr(_intent, "writing", False)
+    if not outer:
+        db.session.commit()  # Ends a deferred read transaction; nothing to do without one
+    _intent.writing = True
+    try:
+        yield
+    finally:
+        _intent.writing = outer
+
+def configure_engine(engine, begin_immediate=SQLITE_BEGIN_IMMEDIATE):
+    """Per-connection setup for SQLite: WAL journal, relaxed fsync and immediate write transactions.
+
+    WAL lets readers run while one writer commits. Transactions begun inside
+    ``write_transaction()`` start with ``BEGIN IMMEDIATE``, so a concurrent
+    read-then-write waits on the busy timeout; all others stay deferred and
+    only take the lock if they write, so readers never queue behind writers.
+    No-op for other backends, which lock rows themselves.
+    """
+    if engine.dialect.name != "sqlite" or engine.url.database in (None, "", ":memory:"):
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if begin_immediate:
+            dbapi_connection.isolation_level = None  # pysqlite must not emit its own BEGIN
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    if begin_immediate:
+        @event.listens_for(engine, "begin")
+        def begin_transaction(connection):
+            connection.exec_driver_sql("BEGIN IMMEDIATE" if getattr(_intent, "writing", False) else "BEGIN")
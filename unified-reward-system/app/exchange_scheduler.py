@@ -0,0 +1,270 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func
+
+from app import db
+from app.database import write_transaction
+from app.models import SmartExchange
+from app.cyclic_matcher import find_exchange_cycles, settle_cycles
+from app.merchant_cache import get_merchant_bpvs
+from app.order_book import get_order_book, reset_order_book
+from app.rate_matrix import rate_matrix_cache
+from app.single_flight import get_flight
+from app.smart_router import choose_route
+
+# Pending orders older than this stop waiting for a counterparty and spill over to the liquidity pools
+ORDER_TTL_SECONDS = 15 * 60
+# Cadence of the scheduled run, and how long a submission-triggered run waits so a burst shares it
+MATCH_INTERVAL_SECONDS = 5
+MATCH_DEBOUNCE_SECONDS = 1
+LOCK_WAIT_SECONDS = 60  # A queued run waits this long for an active one to finish
+# Cadence runs with no new orders only spill over; orders earlier runs left pending (e.g. a user
+# short of points then) are matched again this often
+RESCAN_INTERVAL_SECONDS = 60
+SPILLOVER_BATCH_SIZE = 200  # Expired orders settled against the pools per run
+FILL_LATENCY_SAMPLE = 500  # Most recent fills the latency percentiles are computed over
+FLIGHT_NAME = "smart_exchange_matching"
+
+last_run = {}
+_last_full_match = 0.0  # time.monotonic() of this process's last run over every pending order
+
+def _utc_naive(moment):
+    """Stored DateTimes come back naive (UTC); compare like with like."""
+    return moment.astimezone(timezone.utc).replace(tzinfo=None) if moment.tzinfo else moment
+
+def request_matching():
+    """Called once per submitted order, after it is committed.
+
+    Marks the queue dirty and queues one debounced run unless a run is already
+    queued, in which case this order rides along with it. At most one run is
+    queued and one active, across processes. Returns whether a task was queued.
+    """
+    flight = get_flight(FLIGHT_NAME)
+    try:
+        flight.mark_dirty()
+        flight.incr("requested")
+        if not flight.try_queue():
+            flight.incr("coalesced")
+            return False
+    except Exception as e:  # The order is stored; the next cadence run matches it
+        logging.warning(f"⚠️ Could not coordinate Smart Exchange matching: {e}")
+        return False
+    try:
+        from app.tasks import process_smart_exchanges
+        process_smart_exchanges.apply_async(countdown=MATCH_DEBOUNCE_SECONDS)
+    except Exception as e:
+        flight.clear_queued()  # Nothing is queued after all; the next submission tries again
+        logging.warning(f"⚠️ Could not queue Smart Exchange matching: {e}")
+        return False
+    flight.incr("enqueued")
+    return True
+
+def run_scheduled(queued=False, wait=0):
+    """Single-flight scheduler run; returns its stats, or None if another run held the lock.
+
+    ``queued`` runs (the Celery task) free the queued slot once they hold the
+    lock, so orders submitted from then on queue a follow-up run, and match
+    only the orders submitted since the last run through the incremental order
+    book (``match_new_orders``). Cadence runs spill over expired orders; they
+    match every pending order only when orders arrived that no queued run
+    picked up, or every ``RESCAN_INTERVAL_SECONDS`` so orders a previous run
+    left are retried without waiting for a new submission.
+    """
+    flight = get_flight(FLIGHT_NAME)
+    try:
+        acquired = flight.acquire(wait)
+    except Exception as e:  # Redis unreachable: nothing can be queued either, and only the leader runs the cadence
+        logging.warning(f"⚠️ Could not coordinate Smart Exchange matching: {e}")
+        return None if queued else run_matching()
+    if not acquired:
+        flight.incr("skipped_busy")
+        if queued:
+            flight.clear_queued()  # Dirty stays set, so the next run still matches
+        return None
+    try:
+        if queued:
+            flight.clear_queued()
+        dirty = flight.take_dirty()
+        rescan = not queued and not dirty and time.monotonic() - _last_full_match >= RESCAN_INTERVAL_SECONDS
+        stats = match_new_orders() if queued and dirty else None
+        if stats is None:
+            stats = run_matching(match=dirty or rescan)
+        else:
+            flight.incr("incremental_runs")
+        flight.incr("runs")
+        flight.incr("matching_runs" if dirty else "rescan_runs" if rescan else "spillover_runs")
+        return stats
+    finally:
+        flight.release()
+
+@write_transaction()
+def match_new_orders():
+    """Matches the orders submitted since the last run through the process's order book.
+
+    Only the new orders and the cycles they close are read and locked, so the
+    work does not grow with the number of resting orders. Returns the run's
+    stats, or None when this process has no book yet or the book no longer
+    matches the database; the caller then matches all pending orders instead.
+    """
+    book = get_order_book()
+    if book is None:
+        return None
+    started_at = book.last_id
+    new_orders = SmartExchange.query.filter(SmartExchange.status == 'pending', SmartExchange.id > book.last_id) \
+        .order_by(SmartExchange.id).all()
+    book_cycles = []
+    for exchange in new_orders:
+        book_cycles.extend(book.feed(exchange))
+    stats = {"pending": len(new_orders), "cycles": 0, "filled": 0, "incremental": True}
+    if not book_cycles:
+        db.session.commit()
+        last_run.update(stats, finished_at=datetime.now(timezone.utc).isoformat())
+        return stats
+
+    needed = {}
+    for cycle in book_cycles:
+        for order, fill in cycle:
+            needed[order.id] = needed.get(order.id, 0) + fill
+    rows = {
+        row.id: row
+        for row in SmartExchange.query.filter(SmartExchange.id.in_(needed)).with_for_update().all()
+    }
+    # The book is a cache of pending rows; if another process filled any of them, match from the database
+    if any(order_id not in rows or rows[order_id].status != 'pending' or rows[order_id].amount < fill
+           for order_id, fill in needed.items()):
+        logging.warning("⚠ Order book out of sync with the database. Matching all pending orders.")
+        db.session.rollback()
+        reset_order_book()
+        return None
+
+    merchant_bpvs = get_merchant_bpvs()
+    try:
+        settled = settle_cycles([
+            [(rows[order.id], merchant_bpvs[order.from_merchant_id], fill) for order, fill in cycle]
+            for cycle in book_cycles
+        ])
+    except Exception:
+        # The book already consumed these fills; rebuild it and feed the new orders again next run
+        db.session.rollback()
+        reset_order_book(started_at)
+        raise
+    if settled["rejected"]:
+        reset_order_book()  # The book filled cycles the database did not; the cadence run retries them
+
+    stats["cycles"] = settled["cycles"]
+    stats["filled"] = sum(row.status == 'completed' for row in rows.values())
+    last_run.update(stats, finished_at=datetime.now(timezone.utc).isoformat())
+    logging.info(f"✅ Smart Exchange incremental run: {stats}")
+    return stats
+
+def spill_over(now):
+    """Fills expired orders from the liquidity pools, oldest first and smaller first among equals.
+
+    Uses the direct rate, and only where ``choose_route`` would route the amount
+    instantly; other expired orders (or users short of points) are marked ``expired``.
+    Returns ``(spilled, expired)``.
+    """
+    from app.exchange_utils import pool_swap
+    cutoff = now - timedelta(seconds=ORDER_TTL_SECONDS)
+    orders = SmartExchange.query.filter(SmartExchange.status == 'pending', SmartExchange.created_at <= cutoff) \
+        .order_by(SmartExchange.created_at, SmartExchange.amount, SmartExchange.id) \
+        .limit(SPILLOVER_BATCH_SIZE).with_for_update().all()
+    if not orders:
+        return 0, 0
+
+    rate_matrix = rate_matrix_cache.matrix()
+    balances = rate_matrix.pool_balances
+    spilled = expired = 0
+    for order in orders:
+        from_id, to_id, amount = order.from_merchant_id, order.to_merchant_id, order.amount
+        error = "Insufficient liquidity."
+        if choose_route(amount, balances.get(from_id, 0) or 0, balances.get(to_id, 0) or 0) == 'instant':
+            converted = min(int(round(amount * rate_matrix.direct_rate(from_id, to_id))), amount * 2)
+            try:
+                with db.session.begin_nested():
+                    error = pool_swap(order.user_id, from_id, to_id, amount, converted, reason='smart_spillover')
+            except Exception as e:  # The savepoint is rolled back; the order just expires
+                error = str(e)
+        if error:
+            order.status = 'expired'
+            expired += 1
+            logging.info(f"⌛ Smart Exchange {order.id} expired unfilled: {error}")
+        else:
+            order.status, order.amount, order.completed_at = 'completed', 0, now
+            spilled += 1
+    db.session.commit()
+    if spilled:
+        rate_matrix_cache.invalidate_pools()
+    return spilled, expired
+
+@write_transaction()
+def run_matching(now=None, match=True):
+    """One scheduler run: clears cycles among all pending orders, then spills expired ones to the pools.
+
+    Orders left pending wait for the next run instead of being failed, and leave
+    the queue at the latest after ``ORDER_TTL_SECONDS``. With ``match=False``
+    only the spillover runs. Returns the run's stats.
+    """
+    global _last_full_match
+    now = now or datetime.now(timezone.utc)
+    if match:
+        _last_full_match = time.monotonic()
+    stats = {"pending": 0, "cycles": 0, "filled": 0, "spilled": 0, "expired": 0}
+    pending = SmartExchange.query.filter_by(status='pending').with_for_update().all() if match else []
+    stats["pending"] = len(pending)
+    if pending:
+        cycles = find_exchange_cycles(pending)
+        if cycles:
+            matched = {order.id: order for cycle in cycles for order, _, _ in cycle}
+            settle_cycles(cycles)  # Sets the new status on the matched orders
+            stats["cycles"] = len(cycles)
+            stats["filled"] = sum(order.status == 'completed' for order in matched.values())
+        db.session.commit()
+
+    stats["spilled"], stats["expired"] = spill_over(now)
+    if match:
+        # Every order up to the newest one seen here is matched; the book takes over from there
+        reset_order_book(max((order.id for order in pending), default=0))
+    elif stats["spilled"] or stats["expired"]:
+        reset_order_book()  # The pending set changed behind the incremental book's back
+
+    last_run.update(stats, incremental=False, finished_at=now.isoformat())
+    if stats["cycles"] or stats["spilled"] or stats["expired"]:
+        logging.info(f"✅ Smart Exchange run: {stats}")
+    return stats
+
+def scheduler_metrics(now=None):
+    """Queue depth, age of the oldest pending order, fill latency percentiles over recent fills
+    and trigger counters (submissions, tasks enqueued, runs executed; None if Redis is unreachable)."""
+    now = _utc_naive(now or datetime.now(timezone.utc))
+    depth, oldest = db.session.query(func.count(SmartExchange.id), func.min(SmartExchange.created_at)) \
+        .filter(SmartExchange.status == 'pending').one()
+    fills = db.session.query(SmartExchange.created_at, SmartExchange.completed_at) \
+        .filter(SmartExchange.completed_at.isnot(None)) \
+        .order_by(SmartExchange.completed_at.desc()).limit(FILL_LATENCY_SAMPLE).all()
+    latencies = sorted(
+        (_utc_naive(completed_at) - _utc_naive(created_at)).total_seconds()
+        for created_at, completed_at in fills if created_at
+    )
+
+    try:
+        triggers = get_flight(FLIGHT_NAME).counters()
+    except Exception as e:  # Redis unreachable: the queue metrics above are still worth serving
+        logging.warning(f"⚠️ Smart Exchange trigger counters unavailable: {e}")
+        triggers = None
+
+    def percentile(q):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * q / 100))], 3) if latencies else None
+
+    return {
+        "queue_depth": depth,
+        "oldest_pending_seconds": round((now - _utc_naive(oldest)).total_seconds(), 3) if oldest else None,
+        "fill_latency_p50_seconds": percentile(50),
+        "fill_latency_p95_seconds": percentile(95),
+        "fills_sampled": len(latencies),
+        "order_ttl_seconds": ORDER_TTL_SECONDS,
+        "last_run": dict(last_run),
+        "triggers": triggers,  # None while the counters cannot be read
+    }
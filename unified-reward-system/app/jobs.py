@@ -0,0 +1,64 @@
+import atexit
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from app import metrics
+from app.bpv_updater import update_merchant_bpv
+from app.exchange_scheduler import run_scheduled, MATCH_INTERVAL_SECONDS
+from app.leader import LEASE_RENEW_SECONDS, LeaderLease
+from app.outbox import dispatch_outbox
+from app.reconciliation import reconcile, reconcile_changes
+from app.rebalance_liquidity import rebalance_liquidity
+from app.sync_utils import sync_all_user_points
+
+LEASE_NAME = "scheduler"
+
+# (job, interval seconds): run by whichever process holds the scheduler lease
+PERIODIC_JOBS = [
+    (rebalance_liquidity, 3600),  # Set-based pool rebalance
+    (update_merchant_bpv, 3600),  # Only merchants whose BPV is a day old are written
+    (dispatch_outbox, 2),  # Pushes queued point changes to merchant APIs off the request path
+    (run_scheduled, MATCH_INTERVAL_SECONDS),  # Cadence run: spills over expired orders, matches missed or leftover ones
+    (reconcile_changes, 900),  # Checks the balances the ledger changed since the last run
+    (reconcile, 86400),  # Records balances that differ from the merchants'; resumes an interrupted run
+    (sync_all_user_points, 86400),  # Nightly refresh of every balance from the merchants' batch endpoints
+]
+
+def _leader_only(app, lease, job):
+    def run():
+        if lease.is_leader():
+            # A context per run: an idle open transaction would hold SQLite's write lock
+            with app.app_context():
+                job()
+    run.__name__ = job.__name__
+    return run
+
+def start_scheduler(app, lease=None):
+    """Schedules the periodic jobs in this process; they only run while it holds the lease.
+
+    Every web worker calls this, and every one of them keeps trying to take the
+    lease, so exactly one process runs the jobs and another takes over within
+    the lease TTL if it dies. Returns ``(scheduler, lease)``.
+    """
+    lease = lease or LeaderLease(LEASE_NAME)
+
+    def renew_lease():
+        with app.app_context():
+            lease.renew()
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(renew_lease, 'interval', seconds=LEASE_RENEW_SECONDS, max_instances=1, coalesce=True)
+    for job, seconds in PERIODIC_JOBS:
+        scheduler.add_job(_leader_only(app, lease, job), 'interval', seconds=seconds, max_instances=1, coalesce=True)
+    renew_lease()  # Elect a leader now rather than one renewal interval from now
+    scheduler.start()
+    metrics.collected("scheduler_leader", "1 while this process holds the scheduler lease.",
+                      lambda: {(): int(lease.is_leader())})
+
+    def stop():
+        scheduler.shutdown()
+        with app.app_context():
+            lease.release()
+
+    atexit.register(stop)  # ✅ Hand over the lease on a clean shutdown
+    return scheduler, lease
@@ -0,0 +1,73 @@
+import logging
+import os
+import socket
+import time
+import uuid
+
+from sqlalchemy import insert, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import SchedulerLease
+
+# The leader renews its lease every LEASE_RENEW_SECONDS; other processes take over once it is LEASE_TTL_SECONDS old
+LEASE_TTL_SECONDS = int(os.environ.get("SCHEDULER_LEASE_SECONDS", 30))
+LEASE_RENEW_SECONDS = max(1, LEASE_TTL_SECONDS // 3)
+
+class LeaderLease:
+    """Leadership among every process sharing the database, held as a renewable lease row.
+
+    Any number of web workers (on any number of nodes) can call ``renew()``;
+    at most one holds the lease at a time. A leader that dies or stops renewing
+    loses it after ``ttl`` seconds.
+    """
+
+    def __init__(self, name, holder=None, ttl=LEASE_TTL_SECONDS):
+        self.name, self.ttl = name, ttl
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until = 0.0  # Monotonic deadline of the lease this process last took
+
+    def is_leader(self):
+        return time.monotonic() < self._valid_until
+
+    def renew(self):
+        """Takes the lease if it is free or expired, or extends ours; returns whether we hold it.
+
+        Needs an app context; commits.
+        """
+        started, now = time.monotonic(), time.time()
+        was_leader = self.is_leader()
+        try:
+            taken = db.session.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.name == self.name,
+                       or_(SchedulerLease.holder == self.holder, SchedulerLease.expires_at < now))
+                .values(holder=self.holder, expires_at=now + self.ttl)
+            ).rowcount == 1
+            if not taken and not db.session.get(SchedulerLease, self.name):
+                db.session.execute(insert(SchedulerLease).values(name=self.name, holder=self.holder, expires_at=now + self.ttl))
+                taken = True
+            db.session.commit()
+        except IntegrityError:  # Another process created the row first
+            db.session.rollback()
+            taken = False
+        except Exception as e:  # Keep what we had until it runs out; the next renewal retries
+            db.session.rollback()
+            logging.warning(f"⚠️ Could not renew the {self.name} lease: {e}")
+            return self.is_leader()
+
+        self._valid_until = started + self.ttl if taken else 0.0
+        if taken != was_leader:
+            logging.info(f"{'✅ Acquired' if taken else '⚠️ Lost'} the {self.name} lease ({self.holder})")
+        return taken
+
+    def release(self):
+        """Gives the lease up so another process can take over without waiting for it to expire."""
+        if not self.is_leader():
+            return
+        self._valid_until = 0.0
+        db.session.execute(
+            update(SchedulerLease).where(SchedulerLease.name == self.name, SchedulerLease.holder == self.holder)
+            .values(expires_at=0)
+        )
+        db.session.commit()
@@ -0,0 +1,153 @@
+import uuid
+from collections import defaultdict
+
+from sqlalchemy import bindparam, func, insert, select, tuple_, update
+
+from app import db
+from app.models import LedgerCursor, LiquidityShard, PointsLedger, UserPoints
+
+USER, POOL = 'user', 'pool'
+# Keys per IN query when loading materialized balances, and rows per cursor read
+LOAD_CHUNK = 400
+LEDGER_PAGE_SIZE = 1000
+
+def user_leg(user_id, merchant_id, delta, reason, exchange_id=None):
+    return {"account": USER, "user_id": user_id, "merchant_id": merchant_id, "delta": delta,
+            "reason": reason, "exchange_id": exchange_id}
+
+def pool_leg(merchant_id, delta, reason):
+    return {"account": POOL, "user_id": None, "merchant_id": merchant_id, "delta": delta,
+            "reason": reason, "exchange_id": None}
+
+def new_entry_id():
+    return uuid.uuid4().hex
+
+def record(legs, entry_id=None):
+    """Appends ``legs`` in one INSERT inside the caller's transaction; returns the rows written.
+
+    Legs without an ``entry_id`` share ``entry_id`` (a new one by default).
+    Zero deltas are dropped.
+    """
+    entry_id = entry_id or new_entry_id()
+    rows = [{**leg, "entry_id": leg.get("entry_id") or entry_id} for leg in legs if leg["delta"]]
+    if rows:
+        db.session.execute(insert(PointsLedger), rows)
+    return len(rows)
+
+def _load_user_points(keys):
+    """``{(user_id, merchant_id): points}`` for the materialized rows that exist."""
+    points, keys = {}, list(keys)
+    for i in range(0, len(keys), LOAD_CHUNK):
+        chunk = keys[i:i + LOAD_CHUNK]
+        for user_id, merchant_id, value in db.session.query(UserPoints.user_id, UserPoints.merchant_id, UserPoints.points) \
+                .filter(tuple_(UserPoints.user_id, UserPoints.merchant_id).in_(chunk)):
+            points[(user_id, merchant_id)] = value or 0
+    return points
+
+def apply_user_deltas(deltas, existing=None):
+    """Adds ``{(user_id, merchant_id): delta}`` to ``UserPoints``: one UPDATE executemany, one INSERT.
+
+    ``existing``: the keys that already have a row, when the caller has loaded them.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    if existing is None:
+        existing = _load_user_points(deltas)
+    table = UserPoints.__table__
+    updates = [{"b_user_id": u, "b_merchant_id": m, "b_delta": d} for (u, m), d in deltas.items() if (u, m) in existing]
+    inserts = [{"user_id": u, "merchant_id": m, "points": d} for (u, m), d in deltas.items() if (u, m) not in existing]
+    if updates:
+        db.session.execute(
+            update(table).where(table.c.user_id == bindparam("b_user_id"), table.c.merchant_id == bindparam("b_merchant_id"))
+            .values(points=table.c.points + bindparam("b_delta")),
+            updates
+        )
+    if inserts:
+        db.session.execute(insert(UserPoints), inserts)
+
+def post(legs, entry_id=None):
+    """Records ``legs`` and materializes the user legs into ``UserPoints``.
+
+    Pool legs are only recorded: their shard debits must be conditional, so
+    callers apply them through ``app.liquidity`` first.
+    """
+    deltas = defaultdict(int)
+    for leg in legs:
+        if leg["account"] == USER:
+            deltas[(leg["user_id"], leg["merchant_id"])] += leg["delta"]
+    apply_user_deltas(deltas)
+    return record(legs, entry_id)
+
+def set_user_balances(balances, reason):
+    """Overwrites ``{(user_id, merchant_id): points}`` with outside values (e.g. merchant APIs).
+
+    The difference to the materialized balance is recorded, so ledger sums stay equal to balances.
+    Returns the number of balances written.
+    """
+    current = _load_user_points(balances)
+    legs = [user_leg(u, m, points - current.get((u, m), 0), reason) for (u, m), points in balances.items()]
+    apply_user_deltas({(leg["user_id"], leg["merchant_id"]): leg["delta"] for leg in legs})
+    record(legs)
+    return len(balances)
+
+def balance_at(user_id, merchant_id, at):
+    """A user's balance at ``at``, summed from the ledger (history starts at the opening balance)."""
+    return db.session.query(func.coalesce(func.sum(PointsLedger.delta), 0)).filter(
+        PointsLedger.account == USER, PointsLedger.user_id == user_id,
+        PointsLedger.merchant_id == merchant_id, PointsLedger.created_at <= at
+    ).scalar()
+
+def pool_balance_at(merchant_id, at):
+    return db.session.query(func.coalesce(func.sum(PointsLedger.delta), 0)).filter(
+        PointsLedger.account == POOL, PointsLedger.user_id.is_(None),
+        PointsLedger.merchant_id == merchant_id, PointsLedger.created_at <= at
+    ).scalar()
+
+def read_ledger(cursor_name, limit=LEDGER_PAGE_SIZE):
+    """Ledger rows after the named cursor, oldest first. Call ``advance_cursor`` once they are handled."""
+    cursor = db.session.get(LedgerCursor, cursor_name)
+    last_id = cursor.last_id if cursor else 0
+    return PointsLedger.query.filter(PointsLedger.id > last_id).order_by(PointsLedger.id).limit(limit).all()
+
+def advance_cursor(cursor_name, last_id):
+    cursor = db.session.get(LedgerCursor, cursor_name)
+    if cursor is None:
+        db.session.add(LedgerCursor(name=cursor_name, last_id=last_id))
+    else:
+        cursor.last_id = max(cursor.last_id, last_id)
+
+def find_drift(user_ids=None):
+    """``[(user_id, merchant_id, materialized, ledger)]`` where UserPoints disagrees with the ledger sum."""
+    ledger = select(PointsLedger.user_id, PointsLedger.merchant_id, func.sum(PointsLedger.delta).label("total")) \
+        .where(PointsLedger.account == USER).group_by(PointsLedger.user_id, PointsLedger.merchant_id)
+    if user_ids is not None:
+        ledger = ledger.where(PointsLedger.user_id.in_(user_ids))
+    ledger = ledger.subquery()
+    query = db.session.query(UserPoints.user_id, UserPoints.merchant_id, UserPoints.points, ledger.c.total) \
+        .outerjoin(ledger, (ledger.c.user_id == UserPoints.user_id) & (ledger.c.merchant_id == UserPoints.merchant_id)) \
+        .filter(func.coalesce(UserPoints.points, 0) != func.coalesce(ledger.c.total, 0))
+    if user_ids is not None:
+        query = query.filter(UserPoints.user_id.in_(user_ids))
+    return [(u, m, points or 0, total or 0) for u, m, points, total in query]
+
+def backfill_opening_balances(connection):
+    """One-off migration: an ``opening_balance`` entry for every balance that has no ledger history."""
+    user_accounts = {(u, m) for u, m in connection.execute(
+        select(PointsLedger.user_id, PointsLedger.merchant_id).where(PointsLedger.account == USER).distinct())}
+    pool_accounts = {m for (m,) in connection.execute(
+        select(PointsLedger.merchant_id).where(PointsLedger.account == POOL).distinct())}
+    entry_id = new_entry_id()
+    rows = [
+        {**user_leg(u, m, points, 'opening_balance'), "entry_id": entry_id}
+        for u, m, points in connection.execute(select(UserPoints.user_id, UserPoints.merchant_id, UserPoints.points))
+        if points and (u, m) not in user_accounts
+    ]
+    rows += [
+        {**pool_leg(m, total, 'opening_balance'), "entry_id": entry_id}
+        for m, total in connection.execute(
+            select(LiquidityShard.merchant_id, func.sum(LiquidityShard.balance)).group_by(LiquidityShard.merchant_id))
+        if total and m not in pool_accounts
+    ]
+    if rows:
+        connection.execute(insert(PointsLedger), rows)
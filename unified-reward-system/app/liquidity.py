@@ -0,0 +1,102 @@
+import random
+
+from sqlalchemy import func, insert, select, update
+
+from app import db
+from app.models import LiquidityPool, LiquidityShard
+
+# Sub-balances per merchant pool; instant exchanges touch one random shard
+POOL_SHARDS = 8
+
+def split_balance(balance, shards=POOL_SHARDS):
+    """Spreads ``balance`` evenly; the remainder goes to shard 0."""
+    share, remainder = divmod(int(balance), shards)
+    return [share + (remainder if shard == 0 else 0) for shard in range(shards)]
+
+def shard_rows(merchant_id, balance, shards=POOL_SHARDS):
+    return [
+        {"merchant_id": merchant_id, "shard": shard, "balance": share}
+        for shard, share in enumerate(split_balance(balance, shards))
+    ]
+
+def pool_balances(merchant_ids=None):
+    """Live pool balances ``{merchant_id: total}``, summed over shards."""
+    query = select(LiquidityShard.merchant_id, func.sum(LiquidityShard.balance)).group_by(LiquidityShard.merchant_id)
+    if merchant_ids is not None:
+        query = query.where(LiquidityShard.merchant_id.in_(merchant_ids))
+    return {merchant_id: int(total or 0) for merchant_id, total in db.session.execute(query)}
+
+def pool_balance(merchant_id):
+    return pool_balances([merchant_id]).get(merchant_id, 0)
+
+def _take(merchant_id, shard, amount):
+    """Atomically debits one shard if it holds ``amount``; no row lock is held beforehand."""
+    result = db.session.execute(
+        update(LiquidityShard)
+        .where(LiquidityShard.merchant_id == merchant_id, LiquidityShard.shard == shard,
+               LiquidityShard.balance >= amount)
+        .values(balance=LiquidityShard.balance - amount)
+    )
+    return result.rowcount == 1
+
+def reserve_liquidity(merchant_id, amount):
+    """Debits ``amount`` from a merchant's pool; returns False if the pool cannot cover it.
+
+    Shards are tried from a random start so concurrent swaps on the same
+    merchant usually update different rows. When no single shard holds the
+    amount, it is drained across shards; a partial drain is put back.
+    """
+    if amount <= 0:
+        return True
+    shards = list(db.session.execute(
+        select(LiquidityShard.shard, LiquidityShard.balance).where(LiquidityShard.merchant_id == merchant_id)
+    ))
+    if not shards:
+        return False
+    start = random.randrange(len(shards))
+    shards = shards[start:] + shards[:start]
+
+    for shard, balance in shards:
+        if balance >= amount and _take(merchant_id, shard, amount):
+            return True
+
+    taken, remaining = [], amount
+    for shard, _ in shards:
+        # Re-read: the snapshot above may be stale under concurrent swaps
+        balance = db.session.execute(
+            select(LiquidityShard.balance)
+            .where(LiquidityShard.merchant_id == merchant_id, LiquidityShard.shard == shard)
+        ).scalar() or 0
+        share = min(balance, remaining)
+        if share > 0 and _take(merchant_id, shard, share):
+            taken.append((shard, share))
+            remaining -= share
+        if remaining == 0:
+            return True
+    for shard, share in taken:
+        _credit_shard(merchant_id, shard, share)
+    return False
+
+def _credit_shard(merchant_id, shard, amount):
+    result = db.session.execute(
+        update(LiquidityShard)
+        .where(LiquidityShard.merchant_id == merchant_id, LiquidityShard.shard == shard)
+        .values(balance=LiquidityShard.balance + amount)
+    )
+    return result.rowcount == 1
+
+def credit_liquidity(merchant_id, amount):
+    """Adds ``amount`` to one random shard of a merchant's pool; False if the merchant has no pool."""
+    if not amount or _credit_shard(merchant_id, random.randrange(POOL_SHARDS), amount):
+        return True
+    return _credit_shard(merchant_id, 0, amount)  # Pool sharded with fewer shards
+
+def shard_existing_pools(connection):
+    """One-off migration: splits each ``LiquidityPool.balance`` that has no shards yet."""
+    sharded = {row[0] for row in connection.execute(select(LiquidityShard.merchant_id).distinct())}
+    rows = []
+    for merchant_id, balance in connection.execute(select(LiquidityPool.merchant_id, LiquidityPool.balance)):
+        if merchant_id not in sharded:
+            rows.extend(shard_rows(merchant_id, balance or 0))
+    if rows:
+        connection.execute(insert(LiquidityShard), rows)
@@ -0,0 +1,29 @@
+import logging
+import os
+import random
+
+# Root log level, and the share of hot-path (per-request) INFO events kept; warnings and errors are always logged
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.01))
+
+def configure_logging(level=LOG_LEVEL):
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+
+def _format(value):
+    text = str(value)
+    return f'"{text}"' if not text or " " in text or '"' in text or "=" in text else text
+
+def log_event(logger, level, event, sample_rate=1.0, **fields):
+    """Logs ``event key=value ...`` at ``level``.
+
+    Below WARNING only ``sample_rate`` of the calls are logged, and those carry
+    ``sample_rate`` so counts can be scaled back up. Nothing is formatted for
+    events that are dropped or below the logger's level.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if level < logging.WARNING and sample_rate < 1:
+        if random.random() >= sample_rate:
+            return
+        fields["sample_rate"] = sample_rate
+    logger.log(level, "%s %s", event, " ".join(f"{key}={_format(value)}" for key, value in fields.items()))
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from sqlalchemy import update
+
+from app import db
+from app.models import Merchant, CacheVersion
+from app.bpv_calculator import calculate_bpv
+
+# How often a process checks the shared version row for writes made elsewhere
+VERSION_CHECK_SECONDS = 5
+VERSION_NAME = "merchants"
+
+class MerchantInfo:
+    """Read-only copy of a Merchant row, usable wherever a Merchant is read."""
+    __slots__ = ("id", "name", "redemption_value", "api_url", "supply", "demand", "msf", "sdbf", "bpv")
+
+    def __init__(self, merchant):
+        self.id = merchant.id
+        self.name = merchant.name
+        self.redemption_value = merchant.redemption_value
+        self.api_url = merchant.api_url
+        self.supply = merchant.supply
+        self.demand = merchant.demand
+        self.msf = merchant.msf if merchant.msf is not None else 1.0
+        self.sdbf = merchant.sdbf if merchant.sdbf is not None else 1.0
+        self.bpv = calculate_bpv(self.redemption_value, self.msf, self.sdbf)
+
+    def __repr__(self):
+        return f"<MerchantInfo {self.id} {self.name}>"
+
+def conversion_rate(from_value, to_value):
+    """Clamped redemption-value rate used by /convert_points."""
+    return min(2.0, max(0.1, (from_value / to_value) if to_value > 0 else 1))
+
+class MerchantSnapshot:
+    """All merchants at one cache version, with lookup maps and pairwise rates."""
+
+    def __init__(self, merchants, version):
+        self.version = version
+        self.merchants = [MerchantInfo(m) for m in merchants]
+        self.by_id = {m.id: m for m in self.merchants}
+        self.by_name = {m.name: m for m in self.merchants}
+        self.bpvs = {m.id: m.bpv for m in self.merchants}
+        self.rates = {
+            (a.id, b.id): conversion_rate(a.redemption_value, b.redemption_value)
+            for a in self.merchants for b in self.merchants if a.id != b.id
+        }
+
+class MerchantCache:
+    """Process-local merchant/BPV cache with versioned invalidation."""
+
+    def __init__(self):
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - self._checked_at < VERSION_CHECK_SECONDS:
+            self.hits += 1
+            return snapshot
+        with self._lock:
+            version = _shared_version()
+            self._checked_at = now
+            if self._snapshot is not None and self._snapshot.version == version:
+                self.hits += 1
+                return self._snapshot
+            self.misses += 1
+            self._snapshot = MerchantSnapshot(Merchant.query.all(), version)
+            return self._snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits, "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "version": self._snapshot.version if self._snapshot else None,
+        }
+
+def _shared_version():
+    row = db.session.get(CacheVersion, VERSION_NAME)
+    return row.version if row else 0
+
+merchant_cache = MerchantCache()
+
+def get_merchants():
+    return merchant_cache.snapshot().merchants
+
+def get_merchant(merchant_id):
+    return merchant_cache.snapshot().by_id.get(merchant_id)
+
+def get_merchant_by_name(name):
+    return merchant_cache.snapshot().by_name.get(name)
+
+def get_merchant_bpvs():
+    return merchant_cache.snapshot().bpvs
+
+def get_conversion_rate(from_merchant_id, to_merchant_id):
+    return merchant_cache.snapshot().rates.get((from_merchant_id, to_merchant_id), 1.0)
+
+def bump_merchant_version():
+    """Marks merchant data as changed; call in the same transaction as the write."""
+    updated = db.session.execute(
+        update(CacheVersion).where(CacheVersion.name == VERSION_NAME).values(version=CacheVersion.version + 1)
+    ).rowcount
+    if not updated:
+        db.session.add(CacheVersion(name=VERSION_NAME, version=1))
+    merchant_cache.invalidate()
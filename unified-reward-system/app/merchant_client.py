@@ -0,0 +1,335 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app import metrics
+
+# Per-call (connect, read) timeout and overall deadline for one fan-out, in seconds
+CALL_TIMEOUT = (2, 5)
+FAN_OUT_DEADLINE = 6
+INTERACTIVE_DEADLINE = 2  # Page loads fall back to DB values after this
+MAX_WORKERS = 32
+# Phones or updates per batch request, and the read timeout allowed for one batch
+BATCH_SIZE = 1000
+BATCH_CALL_TIMEOUT = (2, 30)
+# Circuit breaker: consecutive failures that open it, and seconds until one probe call is let through
+BREAKER_FAILURES = 5
+BREAKER_OPEN_SECONDS = 30
+# Adaptive read timeout: LATENCY_MULTIPLIER x p99 of recent successes, never above the fixed timeout
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+LATENCY_MULTIPLIER = 3
+MIN_READ_TIMEOUT = 0.25
+# Hedged GETs: a second request goes out when the first is slower than this latency percentile
+HEDGE_READS = True
+HEDGE_PERCENTILE = 95
+
+_session = None
+_executor = None
+_hedge_executor = None
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a merchant whose breaker is open."""
+
+class MerchantHealth:
+    """Circuit breaker and recent latencies for one merchant endpoint."""
+
+    def __init__(self, name=None):
+        self.name = name
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.failures = 0  # Consecutive
+        self.opened_at = None
+        self.probing = False
+        self.calls = self.errors = self.rejected = self.hedges = 0
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS:
+                self.probing = True  # Half-open: one trial call decides
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self, seconds):
+        with self._lock:
+            self.calls += 1
+            self.latencies.append(seconds)
+            self.failures, self.opened_at, self.probing = 0, None, False
+
+    def record_failure(self):
+        with self._lock:
+            self.calls += 1
+            self.errors += 1
+            self.failures += 1
+            if self.probing or self.failures >= BREAKER_FAILURES:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def percentile(self, q):
+        """Latency percentile in seconds, or None until enough calls were seen."""
+        samples = sorted(self.latencies)
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+    def read_timeout(self, default):
+        p99 = self.percentile(99)
+        return default if p99 is None else min(default, max(MIN_READ_TIMEOUT, p99 * LATENCY_MULTIPLIER))
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing else "open"
+
+    def stats(self):
+        p50, p99 = self.percentile(50), self.percentile(99)
+        return {"state": self.state, "calls": self.calls, "errors": self.errors, "rejected": self.rejected,
+                "hedges": self.hedges, "p50_ms": p50 and round(p50 * 1000, 1), "p99_ms": p99 and round(p99 * 1000, 1)}
+
+_health = {}
+_health_lock = threading.Lock()
+
+def get_health(merchant):
+    """Health of a merchant's endpoint, shared by every caller in the process."""
+    health = _health.get(merchant.api_url)
+    if health is None:
+        with _health_lock:
+            health = _health.setdefault(merchant.api_url, MerchantHealth(merchant.name))
+    return health
+
+def health_stats():
+    return {api_url: health.stats() for api_url, health in list(_health.items())}
+
+def reset_health():
+    _health.clear()
+
+CALL_DURATION = metrics.histogram("merchant_request_duration_seconds",
+                          "Merchant API call latency by outcome (ok, client_error, server_error, timeout, error).",
+                          ("merchant", "outcome"))
+CALL_ERRORS = metrics.counter("merchant_request_errors_total",
+                      "Failed merchant API calls, including calls refused by an open breaker.", ("merchant", "kind"))
+HEDGED_CALLS = metrics.counter("merchant_hedged_requests_total", "Second copies of slow balance reads.", ("merchant",))
+metrics.collected("merchant_circuit_open", "1 while the merchant's circuit breaker is open or half-open.",
+          lambda: {(health.name,): int(health.opened_at is not None) for health in list(_health.values())},
+          ("merchant",))
+
+def _record_call(merchant, outcome, seconds):
+    CALL_DURATION.observe(seconds, merchant.name, outcome)
+    if outcome not in ("ok", "client_error"):
+        CALL_ERRORS.inc(merchant.name, outcome)
+
+def guarded(merchant, request_fn, timeout=CALL_TIMEOUT, adaptive=True):
+    """Calls ``request_fn(timeout)`` through the merchant's circuit breaker.
+
+    With ``adaptive`` the read timeout follows the merchant's recent p99
+    latency. 4xx responses are the caller's problem and do not count as failures.
+    """
+    health = get_health(merchant)
+    if not health.allow():
+        CALL_ERRORS.inc(merchant.name, "circuit_open")
+        raise CircuitOpenError(f"{merchant.name} circuit open")
+    connect, read = timeout
+    started = time.monotonic()
+    try:
+        result = request_fn((connect, health.read_timeout(read) if adaptive else read))
+    except Exception as e:
+        seconds = time.monotonic() - started
+        outcome = _failed_call_outcome(e)
+        if outcome == "client_error":
+            health.record_success(seconds)
+        else:
+            health.record_failure()
+        _record_call(merchant, outcome, seconds)
+        raise
+    seconds = time.monotonic() - started
+    health.record_success(seconds)
+    _record_call(merchant, "ok", seconds)
+    return result
+
+def _failed_call_outcome(error):
+    import requests
+    if isinstance(error, requests.HTTPError):
+        return "client_error" if error.response is not None and error.response.status_code < 500 else "server_error"
+    return "timeout" if isinstance(error, requests.Timeout) else "error"
+
+def get_session():
+    """Process-wide keep-alive session shared by all merchant calls, made on first use.
+
+    ``requests`` is only imported here, so processes that never call a merchant
+    do not load it. Only refused connections and 502-504 responses are retried;
+    slow reads are handled by adaptive timeouts and hedging rather than by waiting again.
+    """
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        session = requests.Session()
+        retries = Retry(total=1, read=0, backoff_factor=0.1, status_forcelist=[502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS, max_retries=retries)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+    return _session
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="merchant-client")
+    return _executor
+
+def get_hedge_executor():
+    """Separate pool for hedged requests, so calls already running on the main pool never wait on it."""
+    global _hedge_executor
+    if _hedge_executor is None:
+        _hedge_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="merchant-hedge")
+    return _hedge_executor
+
+def fan_out(calls, deadline=FAN_OUT_DEADLINE):
+    """Runs ``{key: callable}`` concurrently and returns ``{key: result or exception}``.
+
+    Calls still running at ``deadline`` are reported as ``TimeoutError``.
+    """
+    executor = get_executor()
+    futures = {executor.submit(fn): key for key, fn in calls.items()}
+    done, not_done = wait(futures, timeout=deadline)
+    results = {}
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            results[futures[future]] = e
+    for future in not_done:
+        future.cancel()
+        results[futures[future]] = TimeoutError(f"no response within {deadline}s")
+    return results
+
+def hedged(merchant, request_fn):
+    """Runs an idempotent read; if it outlasts the merchant's p95 latency, races a second copy.
+
+    Returns the first success, or raises the last error if both fail.
+    """
+    health = get_health(merchant)
+    delay = health.percentile(HEDGE_PERCENTILE) if HEDGE_READS else None
+    if delay is None:
+        return guarded(merchant, request_fn)
+    executor = get_hedge_executor()
+    pending = {executor.submit(guarded, merchant, request_fn)}
+    done, pending = wait(pending, timeout=delay)
+    if not done:
+        health.hedges += 1
+        HEDGED_CALLS.inc(merchant.name)
+        pending.add(executor.submit(guarded, merchant, request_fn))
+    error = None
+    while done or pending:
+        for future in done:
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+        if not pending:
+            break
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+    raise error
+
+def _get_points(merchant, phone):
+    def request(timeout):
+        response = get_session().get(f"{merchant.api_url}/{phone}", timeout=timeout)
+        response.raise_for_status()
+        return response.json().get("points", 0)
+    return hedged(merchant, request)
+
+def post_update(merchant, phone, points_change, idempotency_key=None):
+    def request(timeout):
+        response = get_session().post(
+            f"{merchant.api_url}/update",
+            json={"user_phone": phone, "points_change": points_change},
+            headers={"Idempotency-Key": idempotency_key} if idempotency_key else None,
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json()
+    return guarded(merchant, request)
+
+def fetch_points(merchants, phone, deadline=FAN_OUT_DEADLINE):
+    """Fetches a user's balance from every merchant at once.
+
+    Returns ``{merchant_id: points}``; merchants that failed or timed out are left out.
+    """
+    results = fan_out({m.id: (lambda m=m: _get_points(m, phone)) for m in merchants}, deadline)
+    points = {}
+    for merchant in merchants:
+        result = results[merchant.id]
+        if isinstance(result, Exception):
+            logging.warning(f"⚠️ API fetch failed for {merchant.name}: {result}")
+        else:
+            points[merchant.id] = result
+    return points
+
+def push_points(changes, phone, deadline=FAN_OUT_DEADLINE):
+    """Posts ``[(merchant, points_change)]`` updates concurrently; returns ``{merchant_id: ok}``."""
+    results = fan_out({m.id: (lambda m=m, c=c: post_update(m, phone, c)) for m, c in changes}, deadline)
+    status = {}
+    for merchant, _ in changes:
+        result = results[merchant.id]
+        if isinstance(result, Exception):
+            logging.warning(f"❌ Failed to update {merchant.name}: {result}")
+        status[merchant.id] = not isinstance(result, Exception)
+    return status
+
+def chunked(items, size):
+    """Yields lists of at most ``size`` items from any iterable."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _post_stream(url, body, timeout):
+    response = get_session().post(url, json=body, timeout=timeout, stream=True)
+    response.raise_for_status()
+    return response
+
+def _stream_rows(response):
+    for line in response.iter_lines():
+        if line:
+            yield json.loads(line)
+
+def fetch_points_batch(merchant, phones, batch_size=BATCH_SIZE):
+    """Yields ``(phone, points)`` for many phones, one streamed request per batch.
+
+    Phones the merchant rejects are skipped.
+    """
+    for chunk in chunked(phones, batch_size):
+        response = guarded(merchant, lambda timeout, c=chunk: _post_stream(f"{merchant.api_url}/batch", {"phones": c}, timeout),
+                           BATCH_CALL_TIMEOUT, adaptive=False)
+        for row in _stream_rows(response):
+            if "error" in row:
+                logging.warning(f"⚠️ {merchant.name} rejected {row.get('phone')}: {row['error']}")
+            else:
+                yield row["phone"], row["points"]
+
+def push_points_batch(merchant, updates, batch_size=BATCH_SIZE):
+    """Posts ``[(phone, points_change, idempotency_key)]`` in batches.
+
+    Yields ``(idempotency_key, ok)`` per update in input order.
+    """
+    for chunk in chunked(updates, batch_size):
+        body = {"updates": [
+            {"user_phone": phone, "points_change": change, "idempotency_key": key}
+            for phone, change, key in chunk
+        ]}
+        response = guarded(merchant, lambda timeout: _post_stream(f"{merchant.api_url}/batch/update", body, timeout),
+                           BATCH_CALL_TIMEOUT, adaptive=False)
+        for (_, _, key), row in zip(chunk, _stream_rows(response)):
+            yield key, bool(row.get("success"))
@@ -0,0 +1,191 @@
+import bisect
+import logging
+import os
+import threading
+import time
+
+from flask import request
+from sqlalchemy import event
+
+# Set METRICS_ENABLED=0 to skip the request and SQL hooks entirely
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Histogram bucket upper bounds: latencies in seconds, and statements per request
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+class Counter:
+    """Monotonic count per label values."""
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, values, value) for values, value in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label values."""
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> [per-bucket counts (+Inf last), sum]
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(values, list(counts), total) for values, (counts, total) in self._values.items()]
+        samples = []
+        for values, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", values + (_number(bound),), cumulative))
+            samples.append((f"{self.name}_sum", values, total))
+            samples.append((f"{self.name}_count", values, cumulative))
+        return samples
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+class Collected:
+    """Values read at scrape time from state kept elsewhere (cache stats, breaker states)."""
+
+    def __init__(self, name, help, collect, labels=(), kind="gauge"):
+        self.name, self.help, self.labels, self.kind = name, help, tuple(labels), kind
+        self.collect = collect  # () -> {label values tuple: value}
+
+    def samples(self):
+        return [(self.name, values, value) for values, value in self.collect().items()]
+
+    def reset(self):
+        pass
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+def _register(metric):
+    with _metrics_lock:
+        return _metrics.setdefault(metric.name, metric)
+
+def counter(name, help, labels=()):
+    return _register(Counter(name, help, labels))
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return _register(Histogram(name, help, labels, buckets))
+
+def collected(name, help, collect, labels=(), kind="gauge"):
+    return _register(Collected(name, help, collect, labels, kind))
+
+def reset_metrics():
+    for metric in list(_metrics.values()):
+        metric.reset()
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in list(_metrics.values()):
+        try:
+            samples = metric.samples()
+        except Exception as e:  # A broken collector must not take the whole scrape down
+            logging.warning(f"⚠️ Metric {metric.name} could not be collected: {e}")
+            continue
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        label_names = metric.labels + (("le",) if metric.kind == "histogram" else ())
+        for name, values, value in samples:
+            labels = ",".join(f'{label}="{_escape(v)}"' for label, v in zip(label_names, values))
+            lines.append(f"{name}{{{labels}}} {_number(value)}" if labels else f"{name} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+# Request and SQL metrics
+REQUEST_DURATION = histogram("http_request_duration_seconds", "Request latency by route.", ("route", "method", "status"))
+REQUEST_STATEMENTS = histogram("http_request_db_statements", "SQL statements executed per request by route.",
+                               ("route",), COUNT_BUCKETS)
+REQUEST_DB_SECONDS = histogram("http_request_db_seconds", "Time spent in SQL per request by route.", ("route",))
+DB_STATEMENT_SECONDS = histogram("db_statement_duration_seconds",
+                                 "Latency of single SQL statements, in and out of requests (_count: statements run).")
+
+_request = threading.local()
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+def _start_request():
+    _request.started = time.perf_counter()
+    _request.statements, _request.db_seconds = 0, 0.0
+    _request.status = None
+
+def _note_status(response):
+    _request.status = response.status_code
+    return response
+
+def _finish_request(exc=None):
+    """Records the request at teardown, which also runs when it raised (then without a response: a 500)."""
+    started = getattr(_request, "started", None)
+    if started is not None:
+        route = _route()
+        status = str(_request.status or 500)
+        REQUEST_DURATION.observe(time.perf_counter() - started, route, request.method, status)
+        REQUEST_STATEMENTS.observe(_request.statements, route)
+        REQUEST_DB_SECONDS.observe(_request.db_seconds, route)
+        _request.started = None
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("metrics_started")
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    DB_STATEMENT_SECONDS.observe(seconds)
+    if getattr(_request, "started", None) is not None:  # Attributed to the request this thread serves
+        _request.statements += 1
+        _request.db_seconds += seconds
+
+def instrument_engine(engine):
+    if not event.contains(engine, "before_cursor_execute", _before_execute):
+        event.listen(engine, "before_cursor_execute", _before_execute)
+        event.listen(engine, "after_cursor_execute", _after_execute)
+
+def init_app(app, engine=None):
+    """Times every request and counts its SQL statements (``engine``: the app's, when given)."""
+    if not METRICS_ENABLED:
+        return
+    app.before_request(_start_request)
+    app.after_request(_note_status)
+    app.teardown_request(_finish_request)  # after_request is skipped for unhandled exceptions
+    if engine is not None:
+        instrument_engine(engine)
@@ -7,6 +7,7 @@ class User(db.Model, UserMixin):
     username = db.Column(db.String(50), unique=True, nullable=False)
     password = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(20), unique=True, nullable=False)
+    balances_version = db.Column(db.Integer, nullable=False, default=0)  # Bumped when merchants' balances of the user change
     points = db.relationship('UserPoints', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     smart_exchanges = db.relationship('SmartExchange', backref='user', lazy='dynamic', cascade='all, delete-orphan')
 
@@ -19,6 +20,10 @@ class Merchant(db.Model):
     demand = db.Column(db.Integer, default=1000)  # Adjusted dynamically
     msf = db.Column(db.Float, default=1.0)  # Market Sensitivity Factor
     sdbf = db.Column(db.Float, default=1.0)  # Supply-Demand Balancing Factor
+    trade_volume = db.Column(db.Integer, default=0)  # Points traded since the last BPV update
+    bpv = db.Column(db.Float)  # Last computed Business Point Value
+    rebalanced_supply = db.Column(db.Integer)  # Supply and demand seen by the last liquidity rebalance
+    rebalanced_demand = db.Column(db.Integer)
     last_update = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))  # ✅ Corrected
     liquidity_pool = db.relationship('LiquidityPool', backref='merchant', uselist=False, cascade='all, delete-orphan')
 
@@ -33,6 +38,8 @@ class Merchant(db.Model):
         """Ensure Merchant is created before creating Liquidity Pool"""
         merchant = Merchant(name=name, redemption_value=redemption_value, api_url=api_url)
         db.session.add(merchant)
+        from app.merchant_cache import bump_merchant_version
+        bump_merchant_version()  # ✅ New merchant must show up in every process's cache
         db.session.commit()  # ✅ Commit merchant first to get ID
         
         return merchant
@@ -47,7 +54,15 @@ class UserPoints(db.Model):
 class LiquidityPool(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     merchant_id = db.Column(db.Integer, db.ForeignKey('merchant.id'), nullable=False, unique=True)
-    balance = db.Column(db.Integer, default=0)
+    balance = db.Column(db.Integer, default=0)  # Total as of the last rebalance; live balance is the sum of shards
+
+class LiquidityShard(db.Model):
+    """One of a merchant pool's sub-balances, so concurrent swaps do not share a hot row."""
+    id = db.Column(db.Integer, primary_key=True)
+    merchant_id = db.Column(db.Integer, db.ForeignKey('merchant.id'), nullable=False)
+    shard = db.Column(db.Integer, nullable=False)
+    balance = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.UniqueConstraint('merchant_id', 'shard', name='uix_merchant_shard'),)
     
 class SmartExchange(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -55,10 +70,93 @@ class SmartExchange(db.Model):
     from_merchant_id = db.Column(db.Integer, db.ForeignKey('merchant.id'), nullable=False)
     to_merchant_id = db.Column(db.Integer, db.ForeignKey('merchant.id'), nullable=False)
     amount = db.Column(db.Integer, nullable=False)
-    status = db.Column(db.String(20), default='pending')
+    status = db.Column(db.String(20), default='pending')  # pending, completed, expired, failed
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))  # ✅ Corrected
+    completed_at = db.Column(db.DateTime)  # Set when the last point is filled, for fill latency
     from_merchant = db.relationship('Merchant', foreign_keys=[from_merchant_id])
     to_merchant = db.relationship('Merchant', foreign_keys=[to_merchant_id])
+    __table_args__ = (
+        db.Index('ix_smart_exchange_status_pair', 'status', 'from_merchant_id', 'to_merchant_id'),
+        db.Index('ix_smart_exchange_user_id', 'user_id'),
+        # Partial: the matcher only ever scans pending orders, a small slice of the table
+        db.Index('ix_smart_exchange_pending', 'from_merchant_id', 'to_merchant_id', 'created_at',
+                 postgresql_where=db.text("status = 'pending'"), sqlite_where=db.text("status = 'pending'")),
+        db.Index('ix_smart_exchange_completed_at', 'completed_at'),
+    )
+
+class MerchantOutbox(db.Model):
+    """Pending point changes to push to merchant APIs, written with the balance change."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    merchant_id = db.Column(db.Integer, db.ForeignKey('merchant.id'), nullable=False)
+    points_change = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='pending')  # pending, sending (claimed by a dispatcher), sent, failed
+    batch_key = db.Column(db.String(32))  # Idempotency key, fixed on first dispatch attempt
+    claim_token = db.Column(db.String(32))  # Which dispatcher's claim the row is 'sending' under
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    last_error = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    __table_args__ = (
+        db.Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+        db.Index('ix_outbox_user_id', 'user_id'),  # Undelivered changes per user
+    )
+
+class PointsLedger(db.Model):
+    """Append-only journal of balance changes; UserPoints and pool shards are its materialized totals."""
+    id = db.Column(db.Integer, primary_key=True)
+    account = db.Column(db.String(10), nullable=False)  # 'user' or 'pool'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))  # None for pool entries
+    merchant_id = db.Column(db.Integer, db.ForeignKey('merchant.id'), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(30), nullable=False)
+    exchange_id = db.Column(db.Integer, db.ForeignKey('smart_exchange.id'))
+    entry_id = db.Column(db.String(32), nullable=False)  # Shared by all legs of one transaction
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    __table_args__ = (
+        db.Index('ix_ledger_account', 'account', 'user_id', 'merchant_id', 'id'),
+        db.Index('ix_ledger_created_at', 'created_at'),
+    )
+
+class LedgerCursor(db.Model):
+    """How far a ledger consumer (e.g. incremental reconciliation) has read."""
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+class ReconciliationRun(db.Model):
+    """One pass comparing UserPoints with merchant balances; its checkpoint allows resuming."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), default='full')  # full (keyset pass), incremental (ledger cursor)
+    status = db.Column(db.String(20), default='running')  # running, completed
+    last_user_points_id = db.Column(db.Integer, nullable=False, default=0)  # Checkpoint: keyset position
+    checked = db.Column(db.Integer, nullable=False, default=0)
+    mismatches = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)  # Rows whose merchant could not be reached
+    started_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    finished_at = db.Column(db.DateTime)
+
+class ReconciliationCorrection(db.Model):
+    """A balance that differs between UserPoints and the merchant, found by a reconciliation run."""
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('reconciliation_run.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    merchant_id = db.Column(db.Integer, db.ForeignKey('merchant.id'), nullable=False)
+    local_points = db.Column(db.Integer, nullable=False)  # Minus changes the outbox has not delivered yet
+    merchant_points = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='open')  # open, applied, stale
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+class CacheVersion(db.Model):
+    """Version counters that let every process notice when cached rows changed."""
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class SchedulerLease(db.Model):
+    """Which process runs the periodic jobs, until ``expires_at`` (Unix time) unless renewed."""
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.Float, nullable=False)
 
 from sqlalchemy.event import listens_for
 from sqlalchemy.sql import text
@@ -69,4 +167,11 @@ def create_liquidity_pool(mapper, connection, target):
     connection.execute(
         text("INSERT INTO liquidity_pool (merchant_id, balance) VALUES (:merchant_id, :balance)"),
         {"merchant_id": target.id, "balance": 5000}
-    ) 
\ No newline at end of file
+    )
+    from app.liquidity import shard_rows
+    connection.execute(
+        text("INSERT INTO liquidity_shard (merchant_id, shard, balance) VALUES (:merchant_id, :shard, :balance)"),
+        shard_rows(target.id, 5000)
+    )
+    from app.ledger import new_entry_id, pool_leg
+    connection.execute(PointsLedger.__table__.insert(), {**pool_leg(target.id, 5000, 'opening_balance'), "entry_id": new_entry_id()}) 
\ No newline at end of file
@@ -0,0 +1,198 @@
+import heapq
+from collections import defaultdict, deque
+
+from app.models import SmartExchange
+
+# Upper bound on cycles cleared per inserted order, keeps per-order work bounded
+MAX_CYCLES_PER_INSERT = 64
+
+class BookOrder:
+    """Lightweight in-memory copy of a pending SmartExchange row."""
+    __slots__ = ("id", "user_id", "from_merchant_id", "to_merchant_id", "remaining", "sort_key")
+
+    def __init__(self, id, user_id, from_merchant_id, to_merchant_id, remaining, created_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.from_merchant_id = from_merchant_id
+        self.to_merchant_id = to_merchant_id
+        self.remaining = remaining
+        self.sort_key = (created_at is None, created_at.timestamp() if created_at else 0, id or 0)
+
+    def __lt__(self, other):
+        return self.sort_key < other.sort_key
+
+    @classmethod
+    def from_exchange(cls, exchange):
+        return cls(exchange.id, exchange.user_id, exchange.from_merchant_id,
+                   exchange.to_merchant_id, exchange.amount, exchange.created_at)
+
+class OrderBook:
+    """Incremental Smart Exchange order book keyed by (from_merchant, to_merchant).
+
+    Each edge keeps a heap of unfilled orders (oldest first) and its total open
+    volume. Inserting an order costs O(log n); matching only searches for cycles
+    through the edge that just changed, over the merchant graph, so the work per
+    order does not grow with the size of the book.
+    """
+
+    def __init__(self, max_cycles_per_insert=MAX_CYCLES_PER_INSERT):
+        self.max_cycles_per_insert = max_cycles_per_insert
+        self._queues = defaultdict(list)
+        self._capacity = defaultdict(int)
+        self._successors = defaultdict(set)
+        self._orders = {}
+        self.last_id = 0  # Newest order id matched into the book; newer pending orders still need matching
+        self.loaded_through = 0  # Newest order id loaded when the book was built
+
+    @classmethod
+    def from_pending(cls, exchanges, **kwargs):
+        """Builds a book from pending orders without matching them."""
+        book = cls(**kwargs)
+        for exchange in exchanges:
+            book._insert(BookOrder.from_exchange(exchange))
+            book.loaded_through = max(book.loaded_through, exchange.id or 0)
+        return book
+
+    @classmethod
+    def from_db(cls, **kwargs):
+        """Rebuilds the book from all pending SmartExchange rows."""
+        return cls.from_pending(SmartExchange.query.filter_by(status='pending').all(), **kwargs)
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, exchange_id):
+        return exchange_id in self._orders
+
+    def open_volume(self, from_merchant_id, to_merchant_id):
+        return self._capacity.get((from_merchant_id, to_merchant_id), 0)
+
+    def add(self, exchange):
+        """Inserts a pending order and returns the cycles it completes.
+
+        Cycles are lists of ``(BookOrder, fill)`` legs that all clear ``fill``.
+        """
+        order = BookOrder.from_exchange(exchange)
+        if order.id in self._orders or not self._insert(order):
+            return []
+        return self.match_edge(order.from_merchant_id, order.to_merchant_id)
+
+    def feed(self, exchange):
+        """Matches a pending order newer than ``last_id``; returns the cycles it completes.
+
+        A book rebuilt from the DB may already hold the order, in which case
+        only its edge is matched, or may have filled it since.
+        """
+        self.last_id = max(self.last_id, exchange.id)
+        if exchange.id in self._orders:
+            return self.match_edge(exchange.from_merchant_id, exchange.to_merchant_id)
+        if exchange.id <= self.loaded_through:
+            return []  # Loaded with the book and filled by it since
+        return self.add(exchange)
+
+    def remove(self, exchange_id):
+        """Drops an order from the book (e.g. cancelled or failed elsewhere)."""
+        order = self._orders.pop(exchange_id, None)
+        if order:
+            self._consume_capacity((order.from_merchant_id, order.to_merchant_id), order.remaining)
+            order.remaining = 0  # Lazily discarded when it reaches the heap front
+
+    def match_edge(self, from_merchant_id, to_merchant_id):
+        """Clears cycles passing through one edge of the merchant graph."""
+        edge = (from_merchant_id, to_merchant_id)
+        cycles = []
+        for _ in range(self.max_cycles_per_insert):
+            if self._capacity.get(edge, 0) <= 0:
+                break
+            path = self._shortest_path(to_merchant_id, from_merchant_id)
+            if path is None:
+                break
+            edges = [edge] + list(zip(path, path[1:]))
+            volume = min(self._capacity[e] for e in edges)
+            cycles.extend(self._fill(edges, volume))
+        return cycles
+
+    def _insert(self, order):
+        if order.remaining <= 0 or order.from_merchant_id == order.to_merchant_id:
+            return False
+        edge = (order.from_merchant_id, order.to_merchant_id)
+        heapq.heappush(self._queues[edge], order)
+        self._orders[order.id] = order
+        self._capacity[edge] += order.remaining
+        self._successors[edge[0]].add(edge[1])
+        return True
+
+    def _consume_capacity(self, edge, amount):
+        self._capacity[edge] -= amount
+        if self._capacity[edge] <= 0:
+            del self._capacity[edge]
+            self._successors[edge[0]].discard(edge[1])
+
+    def _shortest_path(self, source, target):
+        """BFS over merchants with open volume; returns the node path or None."""
+        if source == target:
+            return [source]
+        parents = {source: None}
+        frontier = deque([source])
+        while frontier:
+            node = frontier.popleft()
+            for neighbor in self._successors.get(node, ()):
+                if neighbor in parents:
+                    continue
+                parents[neighbor] = node
+                if neighbor == target:
+                    path = [neighbor]
+                    while parents[path[-1]] is not None:
+                        path.append(parents[path[-1]])
+                    return path[::-1]
+                frontier.append(neighbor)
+        return None
+
+    def _head(self, edge):
+        queue = self._queues[edge]
+        while queue[0].remaining <= 0:
+            heapq.heappop(queue)
+        return queue[0]
+
+    def _fill(self, edges, volume):
+        cycles = []
+        while volume > 0:
+            heads = [self._head(edge) for edge in edges]
+            fill = min(volume, min(order.remaining for order in heads))
+            for edge, order in zip(edges, heads):
+                order.remaining -= fill
+                self._consume_capacity(edge, fill)
+                if order.remaining == 0:
+                    heapq.heappop(self._queues[edge])
+                    self._orders.pop(order.id, None)
+            cycles.append([(order, fill) for order in heads])
+            volume -= fill
+        return cycles
+
+_order_book = None
+_matched_through = None  # Newest order id a full matching run saw; pending orders up to it were matched
+
+def get_order_book():
+    """Process-local order book, rebuilt from the DB on first use.
+
+    Returns None until a full matching run in this process has recorded which
+    pending orders it already matched (see ``reset_order_book``).
+    """
+    global _order_book
+    if _order_book is None and _matched_through is not None:
+        _order_book = OrderBook.from_db()
+        _order_book.last_id = _matched_through
+    return _order_book
+
+def reset_order_book(matched_through=None):
+    """Discards the process-local book so the next access rebuilds it.
+
+    ``matched_through`` is the newest order id a full matching run just saw;
+    without it the book keeps the position it had reached.
+    """
+    global _order_book, _matched_through
+    if matched_through is None and _order_book is not None:
+        matched_through = _order_book.last_id
+    _order_book = None
+    if matched_through is not None:
+        _matched_through = matched_through
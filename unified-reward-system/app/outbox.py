@@ -0,0 +1,137 @@
+import logging
+import uuid
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import bindparam, insert, or_, update
+
+from app import db
+from app.database import write_transaction
+from app.models import MerchantOutbox, User
+from app.merchant_cache import merchant_cache
+from app.balance_cache import bump_balances_version
+from app.merchant_client import fan_out, push_points_batch
+
+DISPATCH_BATCH_SIZE = 500
+MERCHANT_BATCH_SIZE = 1000  # Updates per batch request to one merchant
+MAX_ATTEMPTS = 8
+RETRY_BASE_SECONDS = 5
+# Claimed rows stay 'sending' this long; a dispatcher that dies mid-send leaves them to be claimed again after it
+CLAIM_SECONDS = 300
+
+def queue_point_changes(changes):
+    """Adds ``[(user_id, merchant_id, points_change)]`` to the outbox.
+
+    Runs inside the caller's transaction, so the merchant update is recorded
+    if and only if the balance change itself commits.
+    """
+    rows = [
+        {"user_id": user_id, "merchant_id": merchant_id, "points_change": change}
+        for user_id, merchant_id, change in changes if change
+    ]
+    if rows:
+        db.session.execute(insert(MerchantOutbox), rows)
+
+ClaimedRow = namedtuple("ClaimedRow", "id user_id merchant_id points_change batch_key attempts")
+
+@write_transaction()
+def _claim_batch(now, batch_size):
+    """Claims due rows for this dispatcher and fixes an idempotency key per (user, merchant) group.
+
+    Claimed rows are marked ``sending`` under a new claim token until
+    ``CLAIM_SECONDS`` from now, so two dispatchers never send the same rows
+    concurrently (rows locked by another claim are skipped on PostgreSQL;
+    SQLite serializes the claim). Returns the token, plain ``ClaimedRow``
+    copies and ``{user_id: phone}``; nothing stays attached to the session,
+    so no transaction is held open during merchant calls.
+    """
+    rows = MerchantOutbox.query.filter(
+        or_(MerchantOutbox.status == 'pending', MerchantOutbox.status == 'sending'),  # 'sending': an expired claim
+        MerchantOutbox.next_attempt_at <= now
+    ).order_by(MerchantOutbox.id).limit(batch_size).with_for_update(skip_locked=True).all()
+
+    new_keys, token = {}, uuid.uuid4().hex
+    for row in rows:
+        if row.batch_key is None:
+            group = (row.user_id, row.merchant_id)
+            row.batch_key = new_keys.setdefault(group, uuid.uuid4().hex)
+        row.status, row.claim_token, row.next_attempt_at = 'sending', token, now + timedelta(seconds=CLAIM_SECONDS)
+    claimed = [
+        ClaimedRow(row.id, row.user_id, row.merchant_id, row.points_change, row.batch_key, row.attempts)
+        for row in rows
+    ]
+    phones = dict(db.session.query(User.id, User.phone).filter(User.id.in_({r.user_id for r in claimed}))) if claimed else {}
+    db.session.commit()  # Keys must survive a crash mid-dispatch so retries reuse them
+    return token, claimed, phones
+
+def dispatch_outbox(batch_size=DISPATCH_BATCH_SIZE):
+    """Drains one batch of the outbox with one batch request per merchant.
+
+    Rows sharing an idempotency key are summed into a single ``points_change``
+    item of that request and retried together with exponential backoff until ``MAX_ATTEMPTS``.
+    Returns ``{"sent": n, "retried": n, "failed": n}`` counted in rows.
+    """
+    now = datetime.now(timezone.utc)
+    merchants = merchant_cache.snapshot().by_id
+    token, rows, phones = _claim_batch(now, batch_size)
+    stats = {"sent": 0, "retried": 0, "failed": 0}
+    if not rows:
+        return stats
+
+    groups = defaultdict(list)
+    for row in rows:
+        groups[row.batch_key].append(row)
+
+    per_merchant = defaultdict(list)
+    results = {}
+    for key, group in groups.items():
+        change = sum(row.points_change for row in group)
+        if change == 0:
+            results[key] = None  # Deltas cancel out, nothing to tell the merchant
+            continue
+        per_merchant[group[0].merchant_id].append((phones[group[0].user_id], change, key))
+
+    # One streamed batch request per merchant (per MERCHANT_BATCH_SIZE updates), all merchants at once
+    calls = {
+        merchant_id: (lambda m=merchants[merchant_id], u=items: dict(push_points_batch(m, u, MERCHANT_BATCH_SIZE)))
+        for merchant_id, items in per_merchant.items()
+    }
+    delivered = set()  # Users whose balances changed at a merchant
+    for merchant_id, outcome in fan_out(calls).items():
+        for _, _, key in per_merchant[merchant_id]:
+            if isinstance(outcome, Exception):
+                results[key] = outcome
+            elif not outcome.get(key):
+                results[key] = RuntimeError(f"{merchants[merchant_id].name} rejected the update")
+            else:
+                results[key] = None
+                delivered.add(groups[key][0].user_id)
+
+    updates = []
+    for key, group in groups.items():
+        result = results[key]
+        for row in group:
+            if not isinstance(result, Exception):
+                updates.append({"b_id": row.id, "status": 'sent', "attempts": row.attempts, "last_error": None,
+                                "next_attempt_at": now})
+                stats["sent"] += 1
+                continue
+            attempts = (row.attempts or 0) + 1
+            status = 'failed' if attempts >= MAX_ATTEMPTS else 'pending'
+            stats["failed" if status == 'failed' else "retried"] += 1
+            updates.append({
+                "b_id": row.id, "status": status, "attempts": attempts, "last_error": str(result)[:200],
+                "next_attempt_at": now + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (attempts - 1)),
+            })
+
+    # Only rows still under this claim: if it expired, another dispatcher re-claimed them under its own token
+    table = MerchantOutbox.__table__
+    db.session.execute(
+        update(table).where(table.c.id == bindparam("b_id"), table.c.status == 'sending', table.c.claim_token == token),
+        updates
+    )
+    bump_balances_version(delivered)  # Every process's balance cache now refetches these users
+    db.session.commit()
+    if stats["retried"] or stats["failed"]:
+        logging.warning(f"⚠️ Outbox dispatch: {stats}")
+    return stats
@@ -0,0 +1,51 @@
+from app.merchant_cache import merchant_cache
+from app.rate_matrix import rate_matrix_cache
+from app.smart_router import choose_route
+
+# Largest amount /convert_points accepts as an instant exchange
+MAX_INSTANT_AMOUNT = 1000
+
+class QuoteError(ValueError):
+    """Raised for quote requests that cannot be priced."""
+
+def instant_conversion(rate_matrix, from_merchant_id, to_merchant_id, amount):
+    """Converted amount for an instant exchange: the direct rate, capped at twice the amount."""
+    return min(int(round(amount * rate_matrix.direct_rate(from_merchant_id, to_merchant_id))), amount * 2)
+
+def build_quote(from_merchant_name, to_merchant_name, amount):
+    """Prices a conversion from in-memory state only (merchant cache + rate matrix).
+
+    Raises QuoteError for unknown merchants or invalid amounts.
+    """
+    snapshot = merchant_cache.snapshot()
+    from_merchant = snapshot.by_name.get(from_merchant_name)
+    to_merchant = snapshot.by_name.get(to_merchant_name)
+    if not from_merchant or not to_merchant:
+        raise QuoteError("Invalid merchants selected.")
+    try:
+        amount = int(amount)
+    except (TypeError, ValueError):
+        raise QuoteError("Amount must be an integer.")
+    if amount <= 0:
+        raise QuoteError("Amount must be greater than 0")
+
+    rate_matrix = rate_matrix_cache.matrix()
+    from_balance = rate_matrix.pool_balances.get(from_merchant.id, 0) or 0
+    to_balance = rate_matrix.pool_balances.get(to_merchant.id, 0) or 0
+    route = choose_route(amount, from_balance, to_balance)
+    if route == 'instant' and amount > MAX_INSTANT_AMOUNT:
+        route = 'smart'
+
+    quote = {
+        "from_merchant": from_merchant.name,
+        "to_merchant": to_merchant.name,
+        "amount": amount,
+        "route": route,
+        "liquidity": {from_merchant.name: from_balance, to_merchant.name: to_balance},
+    }
+    if route == 'instant':
+        quote["converted_amount"] = instant_conversion(rate_matrix, from_merchant.id, to_merchant.id, amount)
+    else:
+        # Same formula settle_cycles credits a matched order with
+        quote["converted_amount"] = int(amount * snapshot.bpvs[from_merchant.id])
+    return quote
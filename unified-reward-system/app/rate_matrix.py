@@ -0,0 +1,83 @@
+import threading
+import time
+
+import numpy as np
+
+from app.liquidity import pool_balances
+from app.merchant_cache import merchant_cache
+
+# Seconds between pool balance refreshes when nothing invalidated them
+POOL_REFRESH_SECONDS = 5
+
+class RateMatrix:
+    """Pairwise direct and BPV conversion rates over all merchants, for O(1) lookups.
+
+    Instant exchanges only convert directly: every swap debits the source pool
+    and credits the target pool, and legs through other merchants would net
+    out in their pools, so routing through them frees no liquidity. Rates are
+    ratios of redemption values, so a route can only pay more where the
+    direct rate is clamped at its 2x maximum, and conversions are capped there.
+    """
+
+    def __init__(self, snapshot, pool_balances):
+        self.version = snapshot.version
+        self.merchant_ids = [m.id for m in snapshot.merchants]
+        self.index = {merchant_id: i for i, merchant_id in enumerate(self.merchant_ids)}
+        self.pool_balances = dict(pool_balances)
+        n = len(self.merchant_ids)
+
+        self.direct = np.ones((n, n))
+        self.bpv = np.ones((n, n))
+        for (a, b), rate in snapshot.rates.items():
+            self.direct[self.index[a], self.index[b]] = rate
+        bpvs = np.array([m.bpv for m in snapshot.merchants], dtype=float)
+        if n:
+            self.bpv = bpvs[:, None] / np.where(bpvs > 0, bpvs, np.inf)[None, :]
+
+    def direct_rate(self, from_merchant_id, to_merchant_id):
+        return float(self.direct[self.index[from_merchant_id], self.index[to_merchant_id]])
+
+    def bpv_rate(self, from_merchant_id, to_merchant_id):
+        return float(self.bpv[self.index[from_merchant_id], self.index[to_merchant_id]])
+
+class RateMatrixCache:
+    """Keeps one RateMatrix per process, rebuilt when merchant data (rates, BPVs) change."""
+
+    def __init__(self):
+        self._matrix = None
+        self._pools = None
+        self._pools_at = 0.0
+        self._inputs = None
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+
+    def pool_balances(self):
+        now = time.monotonic()
+        if self._pools is None or now - self._pools_at >= POOL_REFRESH_SECONDS:
+            self._pools = pool_balances()
+            self._pools_at = now
+        return self._pools
+
+    def invalidate_pools(self):
+        """Call after a local write to pool shards so the next lookup re-reads balances."""
+        self._pools = None
+
+    def matrix(self):
+        """Current matrix; balance-only changes update its pool balances without a rebuild."""
+        snapshot = merchant_cache.snapshot()
+        pools = self.pool_balances()
+        matrix = self._matrix
+        if matrix is not None and self._inputs is not None and self._inputs[0] is snapshot and self._inputs[1] is pools:
+            return matrix  # Hot path: nothing was refreshed since the last lookup
+        with self._lock:
+            if self._matrix is None or self._matrix.version != snapshot.version:
+                self._matrix = RateMatrix(snapshot, pools)
+                self.rebuilds += 1
+            self._matrix.pool_balances = pools
+            self._inputs = (snapshot, pools)
+            return self._matrix
+
+rate_matrix_cache = RateMatrixCache()
+
+def get_rate_matrix():
+    return rate_matrix_cache.matrix()
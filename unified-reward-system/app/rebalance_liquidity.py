@@ -1,33 +1,115 @@
-from app import db, create_app
-from app.models import LiquidityPool, Merchant
-
-def rebalance_liquidity():
-    """Adjust liquidity pools based on supply-demand every 24 hours."""
-    app = create_app()
-    with app.app_context():
-        merchants = Merchant.query.all()
-        updates = []
-        for merchant in merchants:
-            pool = LiquidityPool.query.filter_by(merchant_id=merchant.id).first()
-            if not pool:
-                continue
-
-            # Prevent division by zero
-            if merchant.supply == 0 or merchant.demand == 0:
-                continue
-
-            # Calculate balance change based on supply-demand ratio
-            ratio = merchant.demand / merchant.supply
-            balance_change = int(min(100, abs(merchant.supply - merchant.demand) * 0.02))
-
-            # Ensure balance remains within valid range
-            new_balance = pool.balance + (balance_change if merchant.supply > merchant.demand else -balance_change)
-            new_balance = max(0, min(1000000, new_balance))  # Ensure balance is between 0 and 1,000,000
-
-            pool.balance = new_balance
-            updates.append(pool)
-
-        if updates:
-            db.session.bulk_save_objects(updates)
-            db.session.commit()
-        print("✅ Liquidity Pools Rebalanced")
\ No newline at end of file
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, case, func, insert, literal, or_, select, update
+
+from app import db
+from app.database import write_transaction
+from app.models import LiquidityPool, LiquidityShard, Merchant, PointsLedger
+from app.ledger import POOL, new_entry_id
+from app.merchant_cache import bump_merchant_version
+from app.sql_stats import count_statements
+
+# A run moves a pool by REBALANCE_PERCENT of the supply-demand gap, at most MAX_REBALANCE_STEP points,
+# and keeps it within [POOL_MIN, POOL_MAX]
+REBALANCE_PERCENT = 2
+MAX_REBALANCE_STEP = 100
+POOL_MIN, POOL_MAX = 0, 1000000
+
+def _clamp(value, low, high):
+    return case((value < low, low), (value > high, high), else_=value)
+
+def _eligible(merchant, incremental):
+    """Merchants with a supply-demand gap; with ``incremental``, only those whose supply or demand changed since the last run."""
+    condition = and_(merchant.c.supply != 0, merchant.c.demand != 0, merchant.c.supply != merchant.c.demand)
+    if incremental:
+        condition = and_(condition, _changed(merchant))
+    return condition
+
+def _changed(merchant):
+    return or_(merchant.c.rebalanced_supply.is_(None), merchant.c.rebalanced_demand.is_(None),
+               merchant.c.supply != merchant.c.rebalanced_supply, merchant.c.demand != merchant.c.rebalanced_demand)
+
+def _eligible_ids(incremental):
+    merchant = Merchant.__table__
+    return select(merchant.c.id).where(_eligible(merchant, incremental))
+
+def rebalance_plan(incremental=False):
+    """``SELECT merchant_id, old_total, new_total, shards`` for every pool the run moves, computed in SQL."""
+    merchant, shard = Merchant.__table__, LiquidityShard.__table__
+    totals = select(shard.c.merchant_id, func.sum(shard.c.balance).label("total"), func.count().label("shards")) \
+        .where(shard.c.merchant_id.in_(_eligible_ids(incremental))).group_by(shard.c.merchant_id).subquery()
+    step = _clamp(func.abs(merchant.c.supply - merchant.c.demand) * REBALANCE_PERCENT // 100, 0, MAX_REBALANCE_STEP)
+    delta = case((merchant.c.supply > merchant.c.demand, step), else_=-step)
+    return select(
+        merchant.c.id.label("merchant_id"),
+        totals.c.total.label("old_total"),
+        _clamp(totals.c.total + delta, POOL_MIN, POOL_MAX).label("new_total"),
+        totals.c.shards,
+    ).select_from(merchant.join(totals, totals.c.merchant_id == merchant.c.id)) \
+        .where(_eligible(merchant, incremental)).subquery()
+
+@write_transaction()
+def rebalance_liquidity(incremental=False):
+    """Adjusts liquidity pools towards their merchant's supply-demand balance, set-based in the database.
+
+    Runs in the caller's app context as a handful of statements whatever the
+    number of merchants: lock the shards, journal the (clamped) changes, set
+    the pool totals and re-spread the shards (remainder on shard 0, as
+    ``split_balance``). ``incremental`` only touches merchants whose supply or
+    demand changed since the last run. Returns the run's stats.
+    """
+    merchant, pool, shard = Merchant.__table__, LiquidityPool.__table__, LiquidityShard.__table__
+    timings = {}
+    with count_statements() as counter:
+        started = datetime.now(timezone.utc)
+        eligible_ids = _eligible_ids(incremental)
+
+        # Concurrent swaps must not change a shard between reading the totals and rewriting it
+        # (FOR UPDATE on server databases; on SQLite write_transaction took the write lock up front)
+        locked = select(shard.c.id).where(shard.c.merchant_id.in_(eligible_ids)).with_for_update().subquery()
+        db.session.execute(select(func.count()).select_from(locked))
+        timings["lock"] = _lap(started)
+
+        plan = rebalance_plan(incremental)
+        entry_id = new_entry_id()
+        journaled = db.session.execute(insert(PointsLedger).from_select(
+            ["account", "user_id", "merchant_id", "delta", "reason", "exchange_id", "entry_id", "created_at"],
+            select(literal(POOL), literal(None), plan.c.merchant_id, plan.c.new_total - plan.c.old_total,
+                   literal('rebalance'), literal(None), literal(entry_id), literal(started))
+            .where(plan.c.new_total != plan.c.old_total)
+        )).rowcount
+        timings["journal"] = _lap(started)
+
+        rebalanced = db.session.execute(
+            update(pool).values(balance=plan.c.new_total).where(pool.c.merchant_id == plan.c.merchant_id)
+        ).rowcount
+        timings["pools"] = _lap(started)
+
+        counts = select(shard.c.merchant_id, func.count().label("shards")) \
+            .where(shard.c.merchant_id.in_(eligible_ids)).group_by(shard.c.merchant_id).subquery()
+        db.session.execute(
+            update(shard).values(balance=pool.c.balance // counts.c.shards
+                                 + case((shard.c.shard == 0, pool.c.balance % counts.c.shards), else_=0))
+            .where(shard.c.merchant_id == pool.c.merchant_id, counts.c.merchant_id == shard.c.merchant_id)
+        )
+        timings["shards"] = _lap(started)
+
+        # Remember what this run saw, for the next incremental run
+        db.session.execute(
+            update(merchant).values(rebalanced_supply=merchant.c.supply, rebalanced_demand=merchant.c.demand)
+            .where(_changed(merchant))
+        )
+        if journaled:
+            bump_merchant_version()
+        db.session.commit()
+        timings["commit"] = _lap(started)
+
+    stats = {"rebalanced": rebalanced, "changed": journaled, "incremental": incremental,
+             "timings": timings, **counter.as_dict()}
+    logging.info(f"✅ Liquidity Pools Rebalanced: {rebalanced} pools, {journaled} changed "
+                 f"in {stats['statements']} statements, {stats['seconds']:.3f}s")
+    return stats
+
+def _lap(started):
+    return round((datetime.now(timezone.utc) - started).total_seconds(), 4)
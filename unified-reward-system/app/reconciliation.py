@@ -0,0 +1,225 @@
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from sqlalchemy import func, insert, tuple_
+
+from app import db
+from app.database import write_transaction
+from app.models import MerchantOutbox, ReconciliationCorrection, ReconciliationRun, User, UserPoints
+from app.ledger import LOAD_CHUNK, USER, advance_cursor, post, read_ledger, user_leg
+from app.merchant_cache import merchant_cache
+from app.merchant_client import BATCH_SIZE, chunked, fetch_points_batch, get_executor
+
+# UserPoints rows per keyset page; the checkpoint advances once per page
+RECONCILE_PAGE_SIZE = 5000
+# Merchant batch requests outstanding at once, across all merchants
+MAX_IN_FLIGHT = 8
+# Ledger cursor of the incremental runs
+RECONCILE_CURSOR = "reconciliation"
+# Outbox rows still on their way to the merchant ('sending': claimed by a dispatcher)
+UNDELIVERED_STATUSES = ('pending', 'sending')
+
+def undelivered_changes(user_ids):
+    """``{(user_id, merchant_id): points_change}`` the outbox has not delivered to merchants yet.
+
+    Only changes still on their way count; rows ``failed`` after ``MAX_ATTEMPTS``
+    will never be delivered, so they are left to show up as drift.
+    """
+    rows = db.session.query(MerchantOutbox.user_id, MerchantOutbox.merchant_id, func.sum(MerchantOutbox.points_change)) \
+        .filter(MerchantOutbox.user_id.in_(user_ids), MerchantOutbox.status.in_(UNDELIVERED_STATUSES)) \
+        .group_by(MerchantOutbox.user_id, MerchantOutbox.merchant_id)
+    return {(user_id, merchant_id): total or 0 for user_id, merchant_id, total in rows}
+
+def _points_query():
+    return db.session.query(UserPoints.id, UserPoints.user_id, UserPoints.merchant_id, UserPoints.points, User.phone) \
+        .join(User, User.id == UserPoints.user_id)
+
+def _expected(rows):
+    """``(id, user_id, merchant_id, expected merchant points, phone)`` for UserPoints rows."""
+    undelivered = undelivered_changes({row.user_id for row in rows}) if rows else {}
+    db.session.commit()  # End the read transaction; nothing stays locked during merchant calls
+    return [
+        (row.id, row.user_id, row.merchant_id, (row.points or 0) - undelivered.get((row.user_id, row.merchant_id), 0), row.phone)
+        for row in rows
+    ]
+
+def _load_page(after_id, page_size):
+    """Next keyset page of ``_expected`` rows."""
+    return _expected(_points_query().filter(UserPoints.id > after_id).order_by(UserPoints.id).limit(page_size).all())
+
+def _load_accounts(keys):
+    """``_expected`` rows of the given ``(user_id, merchant_id)`` accounts."""
+    rows = []
+    for chunk in chunked(keys, LOAD_CHUNK):
+        rows += _points_query().filter(tuple_(UserPoints.user_id, UserPoints.merchant_id).in_(chunk)).all()
+    return _expected(sorted(rows))
+
+def _fetch_page(page, merchants, batch_size, slots):
+    """Submits one batch request per merchant and ``batch_size`` phones, at most ``MAX_IN_FLIGHT`` at a time."""
+    phones = defaultdict(list)
+    for _, _, merchant_id, _, phone in page:
+        phones[merchant_id].append(phone)
+    futures = []
+    for merchant_id, merchant_phones in phones.items():
+        merchant = merchants.get(merchant_id)
+        if merchant is None:
+            continue
+        for chunk in chunked(merchant_phones, batch_size):
+            slots.acquire()  # Blocks while MAX_IN_FLIGHT requests are outstanding
+            future = get_executor().submit(lambda m=merchant, c=chunk: dict(fetch_points_batch(m, c, batch_size)))
+            future.add_done_callback(lambda _: slots.release())
+            futures.append((merchant_id, future))
+    return futures
+
+def _settle_page(run_id, page, futures, checkpoint=None, ledger_id=None):
+    """Diffs a page against the merchant balances and writes its corrections.
+
+    They commit together with the run's keyset ``checkpoint`` or, for
+    incremental runs, with the ledger cursor moved to ``ledger_id``.
+    """
+    balances, failed = {}, set()
+    for merchant_id, future in futures:
+        try:
+            for phone, points in future.result().items():
+                balances[(merchant_id, phone)] = points
+        except Exception as e:
+            failed.add(merchant_id)
+            logging.warning(f"⚠️ Reconciliation fetch failed for merchant {merchant_id}: {e}")
+
+    corrections, skipped = [], 0
+    for _, user_id, merchant_id, expected, phone in page:
+        merchant_points = balances.get((merchant_id, phone))
+        if merchant_points is None:
+            skipped += 1
+        elif merchant_points != expected:
+            corrections.append({"run_id": run_id, "user_id": user_id, "merchant_id": merchant_id,
+                                "local_points": expected, "merchant_points": merchant_points})
+    with write_transaction():  # Only now: no lock is held while the merchants answer
+        run = db.session.get(ReconciliationRun, run_id)
+        if corrections:
+            db.session.execute(insert(ReconciliationCorrection), corrections)
+        run.checked += len(page) - skipped
+        run.skipped += skipped
+        run.mismatches += len(corrections)
+        if checkpoint is not None:
+            run.last_user_points_id = checkpoint
+        if ledger_id is not None:
+            advance_cursor(RECONCILE_CURSOR, ledger_id)
+        db.session.commit()  # Corrections and checkpoint land together
+
+def reconcile(page_size=RECONCILE_PAGE_SIZE, batch_size=BATCH_SIZE, max_pages=None):
+    """Compares every UserPoints row with the merchant's balance and records the differences.
+
+    Rows are streamed in keyset pages, so memory stays bounded by two pages
+    (the next one is read while the current one's requests are in flight).
+    An unfinished run resumes from its checkpoint. ``max_pages`` stops early
+    (the run stays resumable). Local balances count changes the outbox is still
+    delivering; permanently failed ones are reported as mismatches. Rows whose
+    merchant could not be reached are skipped.
+    Returns the run.
+    """
+    with write_transaction():
+        run = ReconciliationRun.query.filter_by(kind='full', status='running').order_by(ReconciliationRun.id.desc()).first()
+        if run is None:
+            run = ReconciliationRun()
+            db.session.add(run)
+        else:
+            logging.info(f"🔄 Resuming reconciliation run {run.id} after UserPoints {run.last_user_points_id}")
+        db.session.commit()
+    run_id, after_id = run.id, run.last_user_points_id
+    failed = MerchantOutbox.query.filter_by(status='failed').count()
+    db.session.commit()
+    if failed:
+        logging.warning(f"⚠️ {failed} outbox changes failed permanently; their balances are reported as mismatches")
+
+    merchants = merchant_cache.snapshot().by_id
+    slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+    pages = 0
+    page = _load_page(after_id, page_size)
+    while page and (max_pages is None or pages < max_pages):
+        futures = _fetch_page(page, merchants, batch_size, slots)
+        next_page = _load_page(page[-1][0], page_size)
+        _settle_page(run_id, page, futures, checkpoint=page[-1][0])
+        page, pages = next_page, pages + 1
+
+    with write_transaction():
+        run = db.session.get(ReconciliationRun, run_id)
+        if not page:
+            run.status = 'completed'
+            run.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+    logging.info(f"✅ Reconciliation run {run.id}: {run.checked} checked, {run.mismatches} mismatches, "
+                 f"{run.skipped} skipped ({run.status})")
+    return run
+
+def reconcile_changes(batch_size=BATCH_SIZE, max_pages=None):
+    """Compares only the balances the ledger changed since the last call with the merchants.
+
+    Reads the ledger through the ``RECONCILE_CURSOR`` cursor one page at a
+    time; each page's corrections commit together with the cursor, so an
+    interrupted call resumes after its last page. Drift of balances nothing
+    changed locally, and rows whose merchant could not be reached, are left
+    to the full ``reconcile``. Returns the run.
+    """
+    run = ReconciliationRun(kind='incremental')
+    db.session.add(run)
+    db.session.commit()
+    run_id = run.id
+
+    merchants = merchant_cache.snapshot().by_id
+    slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+    pages = 0
+    while max_pages is None or pages < max_pages:
+        entries = [(e.id, e.account, e.user_id, e.merchant_id) for e in read_ledger(RECONCILE_CURSOR)]
+        if not entries:
+            break
+        page = _load_accounts({(user_id, merchant_id) for _, account, user_id, merchant_id in entries if account == USER})
+        futures = _fetch_page(page, merchants, batch_size, slots)
+        _settle_page(run_id, page, futures, ledger_id=entries[-1][0])
+        pages += 1
+
+    with write_transaction():
+        run = db.session.get(ReconciliationRun, run_id)
+        run.status, run.finished_at = 'completed', datetime.now(timezone.utc)  # The cursor, not the run, is resumed
+        db.session.commit()
+    logging.info(f"✅ Incremental reconciliation run {run.id}: {run.checked} changed balances checked, "
+                 f"{run.mismatches} mismatches, {run.skipped} skipped")
+    return run
+
+@write_transaction()
+def apply_corrections(run_id, page_size=RECONCILE_PAGE_SIZE):
+    """Adopts the merchant balance for a run's open corrections through the ledger.
+
+    A correction whose local balance moved since the run is marked ``stale``
+    instead, so a rerun can judge it against fresh data. Returns the number applied.
+    """
+    applied, last_id = 0, 0
+    while True:
+        corrections = ReconciliationCorrection.query.filter(
+            ReconciliationCorrection.run_id == run_id, ReconciliationCorrection.status == 'open',
+            ReconciliationCorrection.id > last_id
+        ).order_by(ReconciliationCorrection.id).limit(page_size).all()
+        if not corrections:
+            return applied
+        last_id = corrections[-1].id
+
+        keys = {(c.user_id, c.merchant_id) for c in corrections}
+        undelivered = undelivered_changes({user_id for user_id, _ in keys})
+        current = {
+            (row.user_id, row.merchant_id): (row.points or 0) - undelivered.get((row.user_id, row.merchant_id), 0)
+            for row in db.session.query(UserPoints.user_id, UserPoints.merchant_id, UserPoints.points)
+            .filter(UserPoints.user_id.in_({user_id for user_id, _ in keys}))
+        }
+        legs = []
+        for correction in corrections:
+            if current.get((correction.user_id, correction.merchant_id)) != correction.local_points:
+                correction.status = 'stale'
+                continue
+            legs.append(user_leg(correction.user_id, correction.merchant_id,
+                                 correction.merchant_points - correction.local_points, 'reconciliation'))
+            correction.status = 'applied'
+        post(legs)
+        applied += len(legs)
+        db.session.commit()
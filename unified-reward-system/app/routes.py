@@ -1,8 +1,8 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, jsonify, request
+from flask import Blueprint, Response, render_template, redirect, url_for, flash, jsonify, request
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-import requests
+import json
 import logging
 
 from app import db, login_manager
@@ -10,10 +10,19 @@ from app.models import User, UserPoints, Merchant, SmartExchange, LiquidityPool
 from app.bpv_updater import get_merchant_bpv, update_merchant_bpv
 from app.sync_utils import sync_user_points
 from app.smart_router import smart_route
-from app.exchange_utils import process_instant_exchange, process_smart_exchange , update_merchant_api # ✅ Moved exchange functions
-
-# Initialize Logging
-logging.basicConfig(level=logging.INFO)
+from app.merchant_cache import get_merchants, get_merchant_by_name, merchant_cache
+from app.rate_matrix import get_rate_matrix
+from app.merchant_client import INTERACTIVE_DEADLINE
+from app.balance_cache import balance_cache
+from app.reconciliation import undelivered_changes
+from app.exchange_scheduler import scheduler_metrics
+from app.quotes import build_quote, instant_conversion, QuoteError, MAX_INSTANT_AMOUNT
+from app.batch_convert import BATCH_MAX_ITEMS, batch_authorized, convert_batch, read_ndjson
+from app.exchange_utils import process_instant_exchange, process_smart_exchange # ✅ Moved exchange functions
+from app.logs import log_event
+from app import metrics
+
+log = logging.getLogger(__name__)  # Level and format set by create_app (LOG_LEVEL)
 
 main = Blueprint("main", __name__)
 
@@ -44,7 +53,7 @@ def register():
             db.session.commit()
 
             # ✅ Fetch and store initial points only once
-            sync_user_points(new_user)
+            sync_user_points(new_user, fetch_from_api=True)
 
             flash("Registration successful! You can now log in.", "success")
             return redirect(url_for("main.login"))
@@ -85,18 +94,14 @@ def dashboard():
         flash("You must be logged in to access the dashboard.", "error")
         return redirect(url_for("main.login"))  # ✅ Redirect to login if user is None
 
-    # ✅ Debugging output
-    print(f"✅ Debug: current_user = {current_user}")
-    print(f"✅ Debug: Username = {getattr(current_user, 'username', 'No username')}")
-    print(f"✅ Debug: Phone = {getattr(current_user, 'phone', 'No phone')}")
+    log_event(log, logging.DEBUG, "✅ dashboard", user_id=current_user.id)
 
     if not hasattr(current_user, "phone") or not current_user.phone:
         flash("Error: User profile is incomplete. Please update your profile.", "error")
         return redirect(url_for("main.dashboard"))
 
-    sync_user_points(current_user)  # 🚀 Now only runs if `phone` exists
-
-    merchants = Merchant.query.all()
+    # Merchant balances are pushed by the outbox dispatcher, not on page load
+    merchants = get_merchants()
     user_points = current_user.points.all()
 
     return render_template("dashboard.html", user=current_user, user_points=user_points, merchants=merchants)
@@ -114,8 +119,8 @@ def convert_points():
             return jsonify({"error": "Invalid request. Missing merchant or amount."}), 400
 
         amount = int(amount_str)
-        from_merchant = Merchant.query.filter_by(name=from_merchant_name).first()
-        to_merchant = Merchant.query.filter_by(name=to_merchant_name).first()
+        from_merchant = get_merchant_by_name(from_merchant_name)
+        to_merchant = get_merchant_by_name(to_merchant_name)
 
         if not from_merchant or not to_merchant:
             return jsonify({"error": "Invalid merchants selected."}), 400
@@ -124,22 +129,16 @@ def convert_points():
         if amount <= 0:
             return jsonify({"error": "Amount must be greater than 0"}), 400
 
-        # Fix conversion rate calculation
-        from_value = from_merchant.redemption_value
-        to_value = to_merchant.redemption_value
-
-        conversion_rate = min(2.0, max(0.1, (from_value / to_value) if to_value > 0 else 1))
-        converted_amount = min(int(round(amount * conversion_rate)), amount * 2)
-        
         if exchange_type == "instant":
-            if amount > 1000:
+            if amount > MAX_INSTANT_AMOUNT:
                 return jsonify({"error": "Amount must be less than 1000 points for instant exchange."}), 400
+
+            # Precomputed, clamped redemption-value rate
+            converted_amount = instant_conversion(get_rate_matrix(), from_merchant.id, to_merchant.id, amount)
             response, status_code = process_instant_exchange(from_merchant, to_merchant, amount, converted_amount)
         else:
             response, status_code = process_smart_exchange(from_merchant, to_merchant, amount)
 
-        if status_code == 200:
-            sync_user_points(current_user, fetch_from_api=False)
         return jsonify(response), status_code
 
     except Exception as e:
@@ -147,29 +146,85 @@ def convert_points():
     except Exception as e:
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
     
+@main.route("/quote")
+def quote():
+    """Previews a conversion without submitting it; served from in-memory state."""
+    try:
+        return jsonify(build_quote(request.args.get("from_merchant"), request.args.get("to_merchant"), request.args.get("amount")))
+    except QuoteError as e:
+        return jsonify({"error": str(e)}), 400
+
+@main.route("/quote/batch", methods=["POST"])
+def quote_batch():
+    """Prices a JSON list of {from_merchant, to_merchant, amount}; errors are reported per item."""
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return jsonify({"error": "Expected a JSON list of quote requests."}), 400
+
+    quotes = []
+    for item in items:
+        try:
+            if not isinstance(item, dict):
+                raise QuoteError("Each quote request must be an object.")
+            quotes.append(build_quote(item.get("from_merchant"), item.get("to_merchant"), item.get("amount")))
+        except QuoteError as e:
+            quotes.append({"error": str(e)})
+    return jsonify({"quotes": quotes})
+
+@main.route("/convert_points/batch", methods=["POST"])
+def convert_points_batch():
+    """Instant exchanges for many users, settled in a few transactions; one result per item.
+
+    Takes a JSON list or an NDJSON stream (``application/x-ndjson``) of
+    {user_id or phone, from_merchant, to_merchant, amount, ref?}, and answers in
+    the same format. Needs ``Authorization: Bearer <BATCH_API_TOKEN>``.
+    """
+    if not batch_authorized(request.headers.get("Authorization")):
+        return jsonify({"error": "Batch conversion is not authorized."}), 403
+
+    streamed = request.mimetype == "application/x-ndjson"
+    items = read_ndjson(request.get_data().splitlines()) if streamed else request.get_json(silent=True)
+    if not isinstance(items, list):
+        return jsonify({"error": "Expected a JSON list or NDJSON stream of conversions."}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} conversions per batch."}), 413
+
+    results = convert_batch(items)
+    if streamed:
+        return Response((json.dumps(result) + "\n" for result in results), mimetype="application/x-ndjson")
+    succeeded = sum(1 for result in results if result.get("success"))
+    return jsonify({"results": results, "succeeded": succeeded, "failed": len(results) - succeeded})
+
+@main.route("/smart_exchange/metrics")
+def smart_exchange_metrics():
+    """Smart Exchange queue depth and fill latency."""
+    return jsonify(scheduler_metrics())
+
+@main.route("/metrics")
+def prometheus_metrics():
+    """Request, SQL, merchant call and matcher metrics of this process, in the Prometheus text format."""
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
 @main.route("/get_points")
 @login_required
 def get_points():
-    """Fetches user points from merchant APIs and database fallback."""
-    user_points = UserPoints.query.filter_by(user_id=current_user.id).all()
-    merchant_ids = [up.merchant_id for up in user_points]
-    merchants = {m.id: m for m in Merchant.query.filter(Merchant.id.in_(merchant_ids)).all()}
-
-    points_data = {}
-    for up in user_points:
-        merchant = merchants.get(up.merchant_id)
-        if not merchant:
-            continue
-
-        # Fetch live balance from API
-        try:
-            response = requests.get(f"{merchant.api_url}/{current_user.phone}")
-            if response.status_code == 200:
-                api_data = response.json()
-                points_data[merchant.name] = api_data.get("points", 0)
-            else:
-                points_data[merchant.name] = up.points  # Fallback to DB value
-        except requests.RequestException:
-            points_data[merchant.name] = up.points  # Fallback in case of API failure
+    """Fetches user points from merchant APIs, falling back to the DB value per merchant.
 
+    Merchant balances come from the balance cache (misses fetched concurrently,
+    stale entries refreshed in the background). A merchant that is unreachable,
+    or that has not received this user's latest exchange yet, shows the stored balance.
+    """
+    user_points = UserPoints.query.filter_by(user_id=current_user.id).all()
+    merchants = merchant_cache.snapshot().by_id
+    stored = {up.merchant_id: up.points for up in user_points if up.merchant_id in merchants}
+    undelivered = {merchant_id for _, merchant_id in undelivered_changes([current_user.id])}
+    user_id, phone, version = current_user.id, current_user.phone, current_user.balances_version
+    db.session.commit()  # ✅ Don't hold the read transaction during merchant calls
+
+    live = balance_cache.get(user_id, phone, [merchants[m] for m in stored if m not in undelivered],
+                             deadline=INTERACTIVE_DEADLINE, version=version)
+    points_data = {
+        merchants[merchant_id].name: live.get(merchant_id, points)  # ✅ Fallback to DB value
+        for merchant_id, points in stored.items()
+    }
     return jsonify(points_data)
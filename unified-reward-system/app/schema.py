@@ -0,0 +1,34 @@
+from sqlalchemy import inspect, text
+
+from app import db
+from app.ledger import backfill_opening_balances
+from app.liquidity import shard_existing_pools
+
+# Columns added to existing tables after their first release: table -> [(column, DDL type)]
+ADDED_COLUMNS = {
+    "user": [("balances_version", "INTEGER NOT NULL DEFAULT 0")],
+    "merchant": [("trade_volume", "INTEGER DEFAULT 0"), ("bpv", "FLOAT"),
+                 ("rebalanced_supply", "INTEGER"), ("rebalanced_demand", "INTEGER")],
+    "smart_exchange": [("completed_at", "DATETIME")],
+    "merchant_outbox": [("claim_token", "VARCHAR(32)")],
+    "reconciliation_run": [("kind", "VARCHAR(20) DEFAULT 'full'")],
+}
+
+def upgrade_schema():
+    """Creates missing tables, adds columns and indexes that ``db.create_all`` cannot add,
+    shards old pools and opens ledger history for existing balances."""
+    db.create_all()
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)  # Same connection: SQLite allows one writer at a time
+        quote = connection.dialect.identifier_preparer.quote  # "user" is reserved on PostgreSQL
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {column["name"] for column in inspector.get_columns(table)}
+            for name, ddl in columns:
+                if name not in existing:
+                    connection.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(name)} {ddl}"))
+        # create_all only indexes tables it creates; add indexes declared since
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        shard_existing_pools(connection)
+        backfill_opening_balances(connection)
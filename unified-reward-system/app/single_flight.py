@@ -0,0 +1,125 @@
+import threading
+import time
+import uuid
+
+from flask import current_app
+
+# A crashed run's lock, or a queued flag whose task was lost, frees itself after this many seconds
+LOCK_TTL_SECONDS = 300
+QUEUED_TTL_SECONDS = 120
+LOCK_POLL_SECONDS = 0.05
+
+class LocalFlight:
+    """In-process stand-in for ``RedisFlight`` (tests, benchmarks, single-process deployments)."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._dirty = False
+        self._queued_until = 0.0
+        self._counters = {}
+
+    def mark_dirty(self):
+        self._dirty = True
+
+    def take_dirty(self):
+        """Returns whether work arrived since the last call, and clears the flag."""
+        with self._state_lock:
+            dirty, self._dirty = self._dirty, False
+            return dirty
+
+    def try_queue(self):
+        """Claims the single queued slot; False if a run is already queued."""
+        with self._state_lock:
+            now = time.monotonic()
+            if self._queued_until > now:
+                return False
+            self._queued_until = now + QUEUED_TTL_SECONDS
+            return True
+
+    def clear_queued(self):
+        self._queued_until = 0.0
+
+    def acquire(self, wait=0):
+        return self._lock.acquire(timeout=wait) if wait else self._lock.acquire(blocking=False)
+
+    def release(self):
+        self._lock.release()
+
+    def incr(self, counter, amount=1):
+        with self._state_lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def counters(self):
+        return dict(self._counters)
+
+class RedisFlight:
+    """Dirty flag, queued slot, run lock and counters shared by every process through Redis."""
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self._token = None
+
+    def _key(self, part):
+        return f"single_flight:{self.name}:{part}"
+
+    def mark_dirty(self):
+        self.client.set(self._key("dirty"), 1)
+
+    def take_dirty(self):
+        pipe = self.client.pipeline()  # MULTI/EXEC: no submission slips between the read and the delete
+        pipe.get(self._key("dirty"))
+        pipe.delete(self._key("dirty"))
+        dirty, _ = pipe.execute()
+        return dirty is not None
+
+    def try_queue(self):
+        return bool(self.client.set(self._key("queued"), 1, nx=True, ex=QUEUED_TTL_SECONDS))
+
+    def clear_queued(self):
+        self.client.delete(self._key("queued"))
+
+    def acquire(self, wait=0):
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait
+        while True:
+            if self.client.set(self._key("lock"), token, nx=True, ex=LOCK_TTL_SECONDS):
+                self._token = token
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(LOCK_POLL_SECONDS)
+
+    def release(self):
+        # Only delete our own lock, not one taken after ours expired
+        self.client.eval(
+            "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0",
+            1, self._key("lock"), self._token
+        )
+        self._token = None
+
+    def incr(self, counter, amount=1):
+        self.client.hincrby(self._key("counters"), counter, amount)
+
+    def counters(self):
+        return {key.decode(): int(value) for key, value in self.client.hgetall(self._key("counters")).items()}
+
+_flights = {}
+
+def get_flight(name):
+    """Process-wide flight for ``name``; Redis-backed when ``SINGLE_FLIGHT_URL`` (default: the Celery broker) is Redis."""
+    flight = _flights.get(name)
+    if flight is None:
+        url = current_app.config.get("SINGLE_FLIGHT_URL") or current_app.config.get("CELERY_BROKER_URL", "")
+        if url.startswith(("redis://", "rediss://")):
+            import redis
+            flight = RedisFlight(name, redis.Redis.from_url(url))
+        else:
+            flight = LocalFlight(name)
+        _flights[name] = flight
+    return flight
+
+def reset_flights():
+    _flights.clear()
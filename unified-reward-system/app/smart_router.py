@@ -1,14 +1,25 @@
-from app.models import LiquidityPool
+import logging
 
-def smart_route(from_merchant, to_merchant, amount):
-    """Determines if a transaction should use Smart Exchange or Instant Exchange."""
-    from_pool = LiquidityPool.query.filter_by(merchant_id=from_merchant.id).first()
-    to_pool = LiquidityPool.query.filter_by(merchant_id=to_merchant.id).first()
-    
-    liquidity_threshold = 5000  # Max allowed instant exchange
+from app.liquidity import pool_balances
+from app.logs import LOG_SAMPLE_RATE, log_event
+
+log = logging.getLogger(__name__)
+
+LIQUIDITY_THRESHOLD = 5000  # Max allowed instant exchange
+LIQUIDITY_MARGIN = 1.1  # Pools must hold this multiple of the amount
 
-    if amount > liquidity_threshold or from_pool.balance < (amount * 1.1) or to_pool.balance < (amount * 1.1):
-        print("🔄 Smart Exchange Enforced (Large transaction detected)")
+def choose_route(amount, from_balance, to_balance):
+    """Routing rule on known pool balances, shared by smart_route and quotes."""
+    if amount > LIQUIDITY_THRESHOLD or from_balance < (amount * LIQUIDITY_MARGIN) or to_balance < (amount * LIQUIDITY_MARGIN):
         return 'smart'
-    
     return 'instant'
+
+def smart_route(from_merchant, to_merchant, amount):
+    """Determines if a transaction should use Smart Exchange or Instant Exchange."""
+    balances = pool_balances([from_merchant.id, to_merchant.id])
+
+    route = choose_route(amount, balances.get(from_merchant.id, 0), balances.get(to_merchant.id, 0))
+    if route == 'smart':
+        log_event(log, logging.INFO, "🔄 smart_exchange_enforced", LOG_SAMPLE_RATE, amount=amount,
+                  from_merchant=from_merchant.name, to_merchant=to_merchant.name)
+    return route
@@ -0,0 +1,60 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app import db
+
+class StatementCounter:
+    """Counts SQL statements executed on the app engine while active."""
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return {"statements": self.statements, "seconds": round(self.seconds, 6)}
+
+# Counters of the blocks running on this thread, and of blocks counting every thread
+_local = threading.local()
+_all_threads = []
+_all_threads_lock = threading.Lock()
+
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_local, "counters", ()):
+        counter.statements += 1
+    if _all_threads:
+        with _all_threads_lock:
+            for counter in _all_threads:
+                counter.statements += 1
+
+def instrument_engine(engine):
+    """Registers the one statement listener; call at startup, before other threads use the engine."""
+    if not event.contains(engine, "before_cursor_execute", _on_execute):
+        event.listen(engine, "before_cursor_execute", _on_execute)
+
+@contextmanager
+def count_statements(all_threads=False):
+    """Context manager yielding a StatementCounter for the enclosed block.
+
+    Counts the statements of the calling thread only, unless ``all_threads``
+    (e.g. a load test counting what the server threads run).
+    """
+    instrument_engine(db.engine)  # Already registered by create_app(); here for scripts' own apps
+    counter = StatementCounter()
+    if all_threads:
+        with _all_threads_lock:
+            _all_threads.append(counter)
+    else:
+        _local.counters = getattr(_local, "counters", ()) + (counter,)
+    started = time.perf_counter()
+    try:
+        yield counter
+    finally:
+        counter.seconds = time.perf_counter() - started
+        if all_threads:
+            with _all_threads_lock:
+                _all_threads.remove(counter)
+        else:
+            _local.counters = tuple(c for c in _local.counters if c is not counter)
@@ -1,51 +1,93 @@
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import logging
 
 from app import db
-from app.models import UserPoints, Merchant
+from app.database import write_transaction
+from app.models import User, UserPoints
+from app.ledger import set_user_balances
+from app.reconciliation import undelivered_changes
+from app.balance_cache import bump_balances_version
+from app.merchant_cache import get_merchants
+from app.merchant_client import BATCH_SIZE, fan_out, fetch_points, fetch_points_batch, push_points
 
 def sync_user_points(user, fetch_from_api=False):
-    """Sync user points. Fetch from API only during registration, otherwise update API with DB values."""
+    """Sync user points. Fetch from API only during registration, otherwise update API with DB values.
+
+    All merchants are called concurrently through the shared merchant client, so
+    the sync takes as long as the slowest merchant rather than the sum of all.
+    """
     if not user or not user.phone:
         return
 
-    # Configure retry strategy for API calls
-    session = requests.Session()
-    retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-    session.mount("http://", HTTPAdapter(max_retries=retries))
+    merchants = get_merchants()
 
     if fetch_from_api:  # Only during registration
-        merchants = Merchant.query.all()
-        for merchant in merchants:
-            try:
-                response = session.get(f"{merchant.api_url}/rewards/{user.phone}", timeout=10)
-                if response.status_code == 200:
-                    points = response.json().get("points", 0)
-                    user_points = UserPoints.query.filter_by(user_id=user.id, merchant_id=merchant.id).first()
-                    if not user_points:
-                        user_points = UserPoints(user_id=user.id, merchant_id=merchant.id, points=points)
-                        db.session.add(user_points)
-                    else:
-                        user_points.points = points
-                else:
-                    print(f"⚠️ API fetch failed for {merchant.name}: {response.status_code}")
-            except Exception as e:
-                print(f"❌ Error fetching points from {merchant.name}: {e}")
+        fetched = fetch_points(merchants, user.phone)
+        # ✅ Differences to stored balances are journaled as merchant_sync entries
+        with write_transaction():
+            set_user_balances({(user.id, merchant_id): points for merchant_id, points in fetched.items()}, 'merchant_sync')
+            db.session.commit()
+
+    else:  # Push local balances to the merchants
+        # ✅ Send only the difference: posting absolute balances as points_change kept adding them up
+        user_points = {up.merchant_id: up.points or 0 for up in UserPoints.query.filter_by(user_id=user.id).all()}
+        undelivered = undelivered_changes([user.id])  # The outbox will still send these
+        remote = fetch_points(merchants, user.phone)
+        changes = []
+        for m in merchants:
+            if m.id not in remote:
+                continue  # Unreachable; the next sync catches up
+            expected = user_points.get(m.id, 0) - undelivered.get((user.id, m.id), 0)
+            if expected != remote[m.id]:
+                changes.append((m, expected - remote[m.id]))
+        if any(push_points(changes, user.phone).values()):
+            bump_balances_version([user.id])
+            db.session.commit()
+
+def bulk_fetch_user_points(users, batch_size=BATCH_SIZE):
+    """Refreshes ``UserPoints`` for many users from the merchants' batch endpoints.
+
+    ``users`` is a list of ``(user_id, phone)``. Each merchant is asked for
+    ``batch_size`` phones per request and all merchants are queried at once,
+    so N users cost about ``N / batch_size`` requests per merchant. Changes
+    the outbox has not delivered yet are added back to the merchant's value.
+    Returns the number of balances written.
+    """
+    merchants = get_merchants()
+    user_ids = {phone: user_id for user_id, phone in users}
+    results = fan_out(
+        {m.id: (lambda m=m: list(fetch_points_batch(m, list(user_ids), batch_size))) for m in merchants},
+        deadline=None
+    )
+
+    balances = {}
+    for merchant in merchants:
+        result = results[merchant.id]
+        if isinstance(result, Exception):
+            logging.warning(f"❌ Batch fetch failed for {merchant.name}: {result}")
+            continue
+        for phone, points in result:
+            balances[(user_ids[phone], merchant.id)] = points
+
+    with write_transaction():
+        # ✅ The merchant has not seen these yet; overwriting would drop them locally
+        undelivered = undelivered_changes(set(user_ids.values())) if balances else {}
+        for key, change in undelivered.items():
+            if key in balances:
+                balances[key] += change
+        written = set_user_balances(balances, 'merchant_sync')
         db.session.commit()
+    return written
+
+def sync_all_user_points(page_size=10 * BATCH_SIZE, batch_size=BATCH_SIZE):
+    """Nightly refresh of every user's balances using the batch endpoints.
 
-    else:  # Update API after exchange
-        merchants = Merchant.query.all()
-        for merchant in merchants:
-            user_points = UserPoints.query.filter_by(user_id=user.id, merchant_id=merchant.id).first()
-            points = user_points.points if user_points else 0
-            try:
-                response = session.post(
-                    f"{merchant.api_url}/rewards/update",
-                    json={"user_phone": user.phone, "points_change": points},
-                    timeout=10
-                )
-                if response.status_code != 200:
-                    print(f"⚠️ Failed to update {merchant.name} API: {response.text}")
-            except Exception as e:
-                print(f"❌ Failed to update {merchant.name}: {e}")
\ No newline at end of file
+    Users are paged by id so memory stays bounded by ``page_size``.
+    """
+    last_id, written = 0, 0
+    while True:
+        page = db.session.query(User.id, User.phone).filter(User.id > last_id) \
+            .order_by(User.id).limit(page_size).all()
+        if not page:
+            return written
+        written += bulk_fetch_user_points(page, batch_size)
+        last_id = page[-1].id
@@ -1,31 +1,9 @@
-from app import db, celery  # ✅ Now Celery is initialized correctly
-from app.models import SmartExchange
-from app.cyclic_matcher import find_exchange_cycles, execute_cycle
-import logging
+from app import get_celery
+from app.exchange_scheduler import run_scheduled, LOCK_WAIT_SECONDS
+
+celery = get_celery()  # ✅ Made here on first import, for the app in context (or the process's cached app)
 
 @celery.task
 def process_smart_exchanges():
-    """Background task to process all pending Smart Exchanges using cyclic matching."""
-    logging.info("🔄 Processing Smart Exchanges...")
-
-    with db.session.begin():
-        pending_exchanges = SmartExchange.query.filter_by(status='pending').with_for_update().all()
-        
-        if not pending_exchanges:
-            logging.info("✅ No pending Smart Exchanges.")
-            return
-
-        # ✅ Find and process exchange cycles
-        cycles = find_exchange_cycles(pending_exchanges)
-        
-        if cycles:
-           logging.info(f"✅ Found {len(cycles)} exchange cycles. Executing...")
-           for cycle in cycles:
-              execute_cycle(cycle)
-        else:   
-    # ✅ Complete unmatched exchanges to prevent hanging
-            for exchange in pending_exchanges:
-                exchange.status = 'failed'
-            logging.info("⚠ No cycles found. Marked pending exchanges as failed.")
-
-        db.session.commit()
+    """Queued smart exchange scheduler run; waits for an active run, then matches the orders submitted so far."""
+    run_scheduled(queued=True, wait=LOCK_WAIT_SECONDS)
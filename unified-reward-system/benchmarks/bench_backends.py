@@ -0,0 +1,63 @@
+"""Runs the matching and instant-exchange paths against each database backend.
+
+Backends: SQLite with its defaults (rollback journal, deferred transactions),
+SQLite as the app configures it (WAL, immediate transactions) and, with
+``--postgres-url``, a scratch PostgreSQL database (its tables are dropped).
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_backends --postgres-url postgresql://localhost/rewards_bench
+"""
+import argparse
+import time
+
+from app import db
+from app.cyclic_matcher import find_exchange_cycles, settle_cycles
+from app.models import SmartExchange
+from benchmarks import bench_instant_exchange
+from benchmarks.support import make_bench_app, seed
+
+
+def run_matching(num_orders, num_users, num_merchants, **app_kwargs):
+    """Seconds to load pending orders, then to find and settle their cycles."""
+    app = make_bench_app(**app_kwargs)
+    with app.app_context():
+        seed(num_users, num_merchants, num_orders)
+        started = time.perf_counter()
+        pending = SmartExchange.query.filter_by(status='pending').all()
+        loaded = time.perf_counter() - started
+        cycles = find_exchange_cycles(pending)
+        stats = settle_cycles(cycles)
+        total = time.perf_counter() - started
+        return loaded, stats["seconds"], total, len(cycles)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--postgres-url", help="scratch PostgreSQL database; its tables are dropped")
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--merchants", type=int, default=10)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--swaps", type=int, default=100, help="instant swaps per worker")
+    args = parser.parse_args()
+
+    backends = [("sqlite", {"sqlite_tuning": False}), ("sqlite-wal", {})]
+    if args.postgres_url:
+        backends.append(("postgresql", {"database_url": args.postgres_url}))
+
+    print(f"{'backend':>11} {'load s':>8} {'settle s':>9} {'match s':>8} {'cycles':>7}")
+    for name, app_kwargs in backends:
+        loaded, settled, total, cycles = run_matching(args.orders, args.users, args.merchants, **app_kwargs)
+        print(f"{name:>11} {loaded:>8.3f} {settled:>9.3f} {total:>8.3f} {cycles:>7}")
+
+    print(f"\n{'backend':>11} {'workers':>8} {'swaps/s':>9} {'ok':>9} {'consistent':>11}")
+    for name, app_kwargs in backends:
+        for workers in args.workers:
+            succeeded, attempted, elapsed, consistent = bench_instant_exchange.run(
+                workers, bench_instant_exchange.POOL_SHARDS, args.swaps, 10, **app_kwargs)
+            print(f"{name:>11} {workers:>8} {succeeded / elapsed:>9.0f} {succeeded:>4}/{attempted:<4} {str(consistent):>11}")
+
+
+if __name__ == "__main__":
+    main()
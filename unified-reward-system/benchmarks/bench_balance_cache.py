@@ -0,0 +1,68 @@
+"""Polled balance reads with and without the stale-while-revalidate balance cache.
+
+Simulates users polling their balances against the mock merchant API with
+latency: "direct" asks every merchant on each poll, "cached" goes through
+``BalanceCache``. Reports per-poll latency and the cache's hit rate.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_balance_cache --users 50 --polls 20 --latency-ms 100
+"""
+import argparse
+import logging
+import random
+import statistics
+import time
+
+from app import balance_cache as balance_cache_module
+from app.balance_cache import BalanceCache
+from app.merchant_cache import merchant_cache
+from app.merchant_client import fetch_points
+from benchmarks.support import make_bench_app, start_mock_api, seed_mock_merchants
+
+
+def run(read, users, polls, seed=7):
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(users * polls):
+        user_id = rng.randrange(users)
+        started = time.perf_counter()
+        read(user_id, "+91" + str(9000000000 + user_id))
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return statistics.median(samples) * 1000, samples[int(len(samples) * 0.99) - 1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--polls", type=int, default=20, help="polls per user")
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--jitter-ms", type=float, default=30)
+    parser.add_argument("--fresh-seconds", type=float, default=0.5,
+                        help="shortened so the run also exercises background refreshes")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    base_url, _, server = start_mock_api(args.latency_ms, args.jitter_ms)
+    app = make_bench_app()
+    merchant_cache.invalidate()
+    with app.app_context():
+        seed_mock_merchants(base_url)
+        merchants = list(merchant_cache.snapshot().by_id.values())
+
+    balance_cache_module.FRESH_SECONDS = args.fresh_seconds
+    cache = BalanceCache()
+    print(f"mock latency {args.latency_ms}ms ±{args.jitter_ms}ms, {len(merchants)} merchants, "
+          f"{args.users} users x {args.polls} polls, fresh for {args.fresh_seconds}s")
+    print(f"{'mode':>8} {'median ms':>10} {'p99 ms':>8}")
+    for mode, read in (("direct", lambda user_id, phone: fetch_points(merchants, phone)),
+                       ("cached", lambda user_id, phone: cache.get(user_id, phone, merchants))):
+        median, p99 = run(read, args.users, args.polls)
+        print(f"{mode:>8} {median:>10.2f} {p99:>8.2f}")
+    print(f"cache: {cache.stats()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Batch conversion: ``convert_batch`` and /convert_points/batch vs looping over instant exchanges.
+
+Seeds ``--users`` users holding points at ``--merchants`` merchants and
+generates ``--items`` random conversions at the direct rate. "loop" runs the
+first ``--loop-items`` of them one by one through ``process_instant_exchange``
+(a login and a transaction per item); "batch" settles the same items with
+``convert_batch`` on an identical database, and the two must end with the same
+balances and pool totals. Then all items go through ``convert_batch`` and the
+HTTP endpoint (JSON and NDJSON), each on a fresh database. Every run checks
+that balances match the ledger and that no pool shard went negative.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_batch_convert --items 100000 --loop-items 2000
+"""
+import argparse
+import json
+import logging
+import random
+import time
+
+from flask_login import login_user
+from sqlalchemy import func, select
+
+from app import db
+from app.batch_convert import convert_batch
+from app.ledger import POOL, backfill_opening_balances, find_drift
+from app.merchant_cache import merchant_cache
+from app.models import LiquidityShard, PointsLedger, User, UserPoints
+from app.rate_matrix import rate_matrix_cache
+from benchmarks.bench_quotes import make_quote_app
+from benchmarks.support import seed, seed_pools
+
+POOL_BALANCE = 5_000_000
+TOKEN = "bench-token"
+
+
+def make_items(count, users, merchants, rng):
+    items = []
+    for i in range(count):
+        from_id, to_id = rng.sample(range(1, merchants + 1), 2)
+        user = rng.randint(1, users)
+        items.append({("user_id" if i % 2 else "phone"): (user if i % 2 else f"+91{user:010d}"),
+                      "from_merchant": f"merchant-{from_id}", "to_merchant": f"merchant-{to_id}",
+                      "amount": rng.randint(1, 1000), "ref": f"bench-{i}"})
+    return items
+
+
+def fresh_app(args):
+    app = make_quote_app()
+    app.config["BATCH_API_TOKEN"] = TOKEN
+    merchant_cache.invalidate()
+    rate_matrix_cache.invalidate_pools()
+    with app.app_context():
+        seed(args.users, args.merchants, points=args.points)
+        seed_pools({m: POOL_BALANCE for m in range(1, args.merchants + 1)})
+        backfill_opening_balances(db.session.connection())
+        db.session.commit()
+    return app
+
+
+def loop_convert(app, items):
+    """One ``process_instant_exchange`` per item, as /convert_points would run it."""
+    from app.exchange_utils import process_instant_exchange
+    snapshot, matrix = merchant_cache.snapshot(), rate_matrix_cache.matrix()
+    by_phone = dict(db.session.query(User.phone, User.id))
+    succeeded = 0
+    for item in items:
+        user_id = item.get("user_id") or by_phone[item["phone"]]
+        from_merchant, to_merchant = snapshot.by_name[item["from_merchant"]], snapshot.by_name[item["to_merchant"]]
+        amount = item["amount"]
+        converted = min(int(round(amount * matrix.direct_rate(from_merchant.id, to_merchant.id))), amount * 2)
+        with app.test_request_context():
+            login_user(db.session.get(User, user_id))
+            _, status = process_instant_exchange(from_merchant, to_merchant, amount, converted)
+        succeeded += status == 200
+    return succeeded
+
+
+def post_batch(app, items, ndjson):
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    with app.test_client() as client:
+        if ndjson:
+            body = "".join(json.dumps(item) + "\n" for item in items)
+            response = client.post("/convert_points/batch", data=body, headers=headers, content_type="application/x-ndjson")
+            results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        else:
+            results = client.post("/convert_points/batch", json=items, headers=headers).get_json()["results"]
+    return sum(1 for result in results if result.get("success"))
+
+
+def state():
+    points = dict(((u, m), p) for u, m, p in db.session.query(UserPoints.user_id, UserPoints.merchant_id, UserPoints.points))
+    pools = dict(db.session.execute(
+        select(LiquidityShard.merchant_id, func.sum(LiquidityShard.balance)).group_by(LiquidityShard.merchant_id)).all())
+    return points, pools
+
+
+def check():
+    """``(drifted balances, pools whose ledger sum differs, negative shards)``, all zero when consistent."""
+    _, pools = state()
+    ledger = dict(db.session.execute(
+        select(PointsLedger.merchant_id, func.sum(PointsLedger.delta)).where(PointsLedger.account == POOL)
+        .group_by(PointsLedger.merchant_id)).all())
+    negative = LiquidityShard.query.filter(LiquidityShard.balance < 0).count()
+    return len(find_drift()), sum(1 for m, total in pools.items() if ledger.get(m) != total), negative
+
+
+def run(args, label, fn):
+    app = fresh_app(args)
+    with app.app_context():
+        started = time.perf_counter()
+        succeeded = fn(app)
+        seconds = time.perf_counter() - started
+        checks = check()
+        final = state()
+        db.session.remove()
+    return label, succeeded, seconds, checks, final
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--points", type=int, default=5000, help="starting balance per user and merchant")
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--loop-items", type=int, default=2000, help="items run through the per-item loop")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)  # Per-item log lines would dominate the loop
+
+    items = make_items(args.items, args.users, args.merchants, random.Random(7))
+    subset = items[:args.loop_items]
+    runs = [
+        run(args, "loop", lambda app: loop_convert(app, subset)),
+        run(args, "batch (same items)", lambda app: sum(1 for r in convert_batch(subset) if r.get("success"))),
+        run(args, "batch", lambda app: sum(1 for r in convert_batch(items) if r.get("success"))),
+        run(args, "http json", lambda app: post_batch(app, items, ndjson=False)),
+        run(args, "http ndjson", lambda app: post_batch(app, items, ndjson=True)),
+    ]
+
+    print(f"{args.users} users, {args.merchants} merchants")
+    print(f"{'path':>20} {'items':>7} {'ok':>7} {'seconds':>8} {'items/s':>9} {'drift':>6} {'pools':>6} {'negative':>9}")
+    for (label, succeeded, seconds, checks, _), count in zip(runs, (len(subset), len(subset)) + (len(items),) * 3):
+        print(f"{label:>20} {count:>7} {succeeded:>7} {seconds:>8.2f} {count / seconds:>9.0f} "
+              f"{checks[0]:>6} {checks[1]:>6} {checks[2]:>9}")
+    same = runs[0][4] == runs[1][4] and runs[0][1] == runs[1][1]
+    print(f"loop and batch end with the same balances and pools: {same}")
+    print(f"batch, json and ndjson end with the same balances and pools: {runs[2][4] == runs[3][4] == runs[4][4]}")
+
+
+if __name__ == "__main__":
+    main()
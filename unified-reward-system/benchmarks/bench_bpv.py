@@ -0,0 +1,76 @@
+"""Compares the per-merchant ORM BPV loop with the vectorized BPV engine.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_bpv --merchants 10000 100000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from app import db
+from app.models import Merchant
+from app.bpv_calculator import update_msf, update_sdbf, calculate_bpv
+from app.bpv_updater import update_merchant_bpv
+from benchmarks.support import make_bench_app
+
+
+def legacy_update_merchant_bpv():
+    """Pre-vectorization loop: scalar formulas on each ORM object, unit-of-work flush."""
+    for merchant in Merchant.query.all():
+        if merchant.last_update.tzinfo is None:
+            merchant.last_update = merchant.last_update.replace(tzinfo=timezone.utc)
+        time_since_update = (datetime.now(timezone.utc) - merchant.last_update).total_seconds() / 3600
+        if time_since_update >= 24:
+            merchant.msf = update_msf(merchant.msf, merchant.trade_volume, time_since_update)
+            merchant.sdbf = update_sdbf(merchant.sdbf, merchant.supply, merchant.demand)
+            merchant.trade_volume = 0
+            merchant.last_update = datetime.now(timezone.utc)
+            merchant.bpv = calculate_bpv(merchant.redemption_value, merchant.msf, merchant.sdbf)
+    db.session.commit()
+
+
+def seed_merchants(count, seed=7):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    db.session.execute(db.insert(Merchant), [
+        {"name": f"merchant-{i}", "redemption_value": rng.uniform(0.005, 0.05), "api_url": "http://localhost",
+         "supply": rng.randint(0, 5000), "demand": rng.randint(0, 5000), "msf": 1.0, "sdbf": 1.0,
+         "trade_volume": rng.randint(0, 100000),
+         # ~90% of merchants are due for an update
+         "last_update": now - timedelta(hours=rng.choice([2] + [30] * 9))}
+        for i in range(count)
+    ])
+    db.session.commit()
+
+
+def snapshot():
+    return sorted(db.session.query(Merchant.id, Merchant.msf, Merchant.sdbf, Merchant.bpv, Merchant.trade_volume))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--merchants", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'merchants':>10} {'loop s':>8} {'vector s':>9} {'speedup':>8}  results match")
+    for count in args.merchants:
+        timings, results = [], []
+        for fn in (legacy_update_merchant_bpv, update_merchant_bpv):
+            app = make_bench_app()
+            with app.app_context():
+                seed_merchants(count)
+                started = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - started)
+                results.append(snapshot())
+        match = all(
+            a[0] == b[0] and a[4] == b[4] and all(abs((x or 0) - (y or 0)) < 1e-9 for x, y in zip(a[1:4], b[1:4]))
+            for a, b in zip(*results)
+        )
+        print(f"{count:>10} {timings[0]:>8.2f} {timings[1]:>9.2f} {timings[0] / timings[1]:>7.1f}x  {match}")
+
+
+if __name__ == "__main__":
+    main()
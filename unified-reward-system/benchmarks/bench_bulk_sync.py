@@ -0,0 +1,63 @@
+"""Counts merchant requests for a full balance refresh: per-user vs batch endpoints.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_bulk_sync --users 20000 --batch-size 1000
+"""
+import argparse
+import time
+
+from app import db
+from app.models import User
+from app.sync_utils import sync_user_points, sync_all_user_points
+from benchmarks.support import make_bench_app, start_mock_api, seed_mock_merchants, MOCK_MERCHANTS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--per-user-sample", type=int, default=200, help="users synced one by one, then extrapolated")
+    args = parser.parse_args()
+
+    base_url, mock, server = start_mock_api()
+    requests_seen = [0]
+
+    @mock.app.before_request
+    def count_request():
+        requests_seen[0] += 1
+
+    phones = [f"+91{i:010d}" for i in range(1, args.users + 1)]
+    for name in MOCK_MERCHANTS:
+        mock.mock_db[name].update({phone: {"points": i % 997} for i, phone in enumerate(phones)})
+
+    app = make_bench_app()
+    with app.app_context():
+        seed_mock_merchants(base_url)
+        db.session.execute(db.insert(User), [
+            {"username": f"user-{i}", "password": "x", "phone": phone} for i, phone in enumerate(phones)
+        ])
+        db.session.commit()
+
+        sample = User.query.limit(args.per_user_sample).all()
+        requests_seen[0] = 0
+        started = time.perf_counter()
+        for user in sample:
+            sync_user_points(user, fetch_from_api=True)
+        per_user_seconds = (time.perf_counter() - started) / len(sample)
+        per_user_requests = requests_seen[0] / len(sample)
+
+        requests_seen[0] = 0
+        started = time.perf_counter()
+        written = sync_all_user_points(batch_size=args.batch_size)
+        bulk_seconds = time.perf_counter() - started
+
+    server.shutdown()
+    print(f"{args.users} users, {len(MOCK_MERCHANTS)} merchants")
+    print(f"per-user: {per_user_requests * args.users:>10.0f} requests, ~{per_user_seconds * args.users:.1f}s (extrapolated)")
+    print(f"batched:  {requests_seen[0]:>10} requests, {bulk_seconds:.1f}s, {written} balances written")
+    print(f"1M users at batch size {args.batch_size}: ~{len(MOCK_MERCHANTS) * -(-1_000_000 // args.batch_size)} requests")
+
+
+if __name__ == "__main__":
+    main()
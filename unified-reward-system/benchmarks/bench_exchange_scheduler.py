@@ -0,0 +1,77 @@
+"""Smart Exchange scheduler under a steady order stream, in simulated time.
+
+Every tick (one ``MATCH_INTERVAL_SECONDS``) a batch of random orders arrives
+and one scheduler run executes. Reports the queue depth over time, fill latency
+(cycle fills and pool spillover), and the wall time per run. Without the TTL
+the queue only grows; with it, depth is bounded by arrival rate x TTL.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_exchange_scheduler --ticks 200 --orders-per-tick 50 --ttl 300
+"""
+import argparse
+import logging
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from app import db, exchange_scheduler
+from app.exchange_scheduler import run_matching, scheduler_metrics
+from app.models import SmartExchange
+from benchmarks.bench_instant_exchange import make_exchange_app
+from benchmarks.support import seed, seed_pools
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--orders-per-tick", type=int, default=50)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--merchants", type=int, default=12)
+    parser.add_argument("--ttl", type=float, default=300, help="order TTL in simulated seconds")
+    parser.add_argument("--pool-balance", type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    app = make_exchange_app()
+    logging.getLogger().setLevel(logging.CRITICAL)
+    exchange_scheduler.ORDER_TTL_SECONDS = args.ttl
+    rng = random.Random(7)
+    interval = exchange_scheduler.MATCH_INTERVAL_SECONDS
+    start = datetime.now(timezone.utc) - timedelta(seconds=args.ticks * interval)
+
+    with app.app_context():
+        seed(args.users, args.merchants)
+        seed_pools({m: args.pool_balance for m in range(1, args.merchants + 1)})
+        print(f"{args.orders_per_tick} orders every {interval}s, TTL {args.ttl:.0f}s, "
+              f"{args.merchants} merchants, {args.ticks} ticks")
+        print(f"{'tick':>6} {'depth':>7} {'filled':>7} {'spilled':>8} {'expired':>8} {'run ms':>8}")
+        totals, run_times = {"filled": 0, "spilled": 0, "expired": 0}, []
+        for tick in range(args.ticks):
+            now = start + timedelta(seconds=tick * interval)
+            orders = []
+            for _ in range(args.orders_per_tick):
+                from_id, to_id = rng.sample(range(1, args.merchants + 1), 2)
+                orders.append({"user_id": rng.randint(1, args.users), "from_merchant_id": from_id,
+                               "to_merchant_id": to_id, "amount": rng.randint(10, 500),
+                               "status": "pending", "created_at": now})
+            db.session.execute(db.insert(SmartExchange), orders)
+            db.session.commit()
+
+            started = time.perf_counter()
+            stats = run_matching(now + timedelta(seconds=interval))
+            run_times.append(time.perf_counter() - started)
+            for key in totals:
+                totals[key] += stats[key]
+            if tick % max(1, args.ticks // 10) == 0 or tick == args.ticks - 1:
+                depth = SmartExchange.query.filter_by(status='pending').count()
+                print(f"{tick:>6} {depth:>7} {totals['filled']:>7} {totals['spilled']:>8} "
+                      f"{totals['expired']:>8} {run_times[-1] * 1000:>8.1f}")
+
+        metrics = scheduler_metrics(start + timedelta(seconds=args.ticks * interval))
+        print(f"fill latency p50 {metrics['fill_latency_p50_seconds']}s, p95 {metrics['fill_latency_p95_seconds']}s "
+              f"(last {metrics['fills_sampled']} fills); median run {statistics.median(run_times) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
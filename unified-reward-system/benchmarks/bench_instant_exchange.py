@@ -0,0 +1,92 @@
+"""Concurrent instant-exchange load test: swaps/s as workers grow, per pool shard count.
+
+Every worker is a different user swapping on the same hot merchant pair, so
+with one shard all debits hit a single pool row. After each run the pool
+totals are checked against the swaps that succeeded.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_instant_exchange --workers 1 2 4 8 --shards 1 8
+"""
+import argparse
+import logging
+import threading
+import time
+
+from flask_login import login_user
+
+import app as app_package
+from app import db, login_manager, make_celery
+from app.liquidity import POOL_SHARDS, pool_balances
+from app.models import LiquidityShard, User
+from benchmarks.support import make_bench_app, seed, seed_pools
+
+POOL_BALANCE = 10_000_000
+
+
+def make_exchange_app(**kwargs):
+    """Bench app able to run exchange code: login manager and a Celery app that is never contacted."""
+    app = make_bench_app(**kwargs)
+    app.config["SECRET_KEY"] = "bench"
+    app.config["CELERY_BROKER_URL"] = app.config["CELERY_RESULT_BACKEND"] = "memory://"
+    app_package.celery = make_celery(app)
+    login_manager.init_app(app)
+    return app
+
+
+def run(workers, shards, swaps_per_worker, amount, **app_kwargs):
+    app = make_exchange_app(**app_kwargs)
+    from app.exchange_utils import process_instant_exchange
+    from app.merchant_cache import get_merchant
+    logging.getLogger().setLevel(logging.CRITICAL)  # Per-swap log lines would dominate; failures show in "ok"
+
+    with app.app_context():
+        seed(workers, 2)
+        seed_pools({1: POOL_BALANCE, 2: POOL_BALANCE}, shards)
+
+    results, barrier = [], threading.Barrier(workers)
+
+    def worker(user_id):
+        ok = 0
+        with app.test_request_context():
+            login_user(db.session.get(User, user_id))
+            from_merchant, to_merchant = get_merchant(1), get_merchant(2)
+            barrier.wait()
+            for _ in range(swaps_per_worker):
+                _, status = process_instant_exchange(from_merchant, to_merchant, amount, amount)
+                ok += status == 200
+        results.append(ok)
+
+    threads = [threading.Thread(target=worker, args=(user_id,)) for user_id in range(1, workers + 1)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        succeeded = sum(results)
+        totals = pool_balances()
+        consistent = totals == {1: POOL_BALANCE - succeeded * amount, 2: POOL_BALANCE + succeeded * amount} \
+            and not LiquidityShard.query.filter(LiquidityShard.balance < 0).count()
+    return succeeded, workers * swaps_per_worker, elapsed, consistent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--swaps", type=int, default=200, help="swaps per worker")
+    parser.add_argument("--amount", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'shards':>7} {'workers':>8} {'swaps/s':>9} {'ok':>7} {'consistent':>11}")
+    for shards in args.shards:
+        for workers in args.workers:
+            succeeded, attempted, elapsed, consistent = run(workers, shards, args.swaps, args.amount)
+            print(f"{shards:>7} {workers:>8} {succeeded / elapsed:>9.0f} {succeeded:>4}/{attempted:<4} {str(consistent):>9}")
+
+
+if __name__ == "__main__":
+    main()
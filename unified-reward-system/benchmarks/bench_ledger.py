@@ -0,0 +1,72 @@
+"""Measures ledger writes, balance reads, point-in-time queries and cursor reads.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_ledger --users 2000 --entries 100000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timezone
+
+from app import db
+from app.ledger import advance_cursor, balance_at, find_drift, post, read_ledger, user_leg
+from app.models import UserPoints
+from benchmarks.support import make_bench_app, seed
+
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat * 1e6, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--merchants", type=int, default=10)
+    parser.add_argument("--entries", type=int, default=100000, help="two-leg journal entries to post")
+    parser.add_argument("--batch", type=int, default=1000, help="entries posted per transaction")
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    app = make_bench_app()
+    with app.app_context():
+        seed(args.users, args.merchants, points=0)
+
+        started = time.perf_counter()
+        for _ in range(0, args.entries, args.batch):
+            legs = []
+            for _ in range(args.batch):
+                user, (a, b) = rng.randint(1, args.users), rng.sample(range(1, args.merchants + 1), 2)
+                legs += [user_leg(user, a, -rng.randint(1, 50), "bench"), user_leg(user, b, rng.randint(1, 50), "bench")]
+            post(legs)
+            db.session.commit()
+        elapsed = time.perf_counter() - started
+        print(f"post: {args.entries / elapsed:,.0f} entries/s ({args.batch} per transaction)")
+
+        now = datetime.now(timezone.utc)
+        user = rng.randint(1, args.users)
+        read_us, _ = timed(lambda: UserPoints.query.filter_by(user_id=user, merchant_id=1).first().points, 200)
+        at_us, _ = timed(lambda: balance_at(user, 1, now), 200)
+        drift_us, drift = timed(lambda: find_drift([user]), 50)
+        print(f"materialized balance read: {read_us:8.0f} us")
+        print(f"balance_at (ledger sum):   {at_us:8.0f} us")
+        print(f"find_drift for one user:   {drift_us:8.0f} us  ({len(drift)} mismatches)")
+
+        rows = read_ledger("bench")
+        while rows:
+            advance_cursor("bench", rows[-1].id)
+            rows = read_ledger("bench")
+        db.session.commit()
+        post([user_leg(user, 1, 5, "bench"), user_leg(user, 2, -5, "bench")])
+        db.session.commit()
+        cursor_us, rows = timed(lambda: read_ledger("bench"), 50)
+        scan_us, _ = timed(lambda: db.session.query(UserPoints.user_id, UserPoints.merchant_id, UserPoints.points).all(), 5)
+        print(f"cursor read of new rows:   {cursor_us:8.0f} us  ({len(rows)} rows)")
+        print(f"full balance scan:         {scan_us:8.0f} us  ({args.users * args.merchants} rows)")
+
+
+if __name__ == "__main__":
+    main()
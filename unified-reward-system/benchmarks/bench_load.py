@@ -0,0 +1,341 @@
+"""End-to-end load test of the web app against the mock merchant API, plus core micro-benchmarks.
+
+Seeds ``--users`` users, ``--merchants`` merchants (with liquidity pools) and
+``--orders`` pending Smart Exchange orders into a scratch SQLite database,
+starts the mock merchant API with ``--latency-ms`` latency and serves the app
+over HTTP. ``--concurrency`` logged-in clients then drive ``/convert_points``
+(instant and smart), ``/dashboard`` and ``/get_points`` in the ``--mix``
+proportions for ``--duration`` seconds, while a background thread does what
+the scheduler leader and the Celery worker would (queued and cadence matching runs, outbox
+dispatch). Reports throughput, p50/p95/p99 latency and SQL statements per
+request for each action. The micro-benchmarks then time ``find_exchange_cycles``,
+``execute_cycle`` and ``update_merchant_bpv`` on a fresh copy of the same data.
+
+``--output`` saves the results as JSON; ``--compare`` prints the change
+against an earlier saved run.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_load --users 2000 --merchants 20 --orders 5000 --concurrency 8 \\
+        --duration 20 --latency-ms 50 --output load.json
+    python -m benchmarks.bench_load ... --compare load.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+from sqlalchemy import bindparam, event, update
+from werkzeug.security import generate_password_hash
+
+from app import db
+from app.bpv_updater import update_merchant_bpv
+from app.cyclic_matcher import execute_cycle, find_exchange_cycles
+from app.exchange_scheduler import MATCH_DEBOUNCE_SECONDS, MATCH_INTERVAL_SECONDS, run_scheduled
+from app.merchant_cache import merchant_cache
+from app.models import Merchant, SmartExchange, User
+from app.outbox import dispatch_outbox
+from app.sql_stats import count_statements
+from benchmarks.bench_quotes import make_quote_app
+from benchmarks.support import make_bench_app, seed, seed_pools, serve, start_mock_api
+
+ACTIONS = ("instant", "smart", "dashboard", "get_points")
+PASSWORD = "bench"
+DISPATCH_INTERVAL_SECONDS = 2  # As scheduled in app/jobs.py
+STATEMENTS_HEADER = "X-Bench-Statements"
+
+
+def parse_mix(text):
+    """``"instant=4,smart=2,..."`` -> ``{action: weight}``."""
+    mix = {}
+    for part in text.split(","):
+        action, _, weight = part.partition("=")
+        if action not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"unknown action {action!r}, expected one of {', '.join(ACTIONS)}")
+        mix[action] = float(weight or 1)
+    return mix
+
+
+def count_request_statements(app):
+    """Counts SQL statements per request thread and returns the count in a response header."""
+    local = threading.local()
+
+    def on_execute(*args):
+        if getattr(local, "statements", None) is not None:
+            local.statements += 1
+
+    def start():
+        local.statements = 0
+
+    def finish(response):
+        response.headers[STATEMENTS_HEADER] = str(local.statements or 0)
+        local.statements = None
+        return response
+
+    event.listen(db.engine, "before_cursor_execute", on_execute)
+    app.before_request(start)
+    app.after_request(finish)
+
+
+def prepare(app, args, base_url, mock):
+    """Seeds the scratch database and the mock merchant API; returns the merchant names."""
+    seed(args.users, args.merchants, args.orders)
+    seed_pools({m: 10_000_000 for m in range(1, args.merchants + 1)})
+    names = [f"merchant-{m}" for m in range(1, args.merchants + 1)]
+    table = Merchant.__table__
+    db.session.execute(update(table).where(table.c.id == bindparam("merchant_id")).values(api_url=bindparam("url")),
+                       [{"merchant_id": m, "url": f"{base_url}/api/{name}/rewards"} for m, name in enumerate(names, 1)])
+    db.session.execute(update(User).where(User.id <= args.concurrency).values(password=generate_password_hash(PASSWORD)))
+    db.session.commit()
+    for name in names:
+        mock.mock_db[name] = {}
+    return names
+
+
+def background_jobs(app, stop, wake):
+    """Queued and cadence Smart Exchange runs, and outbox dispatch, as the scheduler leader and the Celery worker do."""
+    last_dispatch = 0.0
+    while not stop.is_set():
+        queued = wake.wait(MATCH_INTERVAL_SECONDS)
+        wake.clear()
+        if queued:
+            time.sleep(MATCH_DEBOUNCE_SECONDS)  # The task's countdown
+        # A context per job, as in app/jobs.py: an idle open transaction would hold SQLite's write lock
+        with app.app_context():
+            try:
+                run_scheduled(queued=queued)
+                if time.monotonic() - last_dispatch >= DISPATCH_INTERVAL_SECONDS:
+                    dispatch_outbox()
+                    last_dispatch = time.monotonic()
+            except Exception as e:
+                logging.warning(f"⚠️ Background job failed: {e}")
+
+
+def client(base_url, user_id, names, mix, deadline, seed_value, samples):
+    """One logged-in user issuing requests back to back until ``deadline``."""
+    rng = random.Random(seed_value)
+    session = requests.Session()
+    response = session.post(f"{base_url}/login", data={"username": f"user-{user_id}", "password": PASSWORD},
+                            allow_redirects=False)
+    if response.status_code != 302:
+        raise RuntimeError(f"login failed for user-{user_id}: {response.status_code}")
+    actions, weights = list(mix), list(mix.values())
+    while time.monotonic() < deadline:
+        action = rng.choices(actions, weights)[0]
+        started = time.perf_counter()
+        try:
+            if action in ("instant", "smart"):
+                from_name, to_name = rng.sample(names, 2)
+                response = session.post(f"{base_url}/convert_points", json={
+                    "from_merchant": from_name, "to_merchant": to_name,
+                    "amount": rng.randint(10, 500), "exchange_type": action,
+                })
+            else:
+                response = session.get(f"{base_url}/{action}", allow_redirects=False)
+            status, statements = response.status_code, int(response.headers.get(STATEMENTS_HEADER, 0))
+        except requests.RequestException:
+            status, statements = 0, 0
+        samples.append((action, status, time.perf_counter() - started, statements))
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def summarize(samples, seconds):
+    latencies = sorted(latency for _, _, latency, _ in samples)
+    if not latencies:
+        return {"requests": 0}
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / seconds, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "rejected": sum(1 for _, status, _, _ in samples if 400 <= status < 500),  # e.g. insufficient points
+        "errors": sum(1 for _, status, _, _ in samples if status == 0 or status >= 500),
+        "statements_per_request": round(statistics.mean(s for _, _, _, s in samples), 2),
+    }
+
+
+def run_load(args):
+    base_url, mock, mock_server = start_mock_api(args.latency_ms, args.jitter_ms)
+    app = make_quote_app()
+    merchant_cache.invalidate()
+    with app.app_context():
+        names = prepare(app, args, base_url, mock)
+        count_request_statements(app)
+
+    stop, wake = threading.Event(), threading.Event()
+    from app import tasks
+    tasks.process_smart_exchanges.apply_async = lambda **kwargs: wake.set()  # Executed by background_jobs
+    jobs = threading.Thread(target=background_jobs, args=(app, stop, wake), daemon=True)
+    jobs.start()
+
+    app_url, app_server = serve(app)
+    samples = []
+    with app.app_context(), count_statements(all_threads=True) as counter:
+        deadline = time.monotonic() + args.duration
+        clients = [threading.Thread(target=client, args=(app_url, user_id, names, args.mix, deadline, user_id, samples))
+                   for user_id in range(1, args.concurrency + 1)]
+        started = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        seconds = time.perf_counter() - started
+    stop.set()
+    wake.set()
+    jobs.join()
+    app_server.shutdown()
+    mock_server.shutdown()
+
+    with app.app_context():
+        pending = SmartExchange.query.filter_by(status='pending').count()
+    results = {action: summarize([s for s in samples if s[0] == action], seconds) for action in args.mix}
+    results["all"] = summarize(samples, seconds)
+    results["all"].update({"seconds": round(seconds, 2), "total_statements": counter.statements,
+                           "pending_orders_after": pending})
+    return results
+
+
+def timed(fn, repeats):
+    """Median seconds and statements of ``fn()`` over ``repeats`` calls, and its last result."""
+    seconds, statements, result = [], [], None
+    for _ in range(repeats):
+        with count_statements() as counter:
+            result = fn()
+        seconds.append(counter.seconds)
+        statements.append(counter.statements)
+    return {"median_ms": round(statistics.median(seconds) * 1000, 3), "statements": statistics.median(statements),
+            "repeats": repeats}, result
+
+
+def run_micro(args):
+    app = make_bench_app()
+    merchant_cache.invalidate()
+    results = {}
+    with app.app_context():
+        seed(args.users, args.merchants, args.orders)
+        pending = SmartExchange.query.filter_by(status='pending').all()
+        results["find_exchange_cycles"], cycles = timed(lambda: find_exchange_cycles(pending), args.repeats)
+        results["find_exchange_cycles"].update({"orders": len(pending), "cycles": len(cycles)})
+
+        settled = iter(cycles[:args.repeats])
+        if cycles:
+            results["execute_cycle"], _ = timed(lambda: execute_cycle(next(settled)), min(args.repeats, len(cycles)))
+
+        def stale_bpv_update():
+            db.session.execute(update(Merchant).values(last_update=datetime.now(timezone.utc) - timedelta(days=2)))
+            db.session.commit()
+            with count_statements() as counter:
+                updated = update_merchant_bpv()
+            return counter, updated
+
+        runs = [stale_bpv_update() for _ in range(args.repeats)]
+        results["update_merchant_bpv"] = {
+            "median_ms": round(statistics.median(c.seconds for c, _ in runs) * 1000, 3),
+            "statements": statistics.median(c.statements for c, _ in runs),
+            "repeats": args.repeats, "merchants": runs[-1][1],
+        }
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"git_commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "database": "sqlite",
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+
+
+def print_results(results):
+    print(f"{'action':>12} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'4xx':>5} {'errors':>6} {'SQL/req':>8}")
+    for action, row in results["load"].items():
+        if not row["requests"]:
+            continue
+        print(f"{action:>12} {row['requests']:>9} {row['throughput_rps']:>8.1f} {row['p50_ms']:>8.1f} "
+              f"{row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['rejected']:>5} {row['errors']:>6} "
+              f"{row['statements_per_request']:>8.1f}")
+    overall = results["load"]["all"]
+    print(f"{overall['total_statements']} statements in {overall['seconds']}s (requests and background jobs), "
+          f"{overall['pending_orders_after']} orders still pending")
+    for name, row in results.get("micro", {}).items():
+        extra = ", ".join(f"{k} {v}" for k, v in row.items() if k not in ("median_ms", "statements", "repeats"))
+        print(f"{name:>22}: median {row['median_ms']:.2f}ms, {row['statements']:g} statements" + (f" ({extra})" if extra else ""))
+
+
+def compare(results, baseline):
+    """Prints throughput/latency and micro-benchmark changes against a saved run."""
+    print(f"\nvs {baseline['environment'].get('git_commit')} ({baseline['environment'].get('recorded_at')}):")
+    for action, row in results["load"].items():
+        old = baseline.get("load", {}).get(action)
+        if old and old.get("requests") and row["requests"]:
+            print(f"{action:>12}: req/s {old['throughput_rps']:.1f} -> {row['throughput_rps']:.1f} "
+                  f"({change(old['throughput_rps'], row['throughput_rps'])}), "
+                  f"p95 {old['p95_ms']:.1f} -> {row['p95_ms']:.1f}ms ({change(old['p95_ms'], row['p95_ms'])})")
+    for name, row in results.get("micro", {}).items():
+        old = baseline.get("micro", {}).get(name)
+        if old:
+            print(f"{name:>22}: {old['median_ms']:.2f} -> {row['median_ms']:.2f}ms "
+                  f"({change(old['median_ms'], row['median_ms'])})")
+
+
+def change(old, new):
+    return f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--orders", type=int, default=5000, help="pending Smart Exchange orders seeded")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent logged-in clients")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--mix", type=parse_mix, default="instant=4,smart=2,dashboard=2,get_points=2")
+    parser.add_argument("--repeats", type=int, default=5, help="runs per micro-benchmark")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+    if args.concurrency > args.users:
+        parser.error("--concurrency cannot exceed --users (each client is a different user)")
+    logging.disable(logging.INFO)  # Per-request log lines otherwise
+
+    results = {
+        "benchmark": "load",
+        "environment": environment(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "load": run_load(args),
+    }
+    if not args.skip_micro:
+        results["micro"] = run_micro(args)
+
+    print(f"{args.concurrency} clients for {args.duration:g}s, {args.users} users, {args.merchants} merchants, "
+          f"{args.orders} orders, mock latency {args.latency_ms:g}ms ±{args.jitter_ms:g}ms")
+    print_results(results)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Smart Exchange matching triggers during a submission burst: one task per order vs coalesced.
+
+Orders arrive in a burst from concurrent submitters. "per order" runs a full
+matching pass per submission, as the old one-task-per-order trigger did;
+"coalesced" goes through ``request_matching``, and every queued task is then
+executed once via ``run_scheduled``, which feeds the new orders through the
+incremental order book. Reports tasks enqueued vs runs executed,
+total matching time and the orders left pending (they differ a little, as
+matching the whole burst at once pairs orders differently than one at a time).
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_match_triggers --orders 500 --submitters 8
+"""
+import argparse
+import logging
+import random
+import threading
+import time
+
+from app import db, exchange_scheduler
+from app.exchange_scheduler import FLIGHT_NAME, request_matching, run_matching, run_scheduled
+from app.models import SmartExchange
+from app.order_book import reset_order_book
+from app.single_flight import get_flight, reset_flights
+from benchmarks.bench_instant_exchange import make_exchange_app
+from benchmarks.support import seed, seed_pools
+
+
+def submit_burst(app, orders, submitters, merchants, users, trigger):
+    """Inserts ``orders`` from ``submitters`` threads, calling ``trigger()`` after each commit."""
+    per_thread = orders // submitters
+
+    def submitter(seed_value):
+        rng = random.Random(seed_value)
+        with app.app_context():
+            for _ in range(per_thread):
+                from_id, to_id = rng.sample(range(1, merchants + 1), 2)
+                db.session.add(SmartExchange(user_id=rng.randint(1, users), from_merchant_id=from_id,
+                                             to_merchant_id=to_id, amount=rng.randint(10, 500), status='pending'))
+                db.session.commit()
+                trigger()
+
+    threads = [threading.Thread(target=submitter, args=(i,)) for i in range(submitters)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return per_thread * submitters
+
+
+def run(mode, orders, submitters, merchants, users):
+    app = make_exchange_app()
+    logging.disable(logging.INFO)  # A log line per run otherwise
+    reset_flights()
+    reset_order_book(0)  # Fresh database: none of its orders have been matched yet
+    with app.app_context():
+        seed(users, merchants)
+        seed_pools({m: 10_000_000 for m in range(1, merchants + 1)})
+
+    queued, matching_seconds = [], [0.0]
+    lock = threading.Lock()
+
+    def per_order():
+        started = time.perf_counter()
+        with lock:  # One worker executing the queued tasks one after another
+            run_matching()
+        matching_seconds[0] += time.perf_counter() - started
+
+    with app.app_context():
+        if mode == "per order":
+            submitted = submit_burst(app, orders, submitters, merchants, users, per_order)
+            tasks = runs = submitted
+        else:
+            # Queue the task the way Celery would, but drain it here instead of in a worker
+            exchange_scheduler.MATCH_DEBOUNCE_SECONDS = 0
+            from app import tasks as task_module
+            task_module.process_smart_exchanges.apply_async = lambda **kwargs: queued.append(kwargs)
+            submitted = submit_burst(app, orders, submitters, merchants, users, request_matching)
+            started = time.perf_counter()
+            while queued:
+                queued.pop()
+                run_scheduled(queued=True)
+            run_scheduled()  # Cadence run: anything still dirty
+            matching_seconds[0] = time.perf_counter() - started
+            counters = get_flight(FLIGHT_NAME).counters()
+            tasks, runs = counters.get("enqueued", 0), counters.get("matching_runs", 0)
+        pending = SmartExchange.query.filter_by(status='pending').count()
+    return submitted, tasks, runs, matching_seconds[0], pending
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--submitters", type=int, default=8)
+    parser.add_argument("--merchants", type=int, default=12)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'mode':>10} {'orders':>7} {'tasks':>6} {'runs':>5} {'matching s':>11} {'pending':>8}")
+    for mode in ("per order", "coalesced"):
+        submitted, tasks, runs, seconds, pending = run(mode, args.orders, args.submitters, args.merchants, args.users)
+        print(f"{mode:>10} {submitted:>7} {tasks:>6} {runs:>5} {seconds:>11.2f} {pending:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Compares the flow-based Smart Exchange matcher with the legacy DFS matcher.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_matcher --orders 1000 10000 100000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from app.cyclic_matcher import find_exchange_cycles
+
+
+def synthetic_order_book(num_orders, num_merchants=20, seed=7):
+    """Random pending orders between ``num_merchants`` merchants."""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    orders = []
+    for order_id in range(1, num_orders + 1):
+        from_id, to_id = rng.sample(range(1, num_merchants + 1), 2)
+        orders.append(SimpleNamespace(
+            id=order_id,
+            user_id=rng.randint(1, max(1, num_orders // 4)),
+            from_merchant_id=from_id,
+            to_merchant_id=to_id,
+            amount=rng.randint(10, 1000),
+            status="pending",
+            created_at=start + timedelta(seconds=order_id),
+        ))
+    bpvs = {merchant_id: round(rng.uniform(0.5, 1.5), 3) for merchant_id in range(1, num_merchants + 1)}
+    return orders, bpvs
+
+
+def legacy_find_exchange_cycles(pending_exchanges, merchant_bpvs, deadline):
+    """The pre-flow DFS matcher, cut off at ``deadline`` so the benchmark terminates."""
+    graph = defaultdict(list)
+    for exchange in pending_exchanges:
+        graph[exchange.from_merchant_id].append((exchange.to_merchant_id, exchange, merchant_bpvs[exchange.from_merchant_id]))
+
+    cycles = []
+    for start in graph:
+        stack = [(start, [])]
+        while stack:
+            if time.perf_counter() > deadline:
+                return cycles, True
+            node, path = stack.pop()
+            for neighbor, exchange, bpv in graph[node]:
+                if neighbor == start and len(path) > 1:
+                    cycles.append(path + [(exchange, bpv)])
+                elif neighbor not in path:
+                    stack.append((neighbor, path + [(exchange, bpv)]))
+    return cycles, False
+
+
+def legacy_cleared_volume(cycles):
+    """Volume the legacy ``execute_cycle`` would clear applying cycles in order."""
+    remaining = {}
+    cleared = 0
+    for cycle in cycles:
+        fill = min(remaining.setdefault(exchange.id, exchange.amount) for exchange, _ in cycle)
+        if fill <= 0:
+            continue
+        for exchange, _ in cycle:
+            remaining[exchange.id] -= fill
+        cleared += fill * len(cycle)
+    return cleared
+
+
+def measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--dfs-budget", type=float, default=10.0, help="seconds before the DFS run is cut off")
+    args = parser.parse_args()
+
+    print(f"{'orders':>8} {'matcher':>8} {'seconds':>9} {'peak MiB':>9} {'cycles':>8} {'cleared':>10}  note")
+    for num_orders in args.orders:
+        orders, bpvs = synthetic_order_book(num_orders, args.merchants)
+        total = sum(order.amount for order in orders)
+
+        (cycles, timed_out), elapsed, peak = measure(
+            lambda: legacy_find_exchange_cycles(orders, bpvs, time.perf_counter() + args.dfs_budget)
+        )
+        note = "cut off at budget" if timed_out else ""
+        print(f"{num_orders:>8} {'dfs':>8} {elapsed:>9.3f} {peak / 2**20:>9.1f} {len(cycles):>8} "
+              f"{legacy_cleared_volume(cycles):>10}  {note}")
+
+        cycles, elapsed, peak = measure(lambda: find_exchange_cycles(orders, bpvs))
+        cleared = sum(fill for cycle in cycles for _, _, fill in cycle)
+        print(f"{num_orders:>8} {'flow':>8} {elapsed:>9.3f} {peak / 2**20:>9.1f} {len(cycles):>8} "
+              f"{cleared:>10}  of {total} submitted")
+
+
+if __name__ == "__main__":
+    main()
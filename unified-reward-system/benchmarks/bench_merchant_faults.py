@@ -0,0 +1,73 @@
+"""Balance page fan-out against a faulty mock merchant API, with and without breakers and hedging.
+
+One merchant is down, one has a slow tail; the others are healthy. Each
+request asks all four for a user's balance under the page-load deadline, as
+``get_points`` does. "plain" disables circuit breakers, adaptive timeouts and
+hedged reads; "resilient" uses the defaults.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_merchant_faults --requests 200 --slow-rate 0.05 --slow-ms 1500
+"""
+import argparse
+import logging
+import statistics
+import time
+
+from app import merchant_client
+from app.merchant_cache import merchant_cache
+from benchmarks.support import make_bench_app, start_mock_api, seed_mock_merchants
+
+PHONE = "+910123456789"
+
+
+def run(merchants, requests, deadline):
+    samples, live = [], 0
+    for _ in range(requests):
+        started = time.perf_counter()
+        live += len(merchant_client.fetch_points(merchants, PHONE, deadline))
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return (statistics.median(samples) * 1000, samples[int(len(samples) * 0.99) - 1] * 1000,
+            samples[-1] * 1000, live / (requests * len(merchants)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-ms", type=float, default=1500)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)  # One warning per failed call otherwise
+
+    base_url, module, server = start_mock_api(args.latency_ms, args.jitter_ms)
+    module.FAULTS.update({"dominos": {"down": True},
+                          "amazon": {"slow_rate": args.slow_rate, "slow_ms": args.slow_ms}})
+    app = make_bench_app()
+    merchant_cache.invalidate()
+    with app.app_context():
+        seed_mock_merchants(base_url)
+        merchants = list(merchant_cache.snapshot().by_id.values())
+
+    defaults = (merchant_client.HEDGE_READS, merchant_client.BREAKER_FAILURES, merchant_client.LATENCY_MIN_SAMPLES)
+    print(f"mock latency {args.latency_ms}ms ±{args.jitter_ms}ms; dominos down; "
+          f"amazon {args.slow_rate:.0%} of calls +{args.slow_ms:.0f}ms; deadline {merchant_client.INTERACTIVE_DEADLINE}s")
+    print(f"{'mode':>10} {'median ms':>10} {'p99 ms':>8} {'max ms':>8} {'live':>6}")
+    for mode in ("plain", "resilient"):
+        merchant_client.reset_health()
+        if mode == "plain":
+            merchant_client.HEDGE_READS = False
+            merchant_client.BREAKER_FAILURES = merchant_client.LATENCY_MIN_SAMPLES = float("inf")
+        else:
+            merchant_client.HEDGE_READS, merchant_client.BREAKER_FAILURES, merchant_client.LATENCY_MIN_SAMPLES = defaults
+        median, p99, worst, live = run(merchants, args.requests, merchant_client.INTERACTIVE_DEADLINE)
+        print(f"{mode:>10} {median:>10.1f} {p99:>8.1f} {worst:>8.1f} {live:>6.0%}")
+    for api_url, stats in merchant_client.health_stats().items():
+        print(f"  {api_url.rsplit('/', 2)[-2]:>10} {stats}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Compares sequential and concurrent merchant sync against the mock merchant API.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_merchant_sync --latency-ms 100 --jitter-ms 50
+"""
+import argparse
+import statistics
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app import db
+from app.models import User, UserPoints, Merchant
+from app.sync_utils import sync_user_points
+from benchmarks.support import make_bench_app, start_mock_api, seed_mock_merchants
+
+
+def legacy_sync_user_points(user, fetch_from_api=False):
+    """Pre-fan-out sync: new session per call, one merchant at a time."""
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
+    session.mount("http://", HTTPAdapter(max_retries=retries))
+    for merchant in Merchant.query.all():
+        if fetch_from_api:
+            response = session.get(f"{merchant.api_url}/rewards/{user.phone}", timeout=10)
+            user_points = UserPoints.query.filter_by(user_id=user.id, merchant_id=merchant.id).first()
+            if response.status_code == 200:
+                points = response.json().get("points", 0)
+                if not user_points:
+                    db.session.add(UserPoints(user_id=user.id, merchant_id=merchant.id, points=points))
+                else:
+                    user_points.points = points
+        else:
+            user_points = UserPoints.query.filter_by(user_id=user.id, merchant_id=merchant.id).first()
+            session.post(f"{merchant.api_url}/rewards/update",
+                         json={"user_phone": user.phone, "points_change": user_points.points if user_points else 0},
+                         timeout=10)
+    db.session.commit()
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000, max(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    base_url, _, server = start_mock_api(args.latency_ms, args.jitter_ms)
+    app = make_bench_app()
+    with app.app_context():
+        seed_mock_merchants(base_url)
+        user = User(username="bench", password="x", phone="+910123456789")
+        db.session.add(user)
+        db.session.commit()
+
+        print(f"mock latency {args.latency_ms}ms ±{args.jitter_ms}ms, {Merchant.query.count()} merchants")
+        print(f"{'path':>8} {'mode':>11} {'median ms':>10} {'max ms':>8}")
+        for fetch in (True, False):
+            path = "fetch" if fetch else "push"
+            for mode, fn in (("sequential", legacy_sync_user_points), ("concurrent", sync_user_points)):
+                median, worst = timed(lambda: fn(user, fetch_from_api=fetch), args.repeat)
+                print(f"{path:>8} {mode:>11} {median:>10.1f} {worst:>8.1f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Overhead of the /metrics instrumentation and of sampled hot-path logging.
+
+Serves the same routes through the test client with and without the request
+and SQL hooks: ``/quote`` (no SQL, so the request hooks dominate) and
+``/smart_exchange/metrics`` (a few statements each). Then times a scrape of
+``/metrics`` and a hot-path log call that is sampled out vs one that is written.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_metrics --requests 5000
+"""
+import argparse
+import io
+import logging
+import statistics
+import time
+
+from app import db, metrics
+from app.logs import log_event
+from benchmarks.bench_quotes import make_quote_app
+from benchmarks.support import seed, seed_pools
+
+
+def per_request_us(clients, path, requests_, query_string=None):
+    """Median microseconds per request for each client; requests alternate between them so drift cancels out."""
+    samples = [[] for _ in clients]
+    for _ in range(requests_):
+        for client, client_samples in zip(clients, samples):
+            started = time.perf_counter()
+            client.get(path, query_string=query_string)
+            client_samples.append(time.perf_counter() - started)
+    return [statistics.median(client_samples) * 1e6 for client_samples in samples]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--merchants", type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    quote = {"from_merchant": "merchant-1", "to_merchant": "merchant-2", "amount": 100}
+    print(f"{'route':>24} {'plain us':>9} {'metrics us':>11} {'overhead us':>12}")
+    clients = []
+    for instrumented in (False, True):
+        app = make_quote_app()
+        with app.app_context():
+            seed(1, args.merchants)
+            seed_pools({m: 20000 for m in range(1, args.merchants + 1)})
+            if instrumented:
+                metrics.init_app(app, db.engine)
+        clients.append(app.test_client())
+    for path, query in (("/quote", quote), ("/smart_exchange/metrics", None)):
+        per_request_us(clients, path, 200, query)  # Warm caches
+        plain, measured = per_request_us(clients, path, args.requests, query)
+        print(f"{path:>24} {plain:>9.1f} {measured:>11.1f} {measured - plain:>12.1f}")
+
+    client = clients[1]
+    started = time.perf_counter()
+    body = client.get("/metrics").get_data(as_text=True)
+    print(f"/metrics scrape: {(time.perf_counter() - started) * 1000:.2f}ms, "
+          f"{sum(1 for line in body.splitlines() if not line.startswith('#'))} samples")
+
+    logging.disable(logging.NOTSET)
+    logger = logging.getLogger("bench_metrics")
+    logger.propagate = False
+    logger.addHandler(logging.StreamHandler(io.StringIO()))
+    logger.setLevel(logging.INFO)
+    for label, rate in (("sampled out (1%)", 0.01), ("written", 1.0)):
+        started = time.perf_counter()
+        for i in range(args.requests):
+            log_event(logger, logging.INFO, "🔹 instant_exchange", rate, user_id=i, amount=100,
+                      from_merchant="merchant-1", to_merchant="merchant-2")
+        print(f"log_event {label}: {(time.perf_counter() - started) / args.requests * 1e6:.2f}us per call")
+
+
+if __name__ == "__main__":
+    main()
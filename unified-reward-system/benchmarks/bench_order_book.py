@@ -0,0 +1,39 @@
+"""Measures per-order insert + match cost of the incremental order book.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_order_book --sizes 1000 10000 100000
+"""
+import argparse
+import time
+
+from app.order_book import OrderBook
+from benchmarks.bench_matcher import synthetic_order_book
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--probe", type=int, default=1000, help="orders inserted after the book is built")
+    args = parser.parse_args()
+
+    print(f"{'book size':>10} {'us/order':>9} {'cycles':>8} {'cleared':>10}")
+    for size in args.sizes:
+        orders, _ = synthetic_order_book(size + args.probe, args.merchants)
+        # Pre-load one direction only so the resting book has no cycles of its own
+        resting = [o for o in orders[:size] if o.from_merchant_id < o.to_merchant_id]
+        book = OrderBook.from_pending(resting)
+
+        started = time.perf_counter()
+        cycles = []
+        for order in orders[size:]:
+            cycles.extend(book.add(order))
+        elapsed = time.perf_counter() - started
+
+        cleared = sum(fill for cycle in cycles for _, fill in cycle)
+        print(f"{len(resting):>10} {elapsed / args.probe * 1e6:>9.1f} {len(cycles):>8} {cleared:>10}")
+
+
+if __name__ == "__main__":
+    main()
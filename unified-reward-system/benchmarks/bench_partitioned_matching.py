@@ -0,0 +1,61 @@
+"""Whole-graph vs SCC-partitioned (serial and process pool) circulation on clustered merchant graphs.
+
+Merchants form ``--clusters`` groups that trade mostly among themselves; a
+share of orders crosses clusters in one direction only, so each cluster is its
+own strongly connected component. Reports matching time and cleared volume
+(which partitioning must not reduce).
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_partitioned_matching --clusters 40 --merchants-per-cluster 30 --processes 1 4
+"""
+import argparse
+import random
+import time
+from collections import defaultdict
+
+from app.cyclic_matcher import max_circulation, partitioned_circulation
+
+
+def clustered_capacity(clusters, per_cluster, orders, cross_share=0.05, seed=7):
+    """``{(from, to): volume}`` for random orders inside clusters plus one-way cross-cluster orders."""
+    rng = random.Random(seed)
+    capacity = defaultdict(int)
+    for _ in range(orders):
+        cluster = rng.randrange(clusters)
+        if rng.random() < cross_share and cluster < clusters - 1:
+            from_id = cluster * per_cluster + rng.randrange(per_cluster)
+            to_id = rng.randrange(cluster + 1, clusters) * per_cluster + rng.randrange(per_cluster)
+        else:
+            from_id, to_id = (cluster * per_cluster + m for m in rng.sample(range(per_cluster), 2))
+        capacity[(from_id, to_id)] += rng.randint(10, 1000)
+    return dict(capacity)
+
+
+def timed(fn):
+    started = time.perf_counter()
+    flow = fn()
+    return time.perf_counter() - started, sum(flow.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clusters", type=int, default=40)
+    parser.add_argument("--merchants-per-cluster", type=int, default=30)
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    capacity = clustered_capacity(args.clusters, args.merchants_per_cluster, args.orders)
+    print(f"{args.clusters} clusters x {args.merchants_per_cluster} merchants, {len(capacity)} edges from {args.orders} orders")
+    print(f"{'mode':>16} {'seconds':>8} {'cleared':>11}")
+    seconds, cleared = timed(lambda: max_circulation(capacity))
+    print(f"{'whole graph':>16} {seconds:>8.2f} {cleared:>11}")
+    for processes in args.processes:
+        partitioned_circulation(capacity, processes)  # Start the pool outside the timing
+        seconds, cleared = timed(lambda: partitioned_circulation(capacity, processes))
+        print(f"{f'partitioned x{processes}':>16} {seconds:>8.2f} {cleared:>11}")
+
+
+if __name__ == "__main__":
+    main()
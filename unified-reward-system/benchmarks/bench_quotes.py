@@ -0,0 +1,91 @@
+"""Measures /quote throughput and latency served from the in-memory snapshot.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_quotes --merchants 50 --quotes 20000
+"""
+import argparse
+import random
+import statistics
+import time
+
+import app as app_package
+from app import db, login_manager, make_celery
+from app.sql_stats import count_statements
+from benchmarks.support import make_bench_app, seed, seed_pools
+
+
+def make_quote_app():
+    """Bench app with the main blueprint registered (Celery is configured but never contacted)."""
+    app = make_bench_app()
+    app.config["SECRET_KEY"] = "bench"
+    app.config["CELERY_BROKER_URL"] = app.config["CELERY_RESULT_BACKEND"] = "memory://"
+    app_package.celery = make_celery(app)
+    login_manager.init_app(app)
+    from app.routes import main
+    app.register_blueprint(main)
+    return app
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (statistics.median(samples) * 1e6, samples[int(len(samples) * 0.99) - 1] * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--merchants", type=int, default=50)
+    parser.add_argument("--quotes", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args()
+
+    app = make_quote_app()
+    rng = random.Random(3)
+    with app.app_context():
+        seed(1, args.merchants)
+        seed_pools({m: rng.choice([0, 2000, 20000]) for m in range(1, args.merchants + 1)})
+
+    names = [f"merchant-{i}" for i in range(1, args.merchants + 1)]
+    requests_ = [(*rng.sample(names, 2), rng.choice([50, 500, 5000, 50000])) for _ in range(args.quotes)]
+
+    from app.quotes import build_quote
+    print(f"{'path':>14} {'quotes/s':>10} {'p50 us':>8} {'p99 us':>8} {'SQL':>5}")
+    with app.app_context():
+        build_quote(*requests_[0])  # Warm the merchant cache and rate matrix
+        samples = []
+        with count_statements() as counter:
+            started = time.perf_counter()
+            for request in requests_:
+                t = time.perf_counter()
+                build_quote(*request)
+                samples.append(time.perf_counter() - t)
+            elapsed = time.perf_counter() - started
+        print(f"{'build_quote':>14} {len(requests_) / elapsed:>10.0f} {percentiles(samples)[0]:>8.1f} "
+              f"{percentiles(samples)[1]:>8.1f} {counter.statements:>5}")
+
+    client = app.test_client()
+    samples = []
+    started = time.perf_counter()
+    for from_name, to_name, amount in requests_:
+        t = time.perf_counter()
+        client.get("/quote", query_string={"from_merchant": from_name, "to_merchant": to_name, "amount": amount})
+        samples.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    p50, p99 = percentiles(samples)
+    print(f"{'GET /quote':>14} {len(requests_) / elapsed:>10.0f} {p50:>8.1f} {p99:>8.1f} {'-':>5}")
+
+    batches = [requests_[i:i + args.batch] for i in range(0, len(requests_), args.batch)]
+    samples = []
+    started = time.perf_counter()
+    for batch in batches:
+        t = time.perf_counter()
+        client.post("/quote/batch", json=[{"from_merchant": f, "to_merchant": to, "amount": a} for f, to, a in batch])
+        samples.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    p50, p99 = percentiles(samples)
+    print(f"{'POST /batch':>14} {len(requests_) / elapsed:>10.0f} {p50:>8.1f} {p99:>8.1f} {'-':>5}  "
+          f"(latency per {args.batch}-quote batch)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Measures rate-matrix rebuild time and rate lookup latency.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_rate_matrix --merchants 100 500 1000
+"""
+import argparse
+import random
+import time
+from types import SimpleNamespace
+
+from app.merchant_cache import MerchantSnapshot
+from app.rate_matrix import RateMatrix
+
+
+def synthetic_snapshot(count, seed=7):
+    rng = random.Random(seed)
+    merchants = [
+        SimpleNamespace(id=i, name=f"merchant-{i}", redemption_value=rng.uniform(0.005, 0.05), api_url="",
+                        supply=1000, demand=1000, msf=1.0, sdbf=1.0)
+        for i in range(1, count + 1)
+    ]
+    pools = {m.id: rng.choice([0, 500, 5000, 50000]) for m in merchants}
+    return MerchantSnapshot(merchants, version=1), pools
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--merchants", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--lookups", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'merchants':>10} {'rebuild s':>10} {'direct us':>10} {'bpv us':>10}")
+    for count in args.merchants:
+        snapshot, pools = synthetic_snapshot(count)
+        started = time.perf_counter()
+        matrix = RateMatrix(snapshot, pools)
+        rebuild = time.perf_counter() - started
+
+        rng = random.Random(1)
+        pairs = [tuple(rng.sample(range(1, count + 1), 2)) for _ in range(args.lookups)]
+        started = time.perf_counter()
+        for a, b in pairs:
+            matrix.direct_rate(a, b)
+        direct = (time.perf_counter() - started) / len(pairs) * 1e6
+
+        started = time.perf_counter()
+        for a, b in pairs:
+            matrix.bpv_rate(a, b)
+        bpv = (time.perf_counter() - started) / len(pairs) * 1e6
+        print(f"{count:>10} {rebuild:>10.2f} {direct:>10.2f} {bpv:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
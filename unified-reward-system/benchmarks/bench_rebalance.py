@@ -0,0 +1,117 @@
+"""Liquidity rebalance: per-merchant Python loop vs set-based SQL, full and incremental.
+
+Seeds ``--merchants`` merchants with random supply, demand and sharded pools.
+"python" is the former job: load every merchant, then read and write its
+pool one merchant at a time through the ORM. "set-based" is
+``rebalance_liquidity()`` on an identical database; "incremental" then
+changes ``--changed`` of the merchants and runs ``rebalance_liquidity(incremental=True)``.
+Checks that both paths end with the same pool totals, and that the shards add up
+to every pool's total.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_rebalance --merchants 100000 --changed 0.01
+"""
+import argparse
+import logging
+import random
+import time
+
+from sqlalchemy import bindparam, func, select, update
+
+from app import db
+from app.models import LiquidityPool, LiquidityShard, Merchant
+from app.rebalance_liquidity import rebalance_liquidity
+from benchmarks.support import make_bench_app, seed, seed_pools
+
+
+def seed_market(merchants, rng):
+    seed(1, merchants)
+    seed_pools({m: rng.randint(0, 1_000_000) for m in range(1, merchants + 1)})
+    set_supply_demand(range(1, merchants + 1), rng)
+
+
+def set_supply_demand(merchant_ids, rng):
+    table = Merchant.__table__
+    db.session.execute(
+        update(table).where(table.c.id == bindparam("merchant_id")).values(supply=bindparam("s"), demand=bindparam("d")),
+        [{"merchant_id": m, "s": rng.choice((0, rng.randint(1, 20_000))), "d": rng.randint(0, 20_000)}
+         for m in merchant_ids]
+    )
+    db.session.commit()
+
+
+def python_rebalance():
+    """The former per-merchant loop; it only moves ``LiquidityPool.balance``, which is all that is compared."""
+    rebalanced = 0
+    for merchant in Merchant.query.all():
+        pool = LiquidityPool.query.filter_by(merchant_id=merchant.id).first()
+        if not pool or merchant.supply == 0 or merchant.demand == 0:
+            continue
+        balance_change = int(min(100, abs(merchant.supply - merchant.demand) * 0.02))
+        new_balance = pool.balance + (balance_change if merchant.supply > merchant.demand else -balance_change)
+        pool.balance = max(0, min(1000000, new_balance))
+        rebalanced += 1
+    db.session.commit()
+    return rebalanced
+
+
+def pool_totals():
+    return dict(db.session.execute(select(LiquidityPool.merchant_id, LiquidityPool.balance)).all())
+
+
+def uneven_pools():
+    """Pools whose shards do not add up to ``LiquidityPool.balance``."""
+    sums = select(LiquidityShard.merchant_id, func.sum(LiquidityShard.balance).label("total")) \
+        .group_by(LiquidityShard.merchant_id).subquery()
+    return db.session.execute(
+        select(func.count()).select_from(LiquidityPool)
+        .join(sums, sums.c.merchant_id == LiquidityPool.merchant_id)
+        .where(sums.c.total != LiquidityPool.balance)
+    ).scalar()
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--merchants", type=int, default=100_000)
+    parser.add_argument("--changed", type=float, default=0.01, help="share of merchants changed before the incremental run")
+    parser.add_argument("--database-url", help="scratch server database (default: temporary SQLite file)")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    app = make_bench_app(database_url=args.database_url)
+    with app.app_context():
+        seed_market(args.merchants, random.Random(7))
+        python_seconds, python_pools = timed(python_rebalance)
+        expected = pool_totals()
+        db.session.remove()
+
+    app = make_bench_app(database_url=args.database_url)
+    with app.app_context():
+        seed_market(args.merchants, random.Random(7))
+        full_seconds, full = timed(rebalance_liquidity)
+        actual = pool_totals()
+        mismatched = sum(1 for m, total in expected.items() if actual.get(m) != total)
+
+        rng = random.Random(11)
+        changed = rng.sample(range(1, args.merchants + 1), int(args.merchants * args.changed))
+        set_supply_demand(changed, rng)
+        incremental_seconds, incremental = timed(lambda: rebalance_liquidity(incremental=True))
+        uneven = uneven_pools()
+
+    print(f"{args.merchants} merchants, {(args.database_url or 'sqlite').split(':')[0]}")
+    print(f"{'mode':>12} {'seconds':>8} {'pools':>7} {'changed':>8} {'statements':>11}")
+    print(f"{'python':>12} {python_seconds:>8.2f} {python_pools:>7} {'':>8} {'':>11}")
+    for mode, seconds, stats in (("set-based", full_seconds, full), ("incremental", incremental_seconds, incremental)):
+        print(f"{mode:>12} {seconds:>8.2f} {stats['rebalanced']:>7} {stats['changed']:>8} {stats['statements']:>11}")
+    print(f"pool totals differing from the python path: {mismatched}; pools whose shards do not add up: {uneven}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Runs a reconciliation against the mock merchant API seeded with synthetic balances.
+
+A share of the balances is made to drift; the run is interrupted halfway,
+resumed from its checkpoint, and its corrections are checked against the
+injected drift. Peak Python memory is reported per page size to show it does
+not grow with the number of rows. Then ``--changed`` balances are changed
+through the ledger and the incremental run, which only reads the ledger after
+its cursor, is timed against the full pass.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_reconciliation --users 50000 --drift 0.01
+"""
+import argparse
+import logging
+import random
+import time
+import tracemalloc
+
+from app import db
+from app.models import ReconciliationCorrection, User, UserPoints
+from app.merchant_cache import merchant_cache
+from app.ledger import post, user_leg
+from app.reconciliation import reconcile, reconcile_changes
+from benchmarks.support import MOCK_MERCHANTS, make_bench_app, seed_mock_merchants, start_mock_api
+
+
+def seed_balances(mock, num_users, drift, rng):
+    """Same balances locally and at the mock merchants, except for ``drift`` of them."""
+    phones = [f"+91{i:010d}" for i in range(1, num_users + 1)]
+    db.session.execute(db.insert(User), [
+        {"username": f"user-{i}", "password": "x", "phone": phone} for i, phone in enumerate(phones, 1)
+    ])
+    rows, drifted = [], set()
+    for merchant_id, name in enumerate(MOCK_MERCHANTS, 1):
+        balances = mock.mock_db[name]
+        for user_id, phone in enumerate(phones, 1):
+            points = rng.randint(0, 5000)
+            rows.append({"user_id": user_id, "merchant_id": merchant_id, "points": points})
+            if rng.random() < drift:
+                points += rng.choice([-1, 1]) * rng.randint(1, 500)
+                drifted.add((user_id, merchant_id))
+            balances[phone] = {"points": points}
+    db.session.execute(db.insert(UserPoints), rows)
+    db.session.commit()
+    return drifted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--drift", type=float, default=0.01, help="share of balances that disagree")
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[2000, 10000])
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--changed", type=int, default=1000, help="balances changed before the incremental run")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    for page_size in args.page_sizes:
+        base_url, mock, server = start_mock_api(args.latency_ms)
+        merchant_cache.invalidate()  # The previous round's merchants pointed at another port
+        app = make_bench_app()
+        with app.app_context():
+            seed_mock_merchants(base_url)
+            drifted = seed_balances(mock, args.users, args.drift, random.Random(9))
+            total_pages = -(-args.users * len(MOCK_MERCHANTS) // page_size)
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            first = reconcile(page_size=page_size, max_pages=total_pages // 2)  # Simulated interruption
+            first_status, first_checked = first.status, first.checked
+            run = reconcile(page_size=page_size)  # Resumes from the checkpoint
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            found = {(c.user_id, c.merchant_id) for c in ReconciliationCorrection.query.filter_by(run_id=run.id)}
+            run_id, run_status = run.id, run.status
+
+            rng = random.Random(11)
+            changed = {(rng.randint(1, args.users), rng.randint(1, len(MOCK_MERCHANTS))) for _ in range(args.changed)}
+            post([user_leg(user_id, merchant_id, 1, "bench") for user_id, merchant_id in changed])
+            db.session.commit()
+            started = time.perf_counter()
+            incremental = reconcile_changes()
+            incremental_elapsed = time.perf_counter() - started
+            incremental_checked, incremental_mismatches = incremental.checked, incremental.mismatches
+        server.shutdown()
+
+        rows = args.users * len(MOCK_MERCHANTS)
+        print(f"page {page_size:>6}: {rows} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s), "
+              f"peak {peak / 2**20:.1f} MiB; interrupted at {first_checked} ({first_status}), "
+              f"resumed run {run_id} {run_status}")
+        print(f"             {len(found)} corrections, drift injected {len(drifted)}, "
+              f"missed {len(drifted - found)}, false {len(found - drifted)}")
+        print(f"             incremental: {incremental_checked} changed balances in {incremental_elapsed:.2f}s, "
+              f"{incremental_mismatches} mismatches (changed {len(changed)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Compares per-cycle settlement with the batched settle_cycles stage.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_settlement --orders 1000 5000
+"""
+import argparse
+
+from app import db
+from app.models import UserPoints, SmartExchange
+from app.cyclic_matcher import find_exchange_cycles, settle_cycles
+from app.sql_stats import count_statements
+from benchmarks.support import make_bench_app, seed
+
+
+def legacy_execute_cycle(cycle):
+    """Pre-batching settlement: two lookups per leg and one commit per cycle."""
+    for exchange, bpv, fill in cycle:
+        exchange.amount -= fill
+        if exchange.amount == 0:
+            exchange.status = 'completed'
+        user_points_from = UserPoints.query.filter_by(user_id=exchange.user_id, merchant_id=exchange.from_merchant_id).first()
+        user_points_to = UserPoints.query.filter_by(user_id=exchange.user_id, merchant_id=exchange.to_merchant_id).first()
+        if user_points_from and user_points_from.points >= fill:
+            user_points_from.points -= fill
+            if user_points_to:
+                user_points_to.points += int(fill * bpv)
+            else:
+                db.session.add(UserPoints(user_id=exchange.user_id, merchant_id=exchange.to_merchant_id, points=int(fill * bpv)))
+    db.session.commit()
+
+
+def run(num_orders, num_users, num_merchants, batched):
+    app = make_bench_app()
+    with app.app_context():
+        seed(num_users, num_merchants, num_orders)
+        pending = SmartExchange.query.filter_by(status='pending').all()
+        cycles = find_exchange_cycles(pending)
+        with count_statements() as counter:
+            if batched:
+                settle_cycles(cycles)
+            else:
+                for cycle in cycles:
+                    legacy_execute_cycle(cycle)
+        total = db.session.query(db.func.sum(UserPoints.points)).scalar()
+        return len(cycles), counter, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--merchants", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'orders':>8} {'mode':>9} {'cycles':>7} {'statements':>11} {'seconds':>9}")
+    for num_orders in args.orders:
+        for batched in (False, True):
+            cycles, counter, _ = run(num_orders, args.users, args.merchants, batched)
+            mode = "batched" if batched else "per-cycle"
+            print(f"{num_orders:>8} {mode:>9} {cycles:>7} {counter.statements:>11} {counter.seconds:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
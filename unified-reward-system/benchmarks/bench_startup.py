@@ -0,0 +1,109 @@
+"""Cold start: time to import the app and run ``create_app()``, checked against a budget.
+
+Each of ``--runs`` fresh interpreters imports ``app``, calls ``create_app()``
+and serves one request to ``/``; the medians are reported. ``-X importtime``
+then lists the modules that cost the most. The run fails (exit status 1) when
+the median import + ``create_app()`` time exceeds ``--budget-ms``, or when
+``create_app()`` loads a module that should only load on first use (Celery,
+``requests``, Flask-CORS). Use it as a CI check for cold starts:
+
+    python -m benchmarks.bench_startup --runs 7 --budget-ms 1500
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Loaded on first use only: the Celery app when a task is enqueued, requests on the first merchant call,
+# Flask-CORS on the first request
+LAZY_MODULES = ("celery", "kombu", "requests", "urllib3", "flask_cors")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+loaded = [name for name in %r if name in sys.modules]
+application.test_client().get("/")
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "loaded": loaded,
+}))
+""" % (LAZY_MODULES,)
+
+
+def probe_env():
+    fd, path = tempfile.mkstemp(prefix="rewardtrade-startup-", suffix=".db")
+    os.close(fd)
+    return {**os.environ, "DATABASE_URL": f"sqlite:///{path}", "LOG_LEVEL": "WARNING"}, path
+
+
+def run_probe(env, python_args=()):
+    result = subprocess.run([sys.executable, *python_args, "-c", PROBE], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return result
+
+
+def slowest_imports(env, top):
+    """``[(cumulative ms, module)]`` of the costliest imports that are not inside another listed one."""
+    stderr = run_probe(env, ("-X", "importtime")).stderr
+    rows = []
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        if match:
+            rows.append((int(match.group(1)) / 1000, len(match.group(2)), match.group(3)))
+    # Only direct imports of the probe or of app modules, so nested costs are not counted twice
+    listed = [(ms, name) for ms, depth, name in rows if depth == 1 or (name.startswith("app.") and depth <= 5)]
+    return sorted(listed, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=1500, help="median import + create_app() time allowed")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports listed")
+    args = parser.parse_args()
+
+    env, db_path = probe_env()
+    try:
+        samples = [json.loads(run_probe(env).stdout.strip().splitlines()[-1]) for _ in range(args.runs)]
+        imports = slowest_imports(env, args.top)
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+    medians = {key: statistics.median(s[key] for s in samples) for key in ("import_ms", "create_app_ms", "first_request_ms")}
+    startup = medians["import_ms"] + medians["create_app_ms"]
+    loaded = sorted({name for s in samples for name in s["loaded"]})
+
+    print(f"median of {args.runs} cold starts: import app {medians['import_ms']:.0f}ms, "
+          f"create_app() {medians['create_app_ms']:.0f}ms, first request {medians['first_request_ms']:.0f}ms")
+    print("slowest imports (cumulative ms):")
+    for ms, name in imports:
+        print(f"  {ms:>8.1f}  {name}")
+
+    failures = []
+    if startup > args.budget_ms:
+        failures.append(f"import + create_app() took {startup:.0f}ms, over the {args.budget_ms:g}ms budget")
+    if loaded:
+        failures.append(f"create_app() loaded {', '.join(loaded)}, which should load on first use")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"OK: {startup:.0f}ms within the {args.budget_ms:g}ms budget; none of {', '.join(LAZY_MODULES)} loaded")
+
+
+if __name__ == "__main__":
+    main()
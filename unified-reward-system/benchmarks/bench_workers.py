@@ -0,0 +1,180 @@
+"""Throughput of the production server (gunicorn) by worker count, and scheduler leader election.
+
+For each ``--workers`` count, seeds a scratch SQLite database, starts the
+mock merchant API (``--latency-ms``) and serves ``run:app`` with
+``gunicorn -c gunicorn.conf.py``, as in production. ``--concurrency``
+logged-in clients then drive ``--mix`` for ``--duration`` seconds, and the
+requests/s and latency percentiles are reported.
+
+Every worker competes for the scheduler lease: the run checks that exactly one
+worker acquired it and holds it. Then it kills that worker (SIGKILL, so the
+lease is not released) and times how long another worker takes to
+become the leader (at most ``--lease-seconds`` plus one renewal interval).
+
+Smart exchanges are left out of the default mix: their Celery queue needs Redis.
+
+Run from the ``unified-reward-system`` directory:
+
+    python -m benchmarks.bench_workers --workers 1 2 4 --threads 4 --concurrency 16 --duration 15
+"""
+import argparse
+import logging
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from app import db
+from app.jobs import LEASE_NAME
+from app.models import SchedulerLease
+from benchmarks.bench_load import client, parse_mix, prepare, summarize
+from benchmarks.support import make_bench_app, start_mock_api
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOOT_TIMEOUT_SECONDS = 120
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def lease():
+    db.session.expire_all()
+    row = db.session.get(SchedulerLease, LEASE_NAME)
+    result = (row.holder, row.expires_at) if row else (None, 0)
+    db.session.commit()
+    return result
+
+
+def holder_pid(holder):
+    return int(holder.split(":")[1]) if holder else None
+
+
+def start_server(workers, threads, db_path, lease_seconds, log_file):
+    """Starts gunicorn and waits until every worker has booted; returns ``(process, base_url)``."""
+    port = free_port()
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{db_path}", "SCHEDULER_LEASE_SECONDS": str(lease_seconds),
+           "LOG_LEVEL": "INFO"}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--workers", str(workers),
+         "--threads", str(threads), "--bind", f"127.0.0.1:{port}"],
+        cwd=ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+    )
+    base_url, deadline = f"http://127.0.0.1:{port}", time.monotonic() + BOOT_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}; see {log_file.name}")
+        if len(worker_pids(log_file.name)) >= workers and len(started_apps(log_file.name)) >= workers:
+            try:
+                if requests.get(base_url, timeout=5).status_code == 200:
+                    return process, base_url
+            except requests.RequestException:
+                pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"gunicorn did not start within {BOOT_TIMEOUT_SECONDS}s; see {log_file.name}")
+
+
+def read_log(path):
+    with open(path, errors="replace") as f:
+        return f.read()
+
+
+def worker_pids(path):
+    return [int(pid) for pid in re.findall(r"Booting worker with pid: (\d+)", read_log(path))]
+
+
+def started_apps(path):
+    """Workers whose app is up, i.e. whose scheduler has started."""
+    return re.findall(r"Scheduler started", read_log(path))
+
+
+def run(args, workers):
+    db_fd, db_path = tempfile.mkstemp(prefix="rewardtrade-workers-", suffix=".db")
+    os.close(db_fd)
+    base_url, mock, mock_server = start_mock_api(args.latency_ms, args.jitter_ms)
+    app = make_bench_app(db_path=db_path)
+    with app.app_context():
+        names = prepare(app, args, base_url, mock)
+        db.session.remove()
+
+    log_file = tempfile.NamedTemporaryFile("w", prefix="rewardtrade-gunicorn-", suffix=".log", delete=False)
+    process, app_url = start_server(workers, args.threads, db_path, args.lease_seconds, log_file)
+    try:
+        samples = []
+        deadline = time.monotonic() + args.duration
+        clients = [threading.Thread(target=client, args=(app_url, user_id, names, args.mix, deadline, user_id, samples))
+                   for user_id in range(1, args.concurrency + 1)]
+        started = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        result = summarize(samples, time.perf_counter() - started)
+
+        pids = worker_pids(log_file.name)
+        with app.app_context():
+            holder, _ = lease()
+            result["leaders"] = read_log(log_file.name).count(f"Acquired the {LEASE_NAME} lease")
+            result["leader_is_worker"] = holder_pid(holder) in pids
+
+            # Failover: the killed leader cannot release its lease, so it has to expire
+            os.kill(holder_pid(holder), signal.SIGKILL)
+            killed, failover = time.monotonic(), None
+            while time.monotonic() - killed < args.lease_seconds * 3:
+                new_holder, expires_at = lease()
+                if new_holder != holder and expires_at > time.time():
+                    failover = time.monotonic() - killed
+                    break
+                time.sleep(0.1)
+            result["failover_s"] = round(failover, 2) if failover is not None else None
+    finally:
+        process.terminate()
+        process.wait(60)
+        mock_server.shutdown()
+        log_file.close()
+    os.unlink(log_file.name)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.unlink(db_path + suffix)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=4, help="threads per worker")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent logged-in clients")
+    parser.add_argument("--duration", type=float, default=15, help="seconds of load per worker count")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--mix", type=parse_mix, default="instant=4,dashboard=2,get_points=2")
+    parser.add_argument("--lease-seconds", type=int, default=6, help="scheduler lease TTL for the failover check")
+    args = parser.parse_args()
+    args.orders = 0
+    logging.disable(logging.INFO)
+
+    print(f"{args.concurrency} clients for {args.duration:g}s, {args.threads} threads per worker, "
+          f"mock latency {args.latency_ms:g}ms, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} "
+          f"{'leaders':>8} {'failover s':>11}")
+    for workers in args.workers:
+        r = run(args, workers)
+        leaders = f"{r['leaders']}{'' if r['leader_is_worker'] else '?'}"
+        print(f"{workers:>8} {r['throughput_rps']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+              f"{r['errors']:>7} {leaders:>8} {str(r['failover_s']):>11}")
+
+
+if __name__ == "__main__":
+    main()
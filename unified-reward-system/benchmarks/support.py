@@ -0,0 +1,118 @@
+"""Shared helpers for the benchmark scripts: throwaway app + synthetic data."""
+import os
+import random
+import tempfile
+
+from flask import Flask
+
+from app import db
+from app.database import configure_engine, engine_options
+from app.liquidity import POOL_SHARDS, shard_rows
+from app.models import User, Merchant, UserPoints, SmartExchange, LiquidityPool, LiquidityShard
+
+
+TEMPLATE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "templates")
+
+
+def make_bench_app(db_path=None, database_url=None, sqlite_tuning=True):
+    """Minimal Flask app bound to a scratch database (never the real rewards.db).
+
+    Defaults to a temporary SQLite file configured like the app (WAL, immediate
+    transactions); ``database_url`` points it at a scratch server database
+    instead, whose tables are dropped and recreated.
+    """
+    if database_url is None:
+        if db_path is None:
+            fd, db_path = tempfile.mkstemp(prefix="rewardtrade-bench-", suffix=".db")
+            os.close(fd)
+        database_url = f"sqlite:///{db_path}"
+    app = Flask(__name__, template_folder=TEMPLATE_FOLDER)  # The app's templates, for page routes
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_url)
+    db.init_app(app)
+    with app.app_context():
+        if sqlite_tuning:
+            configure_engine(db.engine)
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+def seed(num_users, num_merchants, num_orders=0, points=100000, seed=7):
+    """Bulk-inserts users, merchants, balances and pending orders. Needs an app context."""
+    rng = random.Random(seed)
+    db.session.execute(db.insert(Merchant), [
+        {"name": f"merchant-{i}", "redemption_value": round(rng.uniform(0.5, 1.5), 3),
+         "api_url": f"http://localhost:5001/api/merchant-{i}/rewards"}
+        for i in range(1, num_merchants + 1)
+    ])
+    db.session.execute(db.insert(User), [
+        {"username": f"user-{i}", "password": "x", "phone": f"+91{i:010d}"} for i in range(1, num_users + 1)
+    ])
+    db.session.execute(db.insert(UserPoints), [
+        {"user_id": u, "merchant_id": m, "points": points}
+        for u in range(1, num_users + 1) for m in range(1, num_merchants + 1)
+    ])
+    orders = []
+    for _ in range(num_orders):
+        from_id, to_id = rng.sample(range(1, num_merchants + 1), 2)
+        orders.append({"user_id": rng.randint(1, num_users), "from_merchant_id": from_id,
+                       "to_merchant_id": to_id, "amount": rng.randint(10, 1000), "status": "pending"})
+    if orders:
+        db.session.execute(db.insert(SmartExchange), orders)
+    db.session.commit()
+
+
+def seed_pools(balances, shards=POOL_SHARDS):
+    """Creates a liquidity pool split into ``shards`` for each ``{merchant_id: balance}``."""
+    db.session.execute(db.insert(LiquidityPool), [
+        {"merchant_id": merchant_id, "balance": balance} for merchant_id, balance in balances.items()
+    ])
+    db.session.execute(db.insert(LiquidityShard), [
+        row for merchant_id, balance in balances.items() for row in shard_rows(merchant_id, balance, shards)
+    ])
+    db.session.commit()
+
+
+MOCK_MERCHANTS = ("dominos", "starbucks", "amazon", "flipkart")
+
+
+def load_mock_api():
+    """Imports ``mock_apis/mock/api.py`` (not a package) as a module."""
+    import importlib.util
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mock_apis", "mock", "api.py")
+    spec = importlib.util.spec_from_file_location("mock_merchant_api", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.print = lambda *args, **kwargs: None  # Keep benchmark output readable
+    return module
+
+
+def start_mock_api(latency_ms=0, jitter_ms=0):
+    """Serves the mock merchant API on a free local port in a background thread.
+
+    Returns ``(base_url, module, server)``; call ``server.shutdown()`` when done.
+    """
+    module = load_mock_api()
+    module.LATENCY_MS, module.JITTER_MS = latency_ms, jitter_ms
+    base_url, server = serve(module.app)
+    return base_url, module, server
+
+
+def serve(wsgi_app):
+    """Serves ``wsgi_app`` (thread per request) on a free local port; returns ``(base_url, server)``."""
+    import logging
+    import threading
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, wsgi_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def seed_mock_merchants(base_url):
+    """Adds the mock API's merchants to the current DB pointing at ``base_url``."""
+    for i, name in enumerate(MOCK_MERCHANTS):
+        db.session.add(Merchant(name.capitalize(), 0.01 + 0.002 * i, f"{base_url}/api/{name}/rewards"))
+    db.session.commit()
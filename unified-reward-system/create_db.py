@@ -1,12 +1,13 @@
 from app import create_app, db
 from app.models import Merchant
+from app.schema import upgrade_schema
 
 app = create_app()
 
 with app.app_context():
     try:
         # ✅ Step 1: Create database tables if they don't exist
-        db.create_all()  # ❗ This ensures the `merchant` table exists before inserting data
+        upgrade_schema()  # ❗ This ensures the `merchant` table (and any newer columns) exist before inserting data
 
         # ✅ Step 2: Define merchant data
         merchants_data = [
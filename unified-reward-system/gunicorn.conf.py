@@ -0,0 +1,22 @@
+# Production server: gunicorn -c gunicorn.conf.py (from the unified-reward-system directory)
+import multiprocessing
+import os
+
+wsgi_app = "run:app"
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+
+# Worker processes, and threads per worker: requests mostly wait on the database and merchant APIs
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_class = "gthread"
+
+# Each worker imports run.py after the fork, so it gets its own engine, caches and scheduler;
+# the scheduler lease (app/leader.py) makes sure only one of them runs the periodic jobs
+preload_app = False
+
+timeout = int(os.environ.get("WEB_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+max_requests = 10000  # Recycle workers now and then; jitter keeps them from restarting together
+max_requests_jitter = 1000
+accesslog = os.environ.get("ACCESS_LOG")  # e.g. "-" for stdout; off by default
@@ -1,8 +1,23 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
+import json
+import os
+import random
 import re
+import time
 
 app = Flask(__name__)
 
+# ✅ Artificial latency for benchmarks, e.g. MOCK_API_LATENCY_MS=200 MOCK_API_JITTER_MS=50
+LATENCY_MS = float(os.environ.get("MOCK_API_LATENCY_MS", 0))
+JITTER_MS = float(os.environ.get("MOCK_API_JITTER_MS", 0))
+
+# ✅ Fault injection per merchant, e.g. MOCK_API_FAULTS='{"amazon": {"error_rate": 0.5}, "dominos": {"down": true}}'
+#    error_rate: share of requests answered with 503; slow_rate/slow_ms: share delayed by slow_ms;
+#    hang_rate: share that stall for HANG_SECONDS; down: every request fails. Also settable at runtime
+#    via POST /api/<merchant>/faults.
+FAULTS = json.loads(os.environ.get("MOCK_API_FAULTS", "{}"))
+HANG_SECONDS = 30
+
 # ✅ Mock Database for All Merchants
 mock_db = {
     'dominos': {
@@ -35,6 +50,9 @@ mock_db = {
     }
 }
 
+# ✅ Responses already sent per Idempotency-Key, so retried updates apply once
+processed_updates = {}
+
 # ✅ Standardize Phone Number Format
 def format_phone(phone):
     """Ensures phone numbers are stored in a consistent format."""
@@ -47,6 +65,33 @@ def format_phone(phone):
 def is_valid_phone(phone):
     return re.match(r'^\+?\d{10,15}$', phone) is not None
 
+@app.before_request
+def inject_latency():
+    if LATENCY_MS or JITTER_MS:
+        time.sleep(max(0.0, LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS)) / 1000)
+
+@app.before_request
+def inject_faults():
+    if request.endpoint == 'set_faults':
+        return None
+    faults = FAULTS.get((request.view_args or {}).get('merchant'))
+    if not faults:
+        return None
+    if faults.get('down') or random.random() < faults.get('error_rate', 0):
+        return jsonify({'error': 'Injected fault'}), 503
+    if random.random() < faults.get('hang_rate', 0):
+        time.sleep(HANG_SECONDS)
+    elif random.random() < faults.get('slow_rate', 0):
+        time.sleep(faults.get('slow_ms', 0) / 1000)
+    return None
+
+# ✅ Read or replace a merchant's injected faults ({} clears them)
+@app.route('/api/<merchant>/faults', methods=['GET', 'POST'])
+def set_faults(merchant):
+    if request.method == 'POST':
+        FAULTS[merchant] = request.get_json(silent=True) or {}
+    return jsonify(FAULTS.get(merchant, {}))
+
 # ✅ Get Points for Any Merchant
 @app.route('/api/<merchant>/rewards/<phone>', methods=['GET'])
 @app.route('/api/<merchant>/rewards/rewards/<phone>', methods=['GET'])
@@ -69,6 +114,10 @@ def update_points(merchant):
     if merchant not in mock_db:
         return jsonify({'error': 'Merchant not found'}), 404
 
+    idempotency_key = request.headers.get("Idempotency-Key")
+    if idempotency_key and (merchant, idempotency_key) in processed_updates:
+        return jsonify(processed_updates[(merchant, idempotency_key)])
+
     data = request.get_json()
     
     # ✅ Debugging: Print received data
@@ -85,15 +134,72 @@ def update_points(merchant):
     if points_change is None or not isinstance(points_change, int):
         return jsonify({'error': 'Invalid or missing points_change'}), 400
 
-    phone = format_phone(phone)
+    result = apply_points_change(merchant, format_phone(phone), points_change)
+    if idempotency_key:
+        processed_updates[(merchant, idempotency_key)] = result
+    return jsonify(result)
 
+def apply_points_change(merchant, phone, points_change):
     if phone in mock_db[merchant]:
         mock_db[merchant][phone]['points'] += points_change
     else:
         mock_db[merchant][phone] = {'points': points_change}
 
     print(f"✅ Updated {merchant.capitalize()} Points for {phone}: {mock_db[merchant][phone]['points']}")
-    return jsonify({'success': True, 'new_points': mock_db[merchant][phone]['points']})
+    return {'success': True, 'new_points': mock_db[merchant][phone]['points']}
+
+def ndjson(rows):
+    """Streams one JSON object per line so clients can consume results as they arrive."""
+    return Response(stream_with_context(json.dumps(row) + "\n" for row in rows), mimetype='application/x-ndjson')
+
+# ✅ Get Points for Many Phones: {"phones": [...]} -> NDJSON {"phone", "points"}
+@app.route('/api/<merchant>/rewards/batch', methods=['POST'])
+def get_points_batch(merchant):
+    if merchant not in mock_db:
+        return jsonify({'error': 'Merchant not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    phones = data.get("phones")
+    if not isinstance(phones, list):
+        return jsonify({'error': 'Missing phones list'}), 400
+
+    def rows():
+        balances = mock_db[merchant]
+        for raw_phone in phones:
+            if not isinstance(raw_phone, str) or not is_valid_phone(format_phone(raw_phone)):
+                yield {'phone': raw_phone, 'error': 'Invalid phone number'}
+                continue
+            yield {'phone': raw_phone, 'points': balances.get(format_phone(raw_phone), {}).get('points', 0)}
+    return ndjson(rows())
+
+# ✅ Update Points for Many Phones: {"updates": [{"user_phone", "points_change", "idempotency_key"?}]}
+@app.route('/api/<merchant>/rewards/batch/update', methods=['POST'])
+def update_points_batch(merchant):
+    if merchant not in mock_db:
+        return jsonify({'error': 'Merchant not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    updates = data.get("updates")
+    if not isinstance(updates, list):
+        return jsonify({'error': 'Missing updates list'}), 400
+
+    def rows():
+        for item in updates:
+            phone = item.get("user_phone") if isinstance(item, dict) else None
+            points_change = item.get("points_change") if isinstance(item, dict) else None
+            key = item.get("idempotency_key") if isinstance(item, dict) else None
+            if not phone or not is_valid_phone(phone):
+                yield {'user_phone': phone, 'error': 'Invalid phone number'}
+            elif not isinstance(points_change, int):
+                yield {'user_phone': phone, 'error': 'Invalid or missing points_change'}
+            elif key and (merchant, key) in processed_updates:
+                yield {'user_phone': phone, **processed_updates[(merchant, key)]}
+            else:
+                result = apply_points_change(merchant, format_phone(phone), points_change)
+                if key:
+                    processed_updates[(merchant, key)] = result
+                yield {'user_phone': phone, **result}
+    return ndjson(rows())
 
 # ✅ Reset Points (For Debugging)
 @app.route('/api/<merchant>/rewards/reset', methods=['POST'])
@@ -0,0 +1,24 @@
+import argparse
+
+from app import create_app
+from app.models import ReconciliationCorrection
+from app.reconciliation import RECONCILE_PAGE_SIZE, apply_corrections, reconcile
+
+# ✅ Standalone reconciliation: python reconcile.py [--max-pages N] [--apply RUN_ID]
+parser = argparse.ArgumentParser(description="Compare local UserPoints with merchant balances.")
+parser.add_argument("--page-size", type=int, default=RECONCILE_PAGE_SIZE)
+parser.add_argument("--max-pages", type=int, help="stop after N pages; the next run resumes from the checkpoint")
+parser.add_argument("--apply", type=int, metavar="RUN_ID", help="adopt merchant balances for a finished run's corrections")
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    if args.apply:
+        print(f"✅ Applied {apply_corrections(args.apply)} corrections from run {args.apply}")
+    else:
+        run = reconcile(page_size=args.page_size, max_pages=args.max_pages)
+        print(f"Run {run.id} ({run.status}): {run.checked} checked, {run.mismatches} mismatches, {run.skipped} skipped")
+        for correction in ReconciliationCorrection.query.filter_by(run_id=run.id).limit(20):
+            print(f"  user {correction.user_id} merchant {correction.merchant_id}: "
+                  f"local {correction.local_points} vs merchant {correction.merchant_points}")
@@ -1,18 +1,13 @@
-from app import create_app
-from apscheduler.schedulers.background import BackgroundScheduler
-from app.rebalance_liquidity import rebalance_liquidity
-import atexit
+from app import get_app
+from app.jobs import start_scheduler
 
-# Create Flask App
-app = create_app()
+# Matching pool workers are spawned and import the main script again as __mp_main__; they need neither
+if __name__ != "__mp_main__":
+    # Create Flask App (the process's cached app, shared with Celery tasks run in this process)
+    app = get_app()
 
-# Initialize and Start Scheduler AFTER Flask App is Created
-scheduler = BackgroundScheduler()
-scheduler.add_job(rebalance_liquidity, 'interval', hours=1)  # Runs every 1 hour
-scheduler.start()
-
-# Ensure Scheduler Stops When App Exits
-atexit.register(lambda: scheduler.shutdown())
+    # Periodic jobs: every process schedules them, only the holder of the scheduler lease runs them
+    scheduler, scheduler_lease = start_scheduler(app)
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    app.run(debug=True)  # Development server; in production: gunicorn -c gunicorn.conf.py
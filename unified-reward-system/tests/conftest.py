@@ -0,0 +1,51 @@
+"""Shared fixtures: the real app factory bound to a scratch SQLite database per test."""
+import pytest
+
+from app import create_app, db
+from app.balance_cache import balance_cache
+from app.ledger import post, user_leg
+from app.merchant_cache import merchant_cache
+from app.models import Merchant, User
+from app.order_book import reset_order_book
+from app.rate_matrix import rate_matrix_cache
+import app.order_book as order_book
+from app.single_flight import reset_flights
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv("LOG_LEVEL", "WARNING")
+    application = create_app()
+    application.config.update(TESTING=True, SINGLE_FLIGHT_URL="local://")  # In-process flight, no Redis
+    # Process-wide caches would otherwise carry another test's database over
+    merchant_cache.invalidate()
+    for attribute in ("_matrix", "_pools", "_inputs"):
+        monkeypatch.setattr(rate_matrix_cache, attribute, None)
+    balance_cache.clear()
+    reset_flights()
+    monkeypatch.setattr(order_book, "_order_book", None)
+    monkeypatch.setattr(order_book, "_matched_through", None)
+    with application.app_context():
+        db.create_all()
+        yield application
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def merchants(app):
+    """Three merchants with 5,000-point pools: ``{name: id}``."""
+    for name in ("alpha", "beta", "gamma"):
+        Merchant.create_with_liquidity(name, 1.0, f"http://localhost:5001/api/{name}/rewards")
+    return {m.name: m.id for m in Merchant.query.all()}
+
+
+def make_user(name, balances):
+    """A user with opening balances ``{merchant_id: points}`` journaled in the ledger; returns the id."""
+    user = User(username=name, password="x", phone=f"+91{User.query.count() + 1:010d}")
+    db.session.add(user)
+    db.session.flush()
+    post([user_leg(user.id, merchant_id, points, 'opening_balance') for merchant_id, points in balances.items()])
+    db.session.commit()
+    return user.id
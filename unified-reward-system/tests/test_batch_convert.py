@@ -0,0 +1,93 @@
+"""Batch conversions: authorization, per-item results and ledger consistency."""
+import json
+
+import pytest
+
+from app.ledger import find_drift
+from app.liquidity import pool_balances
+from app.models import MerchantOutbox, PointsLedger, UserPoints
+from tests.conftest import make_user
+
+TOKEN = "batch-secret"
+
+
+@pytest.fixture
+def client(app):
+    app.config["BATCH_API_TOKEN"] = TOKEN
+    return app.test_client()
+
+
+def convert(client, items, token=TOKEN, ndjson=False):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    if ndjson:
+        return client.post("/convert_points/batch", headers=headers, content_type="application/x-ndjson",
+                           data="\n".join(json.dumps(item) for item in items))
+    return client.post("/convert_points/batch", headers=headers, json=items)
+
+
+def balances():
+    return {(row.user_id, row.merchant_id): row.points for row in UserPoints.query.all()}
+
+
+def test_batch_needs_the_configured_token(app, client, merchants):
+    ann = make_user("ann", {merchants["alpha"]: 500})
+    item = {"user_id": ann, "from_merchant": "alpha", "to_merchant": "beta", "amount": 100}
+
+    assert convert(client, [item], token=None).status_code == 403
+    assert convert(client, [item], token="wrong").status_code == 403
+    app.config["BATCH_API_TOKEN"] = None  # Off while no token is configured
+    assert convert(client, [item]).status_code == 403
+    assert balances() == {(ann, merchants["alpha"]): 500}
+    assert PointsLedger.query.filter_by(reason='batch_exchange').count() == 0
+
+
+def test_replayed_batch_settles_against_current_balances(client, merchants):
+    alpha, beta = merchants["alpha"], merchants["beta"]
+    ann = make_user("ann", {alpha: 150})
+    items = [{"user_id": ann, "from_merchant": "alpha", "to_merchant": "beta", "amount": 100, "ref": "promo-1"}]
+
+    first = convert(client, items).get_json()
+    replay = convert(client, items).get_json()
+
+    # There is no deduplication by ref: the replay is a new conversion, and cannot overdraw
+    assert first["results"] == [{"index": 0, "ref": "promo-1", "success": True, "converted_amount": 100}]
+    assert replay["results"] == [{"index": 0, "ref": "promo-1", "error": "Insufficient points for exchange."}]
+    assert balances() == {(ann, alpha): 50, (ann, beta): 100}
+    assert PointsLedger.query.filter_by(reason='batch_exchange').count() == 4  # One entry, two user and two pool legs
+    assert find_drift() == []
+
+
+def test_invalid_items_fail_alone_and_keep_the_ledger_consistent(client, merchants):
+    alpha, beta, gamma = merchants["alpha"], merchants["beta"], merchants["gamma"]
+    ann, bob = make_user("ann", {alpha: 500}), make_user("bob", {beta: 300})
+    pools_before = pool_balances()
+    items = [
+        {"user_id": ann, "from_merchant": "alpha", "to_merchant": "beta", "amount": 200, "ref": "a"},
+        {"user_id": ann, "from_merchant": "alpha", "to_merchant": "nowhere", "amount": 10, "ref": "b"},
+        {"phone": "+910000000099", "from_merchant": "alpha", "to_merchant": "beta", "amount": 10},
+        {"user_id": bob, "from_merchant": "beta", "to_merchant": "gamma", "amount": 0},
+        {"user_id": ann, "from_merchant": "alpha", "to_merchant": "gamma", "amount": 400},  # Only 300 left after "a"
+        None,
+        {"user_id": bob, "from_merchant": "beta", "to_merchant": "gamma", "amount": 300},
+    ]
+
+    response = convert(client, items, ndjson=True)
+
+    assert response.mimetype == "application/x-ndjson"
+    results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [result["index"] for result in results] == list(range(len(items)))
+    assert [result.get("success", False) for result in results] == [True, False, False, False, False, False, True]
+    assert results[1] == {"index": 1, "ref": "b", "error": "Invalid merchants selected."}
+    assert results[2]["error"] == "Unknown user."
+    assert results[4]["error"] == "Insufficient points for exchange."
+    assert results[5]["error"] == "Each item must be a JSON object."
+
+    assert balances() == {(ann, alpha): 300, (ann, beta): 200, (bob, beta): 0, (bob, gamma): 300}
+    pools = pool_balances()
+    assert pools[alpha] == pools_before[alpha] - 200
+    assert pools[beta] == pools_before[beta] + 200 - 300
+    assert pools[gamma] == pools_before[gamma] + 300
+    outbox = {(row.user_id, row.merchant_id): row.points_change for row in MerchantOutbox.query.all()}
+    assert outbox == {(ann, alpha): -200, (ann, beta): 200, (bob, beta): -300, (bob, gamma): 300}
+    assert find_drift() == []
+    assert PointsLedger.query.filter_by(reason='batch_exchange').count() == 8
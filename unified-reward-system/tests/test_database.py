@@ -0,0 +1,37 @@
+"""SQLite takes the write lock up front only for write transactions."""
+import sqlite3
+
+from sqlalchemy import event
+
+from app import db
+from app.database import write_transaction
+from app.models import User
+
+
+def begins(engine):
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement) if statement.startswith("BEGIN") else None)
+    return statements
+
+
+def test_reads_stay_deferred_and_writes_begin_immediate(app):
+    statements = begins(db.engine)
+    User.query.count()
+    db.session.commit()
+    with write_transaction():
+        User.query.count()
+        db.session.commit()
+    assert statements == ["BEGIN", "BEGIN IMMEDIATE"]
+
+
+def test_reads_do_not_wait_for_a_writer(app):
+    writer = sqlite3.connect(db.engine.url.database, timeout=0)
+    writer.isolation_level = None
+    writer.execute("BEGIN IMMEDIATE")  # Another process holds the write lock
+    try:
+        assert User.query.count() == 0
+        db.session.commit()
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
@@ -0,0 +1,114 @@
+"""Incremental Smart Exchange matching: the order book and ``match_new_orders``."""
+from types import SimpleNamespace
+
+import pytest
+
+from app import db, exchange_scheduler
+import app.order_book as order_book
+from app.exchange_scheduler import match_new_orders, run_matching
+from app.models import SmartExchange
+from app.order_book import OrderBook, get_order_book
+from tests.conftest import make_user
+
+
+def order(id, from_merchant_id, to_merchant_id, amount, user_id=1):
+    return SimpleNamespace(id=id, user_id=user_id, from_merchant_id=from_merchant_id,
+                           to_merchant_id=to_merchant_id, amount=amount, created_at=None)
+
+
+def fills(cycles):
+    return [sorted((leg.id, fill) for leg, fill in cycle) for cycle in cycles]
+
+
+def test_partial_fills_across_several_cycles():
+    book = OrderBook()
+    assert book.add(order(1, 1, 2, 100)) == []
+    assert fills(book.add(order(2, 2, 1, 30))) == [[(1, 30), (2, 30)]]
+    assert fills(book.add(order(3, 2, 1, 50))) == [[(1, 50), (3, 50)]]
+    assert book.open_volume(1, 2) == 20
+    # The next order is larger than what is left: the rest of it rests on the book
+    assert fills(book.add(order(4, 2, 1, 45))) == [[(1, 20), (4, 20)]]
+    assert book.open_volume(1, 2) == 0 and book.open_volume(2, 1) == 25
+    assert 1 not in book and 4 in book
+
+
+def test_feed_on_rebuilt_book_skips_orders_it_already_filled():
+    book = OrderBook.from_pending([order(1, 1, 2, 40), order(2, 2, 1, 40), order(3, 1, 3, 10)])
+    assert book.loaded_through == 3 and book.last_id == 0
+
+    # Loaded but never matched: feeding the first one matches its edge
+    assert fills(book.feed(order(1, 1, 2, 40))) == [[(1, 40), (2, 40)]]
+    # Filled by the book since it was loaded: feeding it again must not re-add it
+    assert book.feed(order(2, 2, 1, 40)) == []
+    assert book.open_volume(2, 1) == 0 and 2 not in book
+    assert book.feed(order(3, 1, 3, 10)) == [] and 3 in book
+    # Newer than the load: added as usual
+    assert fills(book.feed(order(4, 3, 1, 10))) == [[(3, 10), (4, 10)]]
+    assert book.last_id == 4
+
+
+def submit(user_id, from_merchant_id, to_merchant_id, amount):
+    exchange = SmartExchange(user_id=user_id, from_merchant_id=from_merchant_id,
+                             to_merchant_id=to_merchant_id, amount=amount, status='pending')
+    db.session.add(exchange)
+    db.session.commit()
+    return exchange.id
+
+
+@pytest.fixture
+def traders(merchants):
+    alpha, beta = merchants["alpha"], merchants["beta"]
+    return alpha, beta, make_user("ann", {alpha: 1000}), make_user("bob", {beta: 1000})
+
+
+def test_match_new_orders_settles_partial_fills(traders):
+    alpha, beta, ann, bob = traders
+    resting = submit(ann, alpha, beta, 100)
+    assert run_matching()["cycles"] == 0  # Full run: the book continues after it
+    assert get_order_book().last_id == resting
+
+    first, second = submit(bob, beta, alpha, 30), submit(bob, beta, alpha, 50)
+    stats = match_new_orders()
+    assert stats["incremental"] and stats["cycles"] == 2
+    rows = {row.id: row for row in SmartExchange.query.all()}
+    assert (rows[resting].status, rows[resting].amount) == ('pending', 20)
+    assert rows[first].status == rows[second].status == 'completed'
+
+
+def test_out_of_sync_book_falls_back_to_a_full_match(traders):
+    alpha, beta, ann, bob = traders
+    resting = submit(ann, alpha, beta, 100)
+    run_matching()
+    assert resting in get_order_book()
+
+    # Another process fills the resting order behind this process's book
+    db.session.get(SmartExchange, resting).status = 'completed'
+    db.session.commit()
+    new = submit(bob, beta, alpha, 100)
+
+    assert match_new_orders() is None
+    assert order_book._order_book is None  # Rebuilt from the database on next use
+    assert db.session.get(SmartExchange, new).status == 'pending'
+    run_matching()  # The caller's fallback: nothing left to pair the new order with
+    assert db.session.get(SmartExchange, new).status == 'pending'
+
+
+def test_settlement_error_rewinds_the_book(traders, monkeypatch):
+    alpha, beta, ann, bob = traders
+    resting = submit(ann, alpha, beta, 100)
+    run_matching()
+    started_at = get_order_book().last_id
+    new = submit(bob, beta, alpha, 100)
+
+    def fail(cycles):
+        raise RuntimeError("settlement failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(exchange_scheduler, "settle_cycles", fail)
+        with pytest.raises(RuntimeError):
+            match_new_orders()
+    assert order_book._order_book is None and order_book._matched_through == started_at
+
+    stats = match_new_orders()  # The new order is fed again and settles
+    assert stats["cycles"] == 1
+    assert {db.session.get(SmartExchange, i).status for i in (resting, new)} == {'completed'}
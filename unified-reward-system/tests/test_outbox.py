@@ -0,0 +1,45 @@
+"""Outbox claims: a dispatcher only records results for rows it still holds."""
+from sqlalchemy import update
+
+from app import db
+from app import outbox
+from app.balance_cache import BalanceCache
+from app.models import MerchantOutbox, User
+from tests.conftest import make_user
+
+
+def test_expired_claim_cannot_overwrite_a_new_claim(app, merchants, monkeypatch):
+    user = make_user("ann", {})
+    outbox.queue_point_changes([(user, merchants["alpha"], 40)])
+    db.session.commit()
+    engine, table = db.engine, MerchantOutbox.__table__
+
+    def slow_push(merchant, updates, batch_size):
+        # This dispatcher's claim lapses mid-call and another one claims the row
+        with engine.begin() as connection:
+            connection.execute(update(table).values(claim_token="other"))
+        return [(key, True) for _, _, key in updates]
+
+    monkeypatch.setattr(outbox, "push_points_batch", slow_push)
+    stats = outbox.dispatch_outbox()
+
+    row = db.session.get(MerchantOutbox, 1)
+    db.session.refresh(row)
+    assert stats["sent"] == 1
+    assert (row.status, row.claim_token) == ('sending', "other")
+
+
+def test_delivery_retires_every_cached_balance_of_the_user(app, merchants, monkeypatch):
+    alpha = merchants["alpha"]
+    user = make_user("ann", {})
+    other_process = BalanceCache()
+    other_process.store(user, {alpha: 100}, version=0)
+    outbox.queue_point_changes([(user, alpha, 40)])
+    db.session.commit()
+    monkeypatch.setattr(outbox, "push_points_batch", lambda merchant, updates, size: [(key, True) for _, _, key in updates])
+
+    outbox.dispatch_outbox()
+
+    version = db.session.get(User, user).balances_version
+    assert version == 1
+    assert other_process.lookup(user, [alpha], version) == ({}, {}, [alpha])
@@ -0,0 +1,26 @@
+"""Partitioned matching in spawned worker processes, and its serial fallback."""
+from app import cyclic_matcher
+from app.cyclic_matcher import partitioned_circulation
+
+# Two independent three-merchant rings
+CAPACITY = {(1, 2): 50, (2, 3): 40, (3, 1): 60, (4, 5): 10, (5, 6): 30, (6, 4): 20}
+
+
+def test_process_pool_clears_the_same_flow(monkeypatch):
+    monkeypatch.setattr(cyclic_matcher, "PARALLEL_MIN_EDGES", 0)
+    pooled = partitioned_circulation(CAPACITY, processes=2)
+    assert pooled == partitioned_circulation(CAPACITY, processes=1)
+    assert sum(pooled.values()) == 3 * 40 + 3 * 10
+
+
+def test_failing_pool_falls_back_to_serial_matching(monkeypatch):
+    monkeypatch.setattr(cyclic_matcher, "PARALLEL_MIN_EDGES", 0)
+    monkeypatch.setattr(cyclic_matcher, "_pool_failed", False)
+    processes = cyclic_matcher.MATCH_PROCESSES
+
+    def broken_pool(workers=None):
+        raise OSError("no processes here")
+
+    monkeypatch.setattr(cyclic_matcher, "get_process_pool", broken_pool)
+    assert sum(partitioned_circulation(CAPACITY, processes=2).values()) == 150
+    assert cyclic_matcher._pool_failed and cyclic_matcher.MATCH_PROCESSES == processes
@@ -0,0 +1,36 @@
+"""Incremental reconciliation reads the ledger through its cursor."""
+from app import db, reconciliation
+from app.ledger import post, user_leg
+from app.models import LedgerCursor, PointsLedger, ReconciliationCorrection, User
+from tests.conftest import make_user
+
+
+def test_only_balances_changed_since_the_cursor_are_checked(app, merchants, monkeypatch):
+    alpha, beta = merchants["alpha"], merchants["beta"]
+    ann = make_user("ann", {alpha: 100, beta: 100})
+    bob = make_user("bob", {alpha: 100})
+    phones = {user.phone: user.id for user in User.query.all()}
+    remote = {(ann, alpha): 100, (ann, beta): 100, (bob, alpha): 100}
+    asked = []
+
+    def fetch(merchant, batch, batch_size):
+        asked.extend((phones[phone], merchant.id) for phone in batch)
+        return [(phone, remote[(phones[phone], merchant.id)]) for phone in batch]
+
+    monkeypatch.setattr(reconciliation, "fetch_points_batch", fetch)
+    first = reconciliation.reconcile_changes()  # Opening balances: everything is new to the cursor
+    assert (first.checked, first.mismatches) == (3, 0)
+
+    asked.clear()
+    post([user_leg(ann, beta, -30, "test")])  # Local change the merchant has not seen
+    db.session.commit()
+    run = reconciliation.reconcile_changes()
+
+    assert asked == [(ann, beta)]
+    assert (run.kind, run.checked, run.mismatches) == ('incremental', 1, 1)
+    correction = ReconciliationCorrection.query.filter_by(run_id=run.id).one()
+    assert (correction.local_points, correction.merchant_points) == (70, 100)
+    last_id = db.session.query(db.func.max(PointsLedger.id)).scalar()
+    assert db.session.get(LedgerCursor, reconciliation.RECONCILE_CURSOR).last_id == last_id
+
+    assert reconciliation.reconcile_changes().checked == 0
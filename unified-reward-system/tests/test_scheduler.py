@@ -0,0 +1,32 @@
+"""Cadence runs only rescan every pending order when something calls for it."""
+import time
+
+from app import exchange_scheduler
+from app.single_flight import get_flight
+
+
+def cadence_matches(monkeypatch):
+    matched = []
+    real = exchange_scheduler.run_matching
+    monkeypatch.setattr(exchange_scheduler, "run_matching", lambda match=True: matched.append(match) or real(match=match))
+    exchange_scheduler.run_scheduled()
+    return matched
+
+
+def test_quiet_cadence_run_only_spills_over(app, monkeypatch):
+    monkeypatch.setattr(exchange_scheduler, "_last_full_match", time.monotonic())
+    assert cadence_matches(monkeypatch) == [False]
+    assert get_flight(exchange_scheduler.FLIGHT_NAME).counters().get("spillover_runs") == 1
+
+
+def test_cadence_run_matches_missed_submissions(app, monkeypatch):
+    monkeypatch.setattr(exchange_scheduler, "_last_full_match", time.monotonic())
+    get_flight(exchange_scheduler.FLIGHT_NAME).mark_dirty()
+    assert cadence_matches(monkeypatch) == [True]
+
+
+def test_leftover_orders_are_rescanned_on_the_slower_cadence(app, monkeypatch):
+    due = time.monotonic() - exchange_scheduler.RESCAN_INTERVAL_SECONDS
+    monkeypatch.setattr(exchange_scheduler, "_last_full_match", due)
+    assert cadence_matches(monkeypatch) == [True]
+    assert exchange_scheduler._last_full_match > due
@@ -0,0 +1,68 @@
+"""All-or-nothing cycle settlement with relative balance deltas."""
+from app import db
+from app.cyclic_matcher import settle_cycles
+from app.ledger import find_drift
+from app.merchant_cache import get_merchant_bpvs
+from app.models import MerchantOutbox, PointsLedger, SmartExchange, UserPoints
+from tests.conftest import make_user
+
+
+def submit(user_id, from_merchant_id, to_merchant_id, amount):
+    exchange = SmartExchange(user_id=user_id, from_merchant_id=from_merchant_id,
+                             to_merchant_id=to_merchant_id, amount=amount, status='pending')
+    db.session.add(exchange)
+    db.session.commit()
+    return exchange
+
+
+def balances():
+    return {(row.user_id, row.merchant_id): row.points for row in UserPoints.query.all()}
+
+
+def cycle(*legs):
+    bpvs = get_merchant_bpvs()
+    return [(exchange, bpvs[exchange.from_merchant_id], fill) for exchange, fill in legs]
+
+
+def test_short_leg_rejects_its_whole_cycle_only(merchants):
+    alpha, beta = merchants["alpha"], merchants["beta"]
+    ann = make_user("ann", {alpha: 500})
+    bob = make_user("bob", {beta: 50})  # Short of the 100 his order promises
+    cat = make_user("cat", {alpha: 500})
+    dan = make_user("dan", {beta: 500})
+    short = [submit(ann, alpha, beta, 100), submit(bob, beta, alpha, 100)]
+    funded = [submit(cat, alpha, beta, 100), submit(dan, beta, alpha, 100)]
+    before, ledger_rows = balances(), PointsLedger.query.count()
+
+    stats = settle_cycles([cycle((short[0], 100), (short[1], 100)), cycle((funded[0], 100), (funded[1], 100))])
+
+    assert stats["cycles"] == 1 and stats["rejected"] == 1
+    after = balances()
+    # Rejected cycle: no balance, order, ledger or outbox change for either of its users
+    for key in ((ann, alpha), (ann, beta), (bob, alpha), (bob, beta)):
+        assert after.get(key) == before.get(key)
+    assert [(o.status, o.amount) for o in (db.session.get(SmartExchange, e.id) for e in short)] == [('pending', 100)] * 2
+    assert PointsLedger.query.filter(PointsLedger.user_id.in_((ann, bob))).count() == 2  # Opening balances only
+    assert MerchantOutbox.query.filter(MerchantOutbox.user_id.in_((ann, bob))).count() == 0
+
+    # The funded cycle still settled
+    bpv = get_merchant_bpvs()[alpha]
+    assert after[(cat, alpha)] == 400 and after[(cat, beta)] == int(100 * bpv)
+    assert after[(dan, beta)] == 400 and after[(dan, alpha)] == int(100 * get_merchant_bpvs()[beta])
+    assert {db.session.get(SmartExchange, e.id).status for e in funded} == {'completed'}
+    assert PointsLedger.query.count() == ledger_rows + 4
+    assert find_drift() == []
+
+
+def test_settlement_adds_to_balances_changed_since_they_were_read(merchants):
+    alpha, beta = merchants["alpha"], merchants["beta"]
+    ann, bob = make_user("ann", {alpha: 500}), make_user("bob", {beta: 500})
+    legs = cycle((submit(ann, alpha, beta, 100), 100), (submit(bob, beta, alpha, 100), 100))
+
+    # A concurrent instant exchange moves Ann's balance after the matcher read it
+    db.session.execute(db.update(UserPoints).where(UserPoints.user_id == ann, UserPoints.merchant_id == alpha)
+                       .values(points=UserPoints.points + 25))
+    db.session.commit()
+
+    settle_cycles([legs])
+    assert balances()[(ann, alpha)] == 425  # 500 + 25 - 100: the concurrent change is kept
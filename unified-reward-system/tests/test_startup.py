@@ -0,0 +1,39 @@
+"""Cold start budget: importing the app and ``create_app()`` in a fresh interpreter."""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Median import + create_app() time allowed, over STARTUP_RUNS fresh interpreters
+STARTUP_BUDGET_MS = float(os.environ.get("STARTUP_BUDGET_MS", 1500))
+STARTUP_RUNS = 3
+# Loaded on first use only: Celery when a task is enqueued, requests on the first merchant call, CORS on the first request
+LAZY_MODULES = ("celery", "kombu", "requests", "urllib3", "flask_cors")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+app.create_app()
+print(json.dumps({
+    "startup_ms": (time.perf_counter() - started) * 1000,
+    "loaded": [name for name in %r if name in sys.modules],
+}))
+""" % (LAZY_MODULES,)
+
+
+def probe(tmp_path):
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{tmp_path / 'startup.db'}", "LOG_LEVEL": "WARNING"}
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_create_app_defers_optional_modules(tmp_path):
+    assert probe(tmp_path)["loaded"] == []
+
+
+def test_startup_within_budget(tmp_path):
+    samples = sorted(probe(tmp_path)["startup_ms"] for _ in range(STARTUP_RUNS))
+    median = samples[len(samples) // 2]
+    assert median <= STARTUP_BUDGET_MS, f"import + create_app() took {median:.0f}ms, budget {STARTUP_BUDGET_MS:.0f}ms"
@@ -0,0 +1,5 @@
+# Celery worker entry point: celery -A worker worker --loglevel=info (from the unified-reward-system directory)
+from app import get_app, get_celery
+
+celery = get_celery(get_app())  # ✅ Tasks run in the worker's one cached app, one context per task
+from app import tasks  # ✅ Registers the tasks with this Celery app